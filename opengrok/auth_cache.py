@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+In-process caches shared by the OpenGrok LDAP authentication services
+- Bounded LRU cache with per-entry expiry and hit/miss counters
+- Stale-while-revalidate cache for directory lookups (uid -> DN, cn, mail)
+- Credential verification cache that never stores plaintext passwords
+- Negative-result cache and single-flight coalescing for login attempts
+"""
+
+import hashlib
+import hmac
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def token_digest(value):
+    """Return a short, fixed-size cache key for a cookie or token value"""
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return hashlib.blake2b(value, digest_size=16).digest()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire at an absolute timestamp.
+    The least recently used entry is evicted once maxsize is reached.
+    on_lookup(hit), if given, is called after every get() with whether it was a hit; peek() is not counted.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, on_lookup=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_lookup = on_lookup
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        now = time.time()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] is not None and now >= entry[0]:
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._data.move_to_end(key)
+                self.hits += 1
+        if self.on_lookup is not None:
+            self.on_lookup(entry is not None)
+        return default if entry is None else entry[1]
+
+    def peek(self, key, default=None):
+        """Like get, but not counted as a lookup and without refreshing the entry's LRU position"""
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or (entry[0] is not None and time.time() >= entry[0]):
+            return default
+        return entry[1]
+
+    def set(self, key, value, expires_at=None):
+        """Store value under key until expires_at (defaults to now + ttl)"""
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache and return its value"""
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self):
+        """Drop every entry (counters are kept)"""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """Return size and hit/miss counters for health/metrics output"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class RefreshingCache:
+    """
+    Read-through cache around a loader function.
+    Entries are fresh for ttl seconds; for a further stale_ttl seconds they are still
+    served while a background thread reloads them. Loader results of None are not cached.
+    """
+
+    def __init__(self, loader, ttl=3600, stale_ttl=86400, maxsize=10000, on_lookup=None):
+        self.loader = loader
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.stale_hits = 0
+        self.refreshes = 0
+        self._cache = TTLCache(maxsize=maxsize, on_lookup=on_lookup)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the value for key, loading it synchronously on a miss"""
+        entry = self._cache.get(key)
+        if entry is None:
+            return self.load(key)
+        value, fresh_until = entry
+        if time.time() >= fresh_until:
+            self.stale_hits += 1
+            self._refresh_async(key)
+        return value
+
+    def get_nowait(self, key):
+        """Like get, but a miss returns None and loads the value in the background instead of waiting"""
+        entry = self._cache.get(key)
+        if entry is None:
+            self._refresh_async(key)
+            return None
+        value, fresh_until = entry
+        if time.time() >= fresh_until:
+            self.stale_hits += 1
+            self._refresh_async(key)
+        return value
+
+    def load(self, key):
+        """Call the loader and store its result; exceptions propagate to the caller"""
+        value = self.loader(key)
+        if value is None:
+            self._cache.pop(key)
+        else:
+            self.put(key, value)
+        return value
+
+    def peek(self, key):
+        """Return the cached value for key, fresh or stale, without loading it or counting a lookup"""
+        entry = self._cache.peek(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, value, loaded_at=None):
+        """Store value as loaded at loaded_at (default now), e.g. an older value restored from disk"""
+        loaded_at = time.time() if loaded_at is None else loaded_at
+        expires_at = loaded_at + self.ttl + self.stale_ttl
+        if expires_at > time.time():
+            self._cache.set(key, (value, loaded_at + self.ttl), expires_at=expires_at)
+
+    def invalidate(self, key):
+        self._cache.pop(key)
+
+    def revalidate(self, key, min_age):
+        """Reload key in the background if its entry was loaded more than min_age seconds ago"""
+        entry = self._cache.peek(key)
+        if entry is not None and time.time() - (entry[1] - self.ttl) < min_age:
+            return False
+        self._refresh_async(key)
+        return True
+
+    def _refresh_async(self, key):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+        threading.Thread(target=self._refresh, args=(key,), daemon=True).start()
+
+    def _refresh(self, key):
+        try:
+            self.load(key)
+            self.refreshes += 1
+        except Exception as e:
+            # Keep serving the stale entry; the next stale hit retries
+            logger.warning(f"Background refresh of {key!r} failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def stats(self):
+        stats = self._cache.stats()
+        stats.update(stale_hits=self.stale_hits, refreshes=self.refreshes)
+        return stats
+
+
+class CredentialCache:
+    """
+    Short-lived cache of successful username/password verifications.
+    Only a PBKDF2 digest of the password, salted per process and per user, is kept.
+    """
+
+    def __init__(self, ttl=60, maxsize=1024, iterations=10000, on_lookup=None):
+        self.iterations = iterations
+        self.on_lookup = on_lookup
+        self.hits = 0
+        self.misses = 0
+        self._salt = secrets.token_bytes(16)
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def _digest(self, username, password):
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                   self._salt + username.encode('utf-8'), self.iterations)
+
+    def get(self, username, password):
+        """Return the cached result if this exact username/password pair was verified recently"""
+        entry = self._cache.get(username)
+        hit = entry is not None and hmac.compare_digest(entry[0], self._digest(username, password))
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+        if self.on_lookup is not None:
+            self.on_lookup(hit)
+        return entry[1] if hit else None
+
+    def set(self, username, password, result):
+        self._cache.set(username, (self._digest(username, password), result))
+
+    def evict(self, username):
+        """Forget the cached verification for username"""
+        self._cache.pop(username)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "maxsize": self._cache.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key into one execution whose outcome all callers share"""
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+class LoginGuard:
+    """
+    Front for an authenticate(username, password) -> (success, result) function.
+    Identical attempts running at the same time share one call, and failures listed in
+    cacheable_failures are replayed for ttl seconds without calling authenticate again.
+    "User not found" is remembered per username, any other failure per username and password.
+    on_lookup(hit) is called once per attempt with whether a remembered failure was replayed.
+    """
+
+    def __init__(self, ttl=10, maxsize=4096,
+                 cacheable_failures=("User not found", "Invalid credentials"), on_lookup=None):
+        self.cacheable_failures = cacheable_failures
+        self.on_lookup = on_lookup
+        self.negative_hits = 0
+        self._key = secrets.token_bytes(32)
+        self._failures = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._flight = SingleFlight()
+
+    def _password_key(self, username, password):
+        # Keyed fast hash: entries only live for seconds and the key never leaves the process
+        return hmac.new(self._key, f"{username}\0{password}".encode('utf-8'), hashlib.sha256).digest()
+
+    def call(self, authenticate, username, password):
+        password_key = self._password_key(username, password)
+        failure = self._failures.get((username, None)) or self._failures.get((username, password_key))
+        if self.on_lookup is not None:
+            self.on_lookup(failure is not None)
+        if failure is not None:
+            self.negative_hits += 1
+            return False, failure
+
+        success, result = self._flight.do((username, password_key), authenticate, username, password)
+        if not success and result in self.cacheable_failures:
+            scope = None if result == "User not found" else password_key
+            self._failures.set((username, scope), result)
+        return success, result
+
+    def stats(self):
+        return {
+            "size": len(self._failures),
+            "maxsize": self._failures.maxsize,
+            "negative_hits": self.negative_hits,
+            "coalesced": self._flight.shared
+        }
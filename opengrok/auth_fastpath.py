@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+WSGI fast path for nginx auth_request subrequests
+nginx discards the body of an auth_request response, so /auth is answered here with
+the status and X-Auth-* headers only, before Flask routing, request objects or JSON
+building get involved. Every other path falls through to the wrapped application.
+"""
+
+import logging
+
+from basic_upgrade import BASIC_AUTH_UPGRADE, basic_session, bearer_token
+from ldap_auth import LDAP_UNAVAILABLE, retry_after
+from project_access import is_allowed, session_bits
+from rate_limit import RATE_LIMITED, retry_after_header
+from session_auth import check_session, renew_session, session_cookie, session_headers
+
+logger = logging.getLogger(__name__)
+
+UNAUTHORIZED_HEADERS = [('Content-Type', 'text/plain'), ('Content-Length', '0')]
+
+
+class AuthFastPath:
+    """WSGI middleware that serves the /auth path directly from the session cache (or a Basic Auth upgrade)"""
+
+    def __init__(self, app, path='/auth'):
+        self.app = app
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path:
+            return self.app(environ, start_response)
+
+        authorization = environ.get('HTTP_AUTHORIZATION')
+        token = session_cookie(environ.get('HTTP_COOKIE', '')) or bearer_token(authorization)
+        valid = False
+        issued = []
+        if token:
+            valid, result = check_session(token)
+            if not valid:
+                logger.debug(f"Invalid session: {result}")
+        if not valid and BASIC_AUTH_UPGRADE and authorization and authorization.startswith('Basic '):
+            valid, result = basic_session(authorization, environ.get('HTTP_X_FORWARDED_FOR'),
+                                          environ.get('REMOTE_ADDR'))
+            if valid:
+                result, token = result
+                issued = session_headers(token)
+            elif result == LDAP_UNAVAILABLE:
+                start_response('503 SERVICE UNAVAILABLE', UNAUTHORIZED_HEADERS + [('Retry-After', retry_after())])
+                return [b'']
+            elif result == RATE_LIMITED:
+                start_response('429 TOO MANY REQUESTS', UNAUTHORIZED_HEADERS + [('Retry-After', retry_after_header())])
+                return [b'']
+
+        if valid:
+            if not is_allowed(session_bits(result[0]), environ.get('HTTP_X_ORIGINAL_URI')):
+                start_response('403 FORBIDDEN', UNAUTHORIZED_HEADERS)
+                return [b'']
+            if not issued:
+                renewed = renew_session(token, result[0])
+                if renewed:
+                    issued = session_headers(renewed)
+            start_response('200 OK', result[3] + issued)
+            return [b'']
+        start_response('401 UNAUTHORIZED', UNAUTHORIZED_HEADERS)
+        return [b'']
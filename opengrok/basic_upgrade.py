@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Basic Auth to session upgrade for API and script clients of the web login services
+A Basic Authorization header on /auth is verified against LDAP once and answered with
+a session token (Set-Cookie and X-Auth-Session). Later requests present the token, as
+the cookie or as "Authorization: Bearer <token>", and are verified locally. Clients that
+keep sending Basic are answered from a short-lived credential cache.
+"""
+
+import logging
+import os
+
+from auth_cache import CredentialCache
+from ldap_auth import (CREDENTIAL_CACHE_SIZE, CREDENTIAL_CACHE_TTL, LDAP_UNAVAILABLE, authenticate_ldap,
+                       parse_basic_auth)
+from metrics import cache_observer
+from rate_limit import RATE_LIMITED, check_login
+from session_auth import check_session, create_session_token
+
+logger = logging.getLogger(__name__)
+
+# Accept Basic Auth on /auth and hand out a session token; false keeps /auth cookie-only
+BASIC_AUTH_UPGRADE = os.getenv('BASIC_AUTH_UPGRADE', 'true').lower() == 'true'
+
+# Entries map a verified username/password to its session token
+credential_cache = CredentialCache(ttl=CREDENTIAL_CACHE_TTL, maxsize=CREDENTIAL_CACHE_SIZE,
+                                   on_lookup=cache_observer('credential'))
+
+
+def bearer_token(auth_header):
+    """Session token from an "Authorization: Bearer" header, or None"""
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header[7:].strip()
+    return None
+
+
+def basic_session(auth_header, forwarded_for=None, remote_addr=None):
+    """
+    Verify a Basic Authorization header and return (True, (check_session result, token))
+    or (False, reason). Only a username/password not verified within CREDENTIAL_CACHE_TTL
+    costs an LDAP bind, and only within the login rate limit for the user and client
+    (reason RATE_LIMITED otherwise); the token is the one issued at that bind.
+    """
+    username, password = parse_basic_auth(auth_header)
+    if not username or not password:
+        return False, "Invalid authorization format"
+
+    token = credential_cache.get(username, password)
+    if token is not None:
+        valid, result = check_session(token)
+        if valid:
+            return True, (result, token)
+
+    if check_login(username, forwarded_for, remote_addr):
+        return False, RATE_LIMITED
+
+    success, result = authenticate_ldap(username, password)
+    if not success:
+        if result != LDAP_UNAVAILABLE:
+            credential_cache.evict(username)
+        return False, result
+
+    token = create_session_token(result)
+    credential_cache.set(username, password, token)
+    logger.info(f"Issued session for {username} via Basic Auth")
+    valid, result = check_session(token)
+    if not valid:
+        return False, result
+    return True, (result, token)
+
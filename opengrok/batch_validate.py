@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Batch credential validation for the OpenGrok LDAP authentication services
+POST /validate/batch takes many username/password pairs and streams one NDJSON line
+per pair as soon as its bind finishes:
+- DNs for users not already known are resolved with OR-filter searches (prefetch_users)
+- User binds run concurrently on a bounded thread pool over the pooled connections
+- The whole batch shares one time budget; pairs still running when it ends report "timeout"
+- Each pair spends a token from its user's login rate limit bucket; pairs over it report "rate_limited"
+"""
+
+import contextvars
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+
+from ldap_auth import (LDAP_SERVERS, LDAP_UNAVAILABLE, LDAP_USER_POOL_SIZE, UNAVAILABLE_ERRORS, authenticate_ldap,
+                       json_default, prefetch_users)
+from rate_limit import RATE_LIMITED, check_login
+
+logger = logging.getLogger(__name__)
+
+VALIDATE_BATCH_MAX = int(os.getenv('VALIDATE_BATCH_MAX', '100'))
+VALIDATE_BATCH_TIMEOUT = float(os.getenv('VALIDATE_BATCH_TIMEOUT', '10'))
+# More concurrent binds than user connections would only queue on the pool
+VALIDATE_BATCH_CONCURRENCY = int(os.getenv('VALIDATE_BATCH_CONCURRENCY',
+                                           str(LDAP_USER_POOL_SIZE * len(LDAP_SERVERS))))
+BATCH_TIMEOUT = "Timed out"
+NDJSON = 'application/x-ndjson'
+
+batch_executor = ThreadPoolExecutor(max_workers=VALIDATE_BATCH_CONCURRENCY, thread_name_prefix='ldap-batch')
+
+
+def parse_batch(data):
+    """
+    (credentials, timeout) from a request body {"credentials": [{"username", "password"}, ...],
+    "timeout": seconds}; raises ValueError with a message for the 400 response
+    """
+    items = data.get('credentials') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        raise ValueError("credentials must be a non-empty list of {username, password}")
+    if len(items) > VALIDATE_BATCH_MAX:
+        raise ValueError(f"At most {VALIDATE_BATCH_MAX} credentials per batch")
+    credentials = []
+    for item in items:
+        if not isinstance(item, dict) or not item.get('username') or not item.get('password'):
+            raise ValueError("Username and password required for every item")
+        credentials.append((str(item['username']), str(item['password'])))
+    try:
+        timeout = min(float(data.get('timeout', VALIDATE_BATCH_TIMEOUT)), VALIDATE_BATCH_TIMEOUT)
+    except (TypeError, ValueError):
+        raise ValueError("timeout must be a number of seconds")
+    return credentials, timeout
+
+
+def authenticate_batch(credentials, timeout):
+    """Yield (index, success, result) for each (username, password) as it finishes, within timeout seconds"""
+    deadline = time.monotonic() + timeout
+    allowed = []
+    for index, (username, password) in enumerate(credentials):
+        if check_login(username):
+            yield index, False, RATE_LIMITED
+        else:
+            allowed.append((index, username, password))
+    if not allowed:
+        return
+
+    try:
+        known = prefetch_users({username for _, username, _ in allowed})
+    except UNAVAILABLE_ERRORS as e:
+        logger.error(f"LDAP unavailable: {e}")
+        for index, _, _ in allowed:
+            yield index, False, LDAP_UNAVAILABLE
+        return
+    except Exception as e:
+        # Fall back to resolving each user on its own
+        logger.warning(f"Batch user lookup failed: {e}")
+        known = {username for _, username, _ in allowed}
+
+    pending = {}
+    for index, username, password in allowed:
+        if username not in known:
+            yield index, False, "User not found"
+            continue
+        # Copy the context so the request's trace sees the binds
+        future = batch_executor.submit(contextvars.copy_context().run, authenticate_ldap, username, password)
+        pending[future] = index
+
+    try:
+        for future in as_completed(pending, timeout=max(0.0, deadline - time.monotonic())):
+            yield (pending.pop(future),) + future.result()
+    except TimeoutError:
+        # Binds keep running (bounded by LDAP_BIND_TIMEOUT); only their results are dropped
+        for future, index in pending.items():
+            yield (index,) + (future.result() if future.done() else (False, BATCH_TIMEOUT))
+
+
+def batch_lines(credentials, timeout):
+    """NDJSON lines for authenticate_batch, followed by a summary line"""
+    start = time.monotonic()
+    counts = {"valid": 0, "invalid": 0, "unavailable": 0, "timeout": 0, "rate_limited": 0}
+    for index, success, result in authenticate_batch(credentials, timeout):
+        line = {"index": index, "user": credentials[index][0]}
+        if success:
+            line.update(status="valid", result=result)
+        elif result == LDAP_UNAVAILABLE:
+            line.update(status="unavailable", error=result)
+        elif result == BATCH_TIMEOUT:
+            line.update(status="timeout", error=result)
+        elif result == RATE_LIMITED:
+            line.update(status="rate_limited", error=result)
+        else:
+            line.update(status="invalid", error=result)
+        counts[line["status"]] += 1
+        yield json.dumps(line, default=json_default) + '\n'
+    yield json.dumps({"done": True, **counts, "elapsed_ms": round((time.monotonic() - start) * 1000, 1)}) + '\n'
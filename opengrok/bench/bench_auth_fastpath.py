@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /auth through the Flask route vs. the AuthFastPath WSGI middleware
+Calls both WSGI callables in-process with a valid session cookie and reports
+requests/sec and peak memory allocated per request (tracemalloc).
+No LDAP server is contacted - /auth only verifies the session cookie.
+
+Usage: python bench/bench_auth_fastpath.py [--requests 20000]
+"""
+
+import argparse
+import importlib.util
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, SERVICE_DIR)
+
+
+def load_service(filename):
+    spec = importlib.util.spec_from_file_location('ldap_auth_service_v2', os.path.join(SERVICE_DIR, filename))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def make_environ(cookie):
+    return {
+        'REQUEST_METHOD': 'GET',
+        'SCRIPT_NAME': '',
+        'PATH_INFO': '/auth',
+        'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost',
+        'SERVER_PORT': '8000',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_HOST': 'localhost:8000',
+        'HTTP_COOKIE': cookie,
+        'HTTP_X_ORIGINAL_URI': '/source/xref/project/README.md',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(b''),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False
+    }
+
+
+def call(wsgi_app, environ):
+    status = []
+    body = wsgi_app(dict(environ), lambda s, h, exc_info=None: status.append(s))
+    for _ in body:
+        pass
+    if hasattr(body, 'close'):
+        body.close()
+    return status[0]
+
+
+def bench(name, wsgi_app, environ, requests):
+    assert call(wsgi_app, environ).startswith('200'), f"{name}: /auth did not return 200"
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        call(wsgi_app, environ)
+    elapsed = time.perf_counter() - start
+
+    samples = min(requests, 2000)
+    tracemalloc.start()
+    peak_total = 0
+    for _ in range(samples):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        call(wsgi_app, environ)
+        peak_total += tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+
+    result = {"rps": requests / elapsed, "us": elapsed / requests * 1e6, "bytes": peak_total / samples}
+    print(f"{name:<12} {result['rps']:>10.0f} req/s {result['us']:>8.1f} us/req {result['bytes']:>9.0f} B/req")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--service', default='ldap-auth-service-v2.py')
+    args = parser.parse_args()
+
+    service = load_service(args.service)
+    token = service.create_session_token({
+        'username': 'benchuser',
+        'cn': '벤치 사용자',
+        'dn': 'uid=benchuser,ou=개발팀,ou=users,dc=roboetech,dc=com'
+    })
+    environ = make_environ(f"{service.COOKIE_NAME}={token}; _ga=GA1.2.123456789.1700000000")
+
+    # Flask's own wsgi_app, bypassing the middleware installed on the instance
+    flask_route = type(service.app).wsgi_app.__get__(service.app)
+    fast_path = service.AuthFastPath(flask_route)
+
+    print(f"/auth x {args.requests} (session cache warm)")
+    flask = bench('flask-route', flask_route, environ, args.requests)
+    fast = bench('fast-path', fast_path, environ, args.requests)
+    print(f"speedup {fast['rps'] / flask['rps']:.1f}x, "
+          f"allocation {flask['bytes'] / max(fast['bytes'], 1):.1f}x smaller peak per request")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+Minimal LDAPv3 server for benchmarks and offline development
+Speaks enough of the protocol (BER over TCP) for the auth services' python-ldap calls:
+simple bind, search with and/or/not/equality/range/presence filters, Who am I? and unbind.
+Serves a generated directory of users with configurable per-operation latency and
+injected failures, and counts every operation it answers.
+
+Usage: python bench/fake_ldap_server.py [--port 3389] [--users 1000] [--latency-ms 2]
+Users are uid=user0000..., all with the password "password"; the service account is
+cn=admin,dc=roboetech,dc=com / admin. Groups cn=team0... (groupOfNames) each hold
+every user whose number modulo the group count is the group's number.
+"""
+
+import argparse
+import collections
+import random
+import socket
+import socketserver
+import threading
+import time
+
+BASE_DN = 'dc=roboetech,dc=com'
+USER_BASE = 'ou=users,' + BASE_DN
+GROUP_BASE = 'ou=groups,' + BASE_DN
+ADMIN_DN = 'cn=admin,' + BASE_DN
+ADMIN_PASSWORD = 'admin'
+USER_PASSWORD = 'password'
+WHOAMI_OID = b'1.3.6.1.4.1.4203.1.11.3'
+
+# resultCode values
+SUCCESS = 0
+BUSY = 51
+INVALID_CREDENTIALS = 49
+PROTOCOL_ERROR = 2
+
+# BER tags
+SEQUENCE = 0x30
+INTEGER = 0x02
+OCTET_STRING = 0x04
+ENUMERATED = 0x0a
+SET = 0x31
+BIND_REQUEST = 0x60
+BIND_RESPONSE = 0x61
+UNBIND_REQUEST = 0x42
+SEARCH_REQUEST = 0x63
+SEARCH_ENTRY = 0x64
+SEARCH_DONE = 0x65
+ABANDON_REQUEST = 0x50
+EXTENDED_REQUEST = 0x77
+EXTENDED_RESPONSE = 0x78
+
+OPERATION_NAMES = {BIND_REQUEST: 'bind', SEARCH_REQUEST: 'search', EXTENDED_REQUEST: 'extended',
+                   UNBIND_REQUEST: 'unbind', ABANDON_REQUEST: 'abandon'}
+
+
+def ber_length(length):
+    if length < 0x80:
+        return bytes([length])
+    encoded = length.to_bytes((length.bit_length() + 7) // 8, 'big')
+    return bytes([0x80 | len(encoded)]) + encoded
+
+
+def ber(tag, *parts):
+    content = b''.join(parts)
+    return bytes([tag]) + ber_length(len(content)) + content
+
+
+def ber_int(value, tag=INTEGER):
+    return ber(tag, value.to_bytes(max(1, (value.bit_length() + 8) // 8), 'big', signed=True))
+
+
+def ber_str(value, tag=OCTET_STRING):
+    return ber(tag, value.encode('utf-8') if isinstance(value, str) else value)
+
+
+def ber_parse(data):
+    """Split BER data into a list of (tag, content) pairs"""
+    items = []
+    i = 0
+    while i < len(data):
+        tag = data[i]
+        length = data[i + 1]
+        i += 2
+        if length & 0x80:
+            size = length & 0x7f
+            length = int.from_bytes(data[i:i + size], 'big')
+            i += size
+        items.append((tag, data[i:i + length]))
+        i += length
+    return items
+
+
+def ldap_result(code, message=''):
+    return ber_int(code, ENUMERATED) + ber_str('') + ber_str(message)
+
+
+class Directory:
+    """Generated user entries, keyed by lower-cased DN, all stamped with the start time as modifyTimestamp"""
+
+    def __init__(self, users=1000, groups=4):
+        modified = time.strftime('%Y%m%d%H%M%SZ', time.gmtime()).encode()
+        self.entries = {}
+        self.passwords = {ADMIN_DN.lower(): ADMIN_PASSWORD}
+        for n in range(users):
+            uid = f"user{n:04d}"
+            dn = f"uid={uid},{USER_BASE}"
+            self.entries[dn.lower()] = (dn, {
+                'objectclass': [b'person', b'inetOrgPerson'],
+                'uid': [uid.encode()],
+                'cn': [f"Bench User {n}".encode()],
+                'mail': [f"{uid}@roboetech.com".encode()],
+                'modifytimestamp': [modified]
+            })
+            self.passwords[dn.lower()] = USER_PASSWORD
+        for g in range(groups):
+            dn = f"cn=team{g},{GROUP_BASE}"
+            self.entries[dn.lower()] = (dn, {
+                'objectclass': [b'groupOfNames'],
+                'cn': [f"team{g}".encode()],
+                'member': [f"uid=user{n:04d},{USER_BASE}".encode() for n in range(g, users, groups)],
+                'modifytimestamp': [modified]
+            })
+
+    def search(self, base, scope, filter_):
+        base = base.lower()
+        # Fast path for the services' (&(objectClass=person)(uid=...)) lookups
+        uid = _filter_uid(filter_)
+        if uid is not None:
+            entry = self.entries.get(f"uid={uid},{USER_BASE}".lower())
+            candidates = [entry] if entry else []
+        else:
+            candidates = self.entries.values()
+        # Base scope only matches the base entry itself; one-level is treated like subtree
+        return [(dn, attrs) for dn, attrs in candidates
+                if (dn.lower() == base if scope == 0 else dn.lower().endswith(base)) and _matches(filter_, attrs)]
+
+
+def _filter_uid(filter_):
+    tag, content = filter_
+    if tag == 0xa3:
+        attr, value = ber_parse(content)
+        if attr[1].lower() == b'uid':
+            return value[1].decode('utf-8')
+    if tag == 0xa0:
+        for item in ber_parse(content):
+            uid = _filter_uid(item)
+            if uid is not None:
+                return uid
+    return None
+
+
+def _matches(filter_, attrs):
+    tag, content = filter_
+    if tag == 0xa0:  # and
+        return all(_matches(item, attrs) for item in ber_parse(content))
+    if tag == 0xa1:  # or
+        return any(_matches(item, attrs) for item in ber_parse(content))
+    if tag == 0xa2:  # not
+        return not _matches(ber_parse(content)[0], attrs)
+    if tag == 0xa3:  # equalityMatch
+        attr, value = ber_parse(content)
+        wanted = value[1].lower()
+        return any(v.lower() == wanted for v in attrs.get(attr[1].decode().lower(), ()))
+    if tag in (0xa5, 0xa6):  # greaterOrEqual / lessOrEqual, compared as strings like generalized time
+        attr, value = ber_parse(content)
+        values = attrs.get(attr[1].decode().lower(), ())
+        if tag == 0xa5:
+            return any(v >= value[1] for v in values)
+        return any(v <= value[1] for v in values)
+    if tag == 0x87:  # present
+        return content.decode().lower() in attrs
+    return False
+
+
+class FakeLDAPServer(socketserver.ThreadingTCPServer):
+    """
+    Threaded LDAP server. Every operation sleeps latency_ms (+/- jitter_ms); a fraction
+    error_rate is answered with BUSY and a fraction drop_rate closes the connection
+    without answering, which python-ldap reports as SERVER_DOWN.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address=('127.0.0.1', 0), users=1000, groups=4, latency_ms=0.0, jitter_ms=0.0,
+                 error_rate=0.0, drop_rate=0.0, seed=None):
+        super().__init__(address, LDAPHandler)
+        self.directory = Directory(users, groups)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.connections = 0
+        self._sockets = set()
+        self._ops = collections.Counter()
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"ldap://{host}:{port}"
+
+    def count(self, name):
+        with self._lock:
+            self._ops[name] += 1
+
+    def operations(self):
+        with self._lock:
+            return dict(self._ops, connections=self.connections)
+
+    def delay(self):
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay += self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def fault(self):
+        """None, 'error' or 'drop' for the next operation"""
+        roll = self.random.random()
+        if roll < self.drop_rate:
+            return 'drop'
+        if roll < self.drop_rate + self.error_rate:
+            return 'error'
+        return None
+
+    def start(self):
+        """Serve on a daemon thread and return self"""
+        threading.Thread(target=self.serve_forever, name='fake-ldap', daemon=True).start()
+        return self
+
+    def stop(self):
+        """Stop listening and cut every open connection, like a crashed server"""
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            sockets = list(self._sockets)
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class LDAPHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.server._lock:
+            self.server.connections += 1
+            self.server._sockets.add(self.request)
+        self.bound_dn = ''
+
+    def finish(self):
+        with self.server._lock:
+            self.server._sockets.discard(self.request)
+
+    def read_message(self):
+        header = self._recv(2)
+        if not header:
+            return None
+        length = header[1]
+        if length & 0x80:
+            length = int.from_bytes(self._recv(length & 0x7f), 'big')
+        return ber_parse(self._recv(length))
+
+    def _recv(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return b''
+            data += chunk
+        return data
+
+    def reply(self, message_id, *ops):
+        self.request.sendall(b''.join(ber(SEQUENCE, ber_int(message_id), op) for op in ops))
+
+    def handle(self):
+        server = self.server
+        while True:
+            try:
+                message = self.read_message()
+            except OSError:
+                return
+            if not message:
+                return
+            message_id = int.from_bytes(message[0][1], 'big')
+            tag, content = message[1]
+            server.count(OPERATION_NAMES.get(tag, hex(tag)))
+            if tag == UNBIND_REQUEST:
+                return
+            if tag == ABANDON_REQUEST:
+                continue
+
+            server.delay()
+            fault = server.fault()
+            if fault == 'drop':
+                server.count('dropped')
+                return
+            if fault == 'error':
+                server.count('errors')
+                response_tag = {BIND_REQUEST: BIND_RESPONSE, SEARCH_REQUEST: SEARCH_DONE}.get(tag, EXTENDED_RESPONSE)
+                self.reply(message_id, ber(response_tag, ldap_result(BUSY, 'injected failure')))
+                continue
+
+            if tag == BIND_REQUEST:
+                self.reply(message_id, ber(BIND_RESPONSE, ldap_result(self.bind(content))))
+            elif tag == SEARCH_REQUEST:
+                self.reply(message_id, *self.search(content))
+            elif tag == EXTENDED_REQUEST:
+                self.reply(message_id, self.extended(content))
+            else:
+                self.reply(message_id, ber(EXTENDED_RESPONSE, ldap_result(PROTOCOL_ERROR)))
+
+    def bind(self, content):
+        _, (_, name), (auth_tag, password) = ber_parse(content)[:3]
+        dn = name.decode('utf-8')
+        if not dn and not password:
+            self.bound_dn = ''
+            return SUCCESS
+        if auth_tag != 0x80 or self.server.directory.passwords.get(dn.lower()) != password.decode('utf-8'):
+            return INVALID_CREDENTIALS
+        self.bound_dn = dn
+        return SUCCESS
+
+    def search(self, content):
+        fields = ber_parse(content)
+        base = fields[0][1].decode('utf-8')
+        scope = int.from_bytes(fields[1][1], 'big')
+        requested = {value.decode().lower() for _, value in ber_parse(fields[7][1])} if len(fields) > 7 else set()
+        entries = []
+        for dn, attrs in self.server.directory.search(base, scope, fields[6]):
+            returned = [ber(SEQUENCE, ber_str(name), ber(SET, *(ber_str(v) for v in values)))
+                        for name, values in attrs.items() if not requested or name in requested]
+            entries.append(ber(SEARCH_ENTRY, ber_str(dn), ber(SEQUENCE, *returned)))
+        return entries + [ber(SEARCH_DONE, ldap_result(SUCCESS))]
+
+    def extended(self, content):
+        name = ber_parse(content)[0][1]
+        if name != WHOAMI_OID:
+            return ber(EXTENDED_RESPONSE, ldap_result(PROTOCOL_ERROR, 'unsupported extended operation'))
+        authzid = f"dn:{self.bound_dn}" if self.bound_dn else ''
+        return ber(EXTENDED_RESPONSE, ldap_result(SUCCESS), ber_str(authzid, 0x8b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=3389)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--groups', type=int, default=4)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--drop-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeLDAPServer((args.host, args.port), users=args.users, groups=args.groups,
+                            latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                            drop_rate=args.drop_rate)
+    print(f"Fake LDAP server on {server.url} with {args.users} users")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"operations: {server.operations()}")
+
+
+if __name__ == '__main__':
+    main()
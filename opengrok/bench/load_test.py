@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+Load test: one service version under gunicorn against the in-process fake LDAP server
+Drives a weighted mix of /auth subrequests, /login POSTs, /validate calls and /health
+probes from concurrent keep-alive clients, then reports throughput, p50/p95/p99 latency
+and LDAP operations per request. Runs fully offline on 127.0.0.1.
+The "basic" kind is a scripted API client: /auth with Basic Auth, sending back the
+session cookie it was given (unless --no-cookie-jar).
+The login rate limiter is off unless --rate-limit, since every client shares 127.0.0.1.
+
+Usage: python bench/load_test.py [--service ldap-auth-service-v2.py] [--duration 20]
+       [--concurrency 16] [--mix auth=85,login=3,validate=7,health=5] [--latency-ms 2]
+       [--save-baseline bench/baseline-v2.json] [--baseline bench/baseline-v2.json]
+       [--replicas 3 --kill-replica-after 5] [--mix basic=100 --users 10] [--rate-limit]
+"""
+
+import argparse
+import base64
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SERVICE_DIR = os.path.dirname(HERE)
+sys.path.insert(0, HERE)
+
+from fake_ldap_server import ADMIN_DN, ADMIN_PASSWORD, USER_BASE, USER_PASSWORD, FakeLDAPServer  # noqa: E402
+
+DEFAULT_MIX = 'auth=85,login=3,validate=7,health=5'
+# v1 (Basic Auth) has no login page
+V1_SERVICE = 'ldap-auth-service.py'
+LDAP_OPERATIONS = ('bind', 'search', 'extended', 'unbind')
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(','):
+        name, _, weight = part.partition('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def start_service(args, ldap_urls, port, metrics_dir):
+    env = dict(os.environ,
+               LDAP_SERVER=','.join(ldap_urls),
+               LDAP_USER_BASE=USER_BASE,
+               LDAP_BIND_DN=ADMIN_DN,
+               LDAP_BIND_PASSWORD=ADMIN_PASSWORD,
+               JWT_SECRET='load-test-secret',
+               RATE_LIMIT='true' if args.rate_limit else 'false',
+               PROMETHEUS_MULTIPROC_DIR=metrics_dir)
+    command = [sys.executable, '-m', 'gunicorn', '--bind', f"127.0.0.1:{port}", '--workers', str(args.workers),
+               '--preload', '--log-level', 'warning']
+    if 'async' in args.service:
+        command += ['-k', 'uvicorn.workers.UvicornWorker']
+    command.append(os.path.splitext(args.service)[0] + ':app')
+    # Service logs every login at INFO; keep them out of the report
+    return subprocess.Popen(command, cwd=SERVICE_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+
+
+def wait_ready(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            conn.request('GET', '/health/ready')
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"Service on port {port} did not become ready within {timeout}s")
+
+
+class Client:
+    """One keep-alive HTTP connection issuing requests of the configured mix"""
+
+    def __init__(self, port, args, sessions, seed):
+        self.port = port
+        self.args = args
+        self.sessions = sessions
+        self.random = random.Random(seed)
+        self.conn = None
+        self.cookies = {}
+        self.set_cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        """Return (status, seconds); reconnects once if the server closed the connection"""
+        for attempt in (1, 2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            start = time.perf_counter()
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                response.read()
+                elapsed = time.perf_counter() - start
+                self.set_cookie = response.getheader('Set-Cookie')
+                if response.will_close:
+                    self.conn.close()
+                    self.conn = None
+                return response.status, elapsed
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+    def credentials(self):
+        user = f"user{self.random.randrange(self.args.users):04d}"
+        good = self.random.random() >= self.args.bad_password_rate
+        return user, USER_PASSWORD if good else 'wrong-password', good
+
+    def auth(self):
+        headers = {'X-Original-URI': '/source/xref/project/README.md'}
+        if self.args.service == V1_SERVICE:
+            user, password, good = self.credentials()
+            headers['Authorization'] = 'Basic ' + base64.b64encode(f"{user}:{password}".encode()).decode()
+        else:
+            headers['Cookie'] = self.random.choice(self.sessions)
+            good = True
+        status, elapsed = self.request('GET', '/auth', headers=headers)
+        return status == (200 if good else 401), elapsed
+
+    def basic(self):
+        user, password, good = self.credentials()
+        headers = {'X-Original-URI': '/source/xref/project/README.md',
+                   'Authorization': 'Basic ' + base64.b64encode(f"{user}:{password}".encode()).decode()}
+        if user in self.cookies and good:
+            headers['Cookie'] = self.cookies[user]
+        status, elapsed = self.request('GET', '/auth', headers=headers)
+        if self.set_cookie and not self.args.no_cookie_jar:
+            self.cookies[user] = self.set_cookie.split(';', 1)[0]
+        return status == (200 if good else 401), elapsed
+
+    def login(self):
+        user, password, good = self.credentials()
+        body = urllib.parse.urlencode({'username': user, 'password': password})
+        status, elapsed = self.request('POST', '/login?redirect=/', body=body,
+                                       headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        return status == (302 if good else 200), elapsed
+
+    def validate(self):
+        user, password, good = self.credentials()
+        body = json.dumps({'username': user, 'password': password})
+        status, elapsed = self.request('POST', '/validate', body=body, headers={'Content-Type': 'application/json'})
+        return status == (200 if good else 401), elapsed
+
+    def health(self):
+        status, elapsed = self.request('GET', '/health')
+        return status == 200, elapsed
+
+
+def login_sessions(port, count):
+    """Log in count distinct users and return their session Cookie headers"""
+    sessions = []
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    for n in range(count):
+        body = urllib.parse.urlencode({'username': f"user{n:04d}", 'password': USER_PASSWORD})
+        conn.request('POST', '/login', body=body, headers={'Content-Type': 'application/x-www-form-urlencoded'})
+        response = conn.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if response.status != 302 or not cookie:
+            raise SystemExit(f"Warm-up login for user{n:04d} failed with {response.status}")
+        sessions.append(cookie.split(';', 1)[0])
+        if response.will_close:
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    conn.close()
+    return sessions
+
+
+def run_load(port, args, weights, sessions):
+    kinds = list(weights)
+    samples = {kind: [] for kind in kinds}
+    errors = {kind: 0 for kind in kinds}
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def worker(index):
+        client = Client(port, args, sessions, args.seed * 1000 + index)
+        local = {kind: [] for kind in kinds}
+        failed = {kind: 0 for kind in kinds}
+        while time.monotonic() < deadline:
+            kind = client.random.choices(kinds, weights=[weights[k] for k in kinds])[0]
+            try:
+                ok, elapsed = getattr(client, kind)()
+            except (http.client.HTTPException, OSError):
+                failed[kind] += 1
+                continue
+            local[kind].append(elapsed)
+            if not ok:
+                failed[kind] += 1
+        with lock:
+            for kind in kinds:
+                samples[kind].extend(local[kind])
+                errors[kind] += failed[kind]
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.concurrency)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples, errors, time.monotonic() - start
+
+
+def summarize(samples, errors, elapsed):
+    results = {}
+    for kind, latencies in list(samples.items()) + [('total', [x for s in samples.values() for x in s])]:
+        latencies = sorted(latencies)
+        results[kind] = {
+            "requests": len(latencies),
+            "errors": errors[kind] if kind in errors else sum(errors.values()),
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 0.99) * 1000, 3)
+        }
+    return results
+
+
+def print_report(results, ldap_ops, requests):
+    print(f"{'endpoint':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, r in results.items():
+        print(f"{kind:<10} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>9.3f} {r['p95_ms']:>9.3f} {r['p99_ms']:>9.3f}")
+    per_request = {op: round(ldap_ops.get(op, 0) / max(requests, 1), 4) for op in LDAP_OPERATIONS}
+    total = sum(ldap_ops.get(op, 0) for op in LDAP_OPERATIONS)
+    print(f"LDAP ops/request {total / max(requests, 1):.4f} {per_request} "
+          f"(connections opened: {ldap_ops.get('connections', 0)}, includes health probes)")
+    return round(total / max(requests, 1), 4)
+
+
+def compare(baseline, results, tolerance):
+    """Print the change against a saved baseline; return True if anything regressed"""
+    regressed = False
+    print(f"\nvs baseline ({baseline['service']}, {baseline['created']}):")
+    for kind, r in results.items():
+        base = baseline["results"].get(kind)
+        if not base or not base["requests"]:
+            continue
+        rps_change = (r["rps"] - base["rps"]) / base["rps"] if base["rps"] else 0.0
+        p95_change = (r["p95_ms"] - base["p95_ms"]) / base["p95_ms"] if base["p95_ms"] else 0.0
+        worse = rps_change < -tolerance or p95_change > tolerance
+        regressed |= worse
+        print(f"{kind:<10} req/s {rps_change:+7.1%}  p95 {p95_change:+7.1%}{'  REGRESSION' if worse else ''}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--service', default='ldap-auth-service-v2.py',
+                        help='ldap-auth-service.py, ldap-auth-service-v2.py or ldap-auth-service-async.py')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=20)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"weights per endpoint (default {DEFAULT_MIX})")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--sessions', type=int, default=50, help='logged-in users whose cookies /auth replays')
+    parser.add_argument('--bad-password-rate', type=float, default=0.05)
+    parser.add_argument('--no-cookie-jar', action='store_true',
+                        help='"basic" clients ignore the session cookie and send Basic Auth every time')
+    parser.add_argument('--rate-limit', action='store_true',
+                        help='keep the login rate limiter on (its 429s are counted as errors)')
+    parser.add_argument('--latency-ms', type=float, default=2.0, help='fake LDAP latency per operation')
+    parser.add_argument('--jitter-ms', type=float, default=0.5)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of LDAP operations answered BUSY')
+    parser.add_argument('--drop-rate', type=float, default=0.0, help='fraction of LDAP operations that drop the connection')
+    parser.add_argument('--replicas', type=int, default=1, help='number of fake LDAP servers')
+    parser.add_argument('--kill-replica-after', type=float, metavar='SECONDS',
+                        help='stop the first replica this long into the run to exercise failover')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--save-baseline', metavar='FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='compare against a saved baseline; exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative drop in req/s or rise in p95')
+    parser.add_argument('--verbose', action='store_true', help='show the service log')
+    args = parser.parse_args()
+
+    weights = parse_mix(args.mix)
+    if args.service == V1_SERVICE and weights.pop('login', None):
+        print("v1 has no /login; dropping it from the mix")
+
+    # Faults are off while the service starts and sessions are created
+    replicas = [FakeLDAPServer(users=args.users, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               seed=args.seed + n).start() for n in range(args.replicas)]
+    port = free_port()
+    with tempfile.TemporaryDirectory(prefix='load-test-metrics-') as metrics_dir:
+        service = start_service(args, [ldap.url for ldap in replicas], port, metrics_dir)
+        try:
+            wait_ready(port)
+            sessions = login_sessions(port, min(args.sessions, args.users)) if args.service != V1_SERVICE else []
+
+            for ldap in replicas:
+                ldap.error_rate, ldap.drop_rate = args.error_rate, args.drop_rate
+            before = [ldap.operations() for ldap in replicas]
+            if args.kill_replica_after is not None:
+                threading.Timer(args.kill_replica_after, replicas[0].stop).start()
+            print(f"{args.service} x{args.workers} workers, {args.concurrency} clients, {args.duration:g}s, "
+                  f"mix {weights}, {args.replicas} LDAP replica(s) at {args.latency_ms:g}ms")
+            samples, errors, elapsed = run_load(port, args, weights, sessions)
+            after = [ldap.operations() for ldap in replicas]
+        finally:
+            service.terminate()
+            service.wait(10)
+    for ldap in replicas:
+        ldap.stop()
+
+    results = summarize(samples, errors, elapsed)
+    ldap_ops = {}
+    for start, end in zip(before, after):
+        for op in end:
+            ldap_ops[op] = ldap_ops.get(op, 0) + end[op] - start.get(op, 0)
+    if args.replicas > 1:
+        print("LDAP ops per replica: " + ', '.join(
+            f"{ldap.url} {sum(end.get(op, 0) - start.get(op, 0) for op in LDAP_OPERATIONS)}"
+            for ldap, start, end in zip(replicas, before, after)))
+    ops_per_request = print_report(results, ldap_ops, results["total"]["requests"])
+
+    report = {
+        "service": args.service,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "config": {k: v for k, v in vars(args).items() if k not in ('save_baseline', 'baseline', 'verbose')},
+        "results": results,
+        "ldap_ops": ldap_ops,
+        "ldap_ops_per_request": ops_per_request
+    }
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.save_baseline}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+"""
+gunicorn settings read automatically from the working directory
+Keeps the Prometheus multiprocess directory consistent across worker restarts, starts
+each worker's LDAP prober at boot and saves each exiting worker's warm-start state.
+"""
+
+import glob
+import os
+import sys
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Loaded before the app (and before --preload creates any metric), so samples
+# left over from a previous run are cleared before anything writes new ones
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+    for path in glob.glob(os.path.join(PROMETHEUS_MULTIPROC_DIR, '*.db')):
+        os.remove(path)
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges (in-flight requests) from the aggregate"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    """Start the LDAP prober as soon as the worker boots instead of on its first /health request"""
+    ldap_auth = sys.modules.get('ldap_auth')
+    if ldap_auth is not None:
+        ldap_auth.ldap_prober.ensure_started()
+
+
+def worker_exit(server, worker):
+    """Merge the exiting worker's recently active users into the warm-start snapshot"""
+    ldap_auth = sys.modules.get('ldap_auth')
+    if ldap_auth is not None and ldap_auth.warm_start is not None:
+        ldap_auth.warm_start.save()
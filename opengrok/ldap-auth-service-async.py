@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Asyncio (ASGI) edition of the Enhanced LDAP Authentication Service for OpenGrok
+- Same routes and responses as ldap-auth-service-v2.py
+- /auth is answered on the event loop (session cache, then local token verification);
+  only Basic Auth upgrades for API clients and session renewals go to the LDAP thread pool
+- Blocking python-ldap calls run on a bounded thread pool, so a slow bind only delays its own login
+
+Run with: gunicorn -k uvicorn.workers.UvicornWorker ldap-auth-service-async:app
+"""
+
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+from basic_upgrade import BASIC_AUTH_UPGRADE, basic_session, bearer_token, credential_cache
+from batch_validate import NDJSON, batch_lines, parse_batch
+from ldap_auth import (LDAP_SERVER, LDAP_SERVERS, LDAP_UNAVAILABLE, LDAP_USER_BASE, LDAP_POOL_SIZE,
+                       LDAP_USER_POOL_SIZE, authenticate_ldap, json_default, ldap_breaker, ldap_prober,
+                       ldap_stats, liveness, readiness, retry_after)
+from login_page import ASSETS, ASSET_PREFIX, LOGIN_PAGE, render_login_page
+from metrics import ASGIMetricsMiddleware, render_metrics
+from project_access import ORIGINAL_URI_HEADER, is_allowed, session_bits
+from rate_limit import RATE_LIMITED, check_login, rate_limit_stats, retry_after_header
+from session_auth import (COOKIE_NAME, SESSION_MAX_AGE, SESSION_TIMEOUT_HOURS, JWT_ALGORITHM, check_session,
+                          create_session_token, renew_session, renewal_due, revocations, revoke_session,
+                          verify_session_token, session_cache, session_headers, session_keys)
+from tracing import ASGITracingMiddleware
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Threads for blocking LDAP calls; more would only queue on the connection pools (sized per replica)
+LDAP_EXECUTOR_SIZE = int(os.getenv('LDAP_EXECUTOR_SIZE',
+                                   str((LDAP_POOL_SIZE + LDAP_USER_POOL_SIZE) * len(LDAP_SERVERS))))
+ldap_executor = ThreadPoolExecutor(max_workers=LDAP_EXECUTOR_SIZE, thread_name_prefix='ldap')
+
+DEFAULT_REDIRECT = 'https://opengrok.roboetech.com'
+
+
+class Request:
+    """Minimal view of an ASGI HTTP request"""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = dict(urllib.parse.parse_qsl(scope['query_string'].decode('latin-1')))
+        self.headers = {name.decode('latin-1').lower(): value.decode('latin-1')
+                        for name, value in scope['headers']}
+        self.remote_addr = (scope.get('client') or ('',))[0]
+        self._cookies = None
+
+    @property
+    def cookies(self):
+        if self._cookies is None:
+            self._cookies = {}
+            for pair in self.headers.get('cookie', '').split(';'):
+                name, _, value = pair.strip().partition('=')
+                if name and name not in self._cookies:
+                    self._cookies[name] = value.strip('"')
+        return self._cookies
+
+    async def body(self):
+        chunks = []
+        while True:
+            message = await self.receive()
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def form(self):
+        return dict(urllib.parse.parse_qsl((await self.body()).decode('utf-8')))
+
+    async def get_json(self):
+        try:
+            return json.loads(await self.body())
+        except ValueError:
+            return None
+
+
+class Response:
+    def __init__(self, body=b'', status=200, headers=None, content_type='application/json'):
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.status = status
+        self.headers = [(b'content-type', content_type.encode('latin-1'))]
+        for name, value in dict(headers or {}).items():
+            self.headers.append((name.lower().encode('latin-1'), value.encode('latin-1')))
+
+    def set_cookie(self, name, value, max_age=None, httponly=False, secure=False, samesite=None):
+        cookie = f"{name}={value}; Path=/"
+        if max_age is not None:
+            cookie += f"; Max-Age={max_age}"
+        if max_age == 0:
+            cookie += "; Expires=Thu, 01 Jan 1970 00:00:00 GMT"
+        if secure:
+            cookie += "; Secure"
+        if httponly:
+            cookie += "; HttpOnly"
+        if samesite:
+            cookie += f"; SameSite={samesite}"
+        self.headers.append((b'set-cookie', cookie.encode('latin-1')))
+
+    async def send(self, send):
+        headers = self.headers + [(b'content-length', str(len(self.body)).encode('latin-1'))]
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class StreamingResponse(Response):
+    """Response whose body is a blocking iterator of str chunks, advanced on the LDAP thread pool"""
+
+    def __init__(self, chunks, status=200, content_type='application/json'):
+        super().__init__(b'', status=status, content_type=content_type)
+        self.chunks = chunks
+
+    async def send(self, send):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self.headers})
+        while True:
+            chunk = await run_ldap(next, self.chunks, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def jsonify(data, status=200, headers=None):
+    return Response(json.dumps(data, default=json_default), status=status, headers=headers)
+
+
+def render_login(status=200, headers=None, **context):
+    return Response(render_login_page(**context), status=status, headers=headers,
+                    content_type='text/html; charset=utf-8')
+
+
+def send_asset(request, asset):
+    """Serve a pre-rendered asset, honouring Accept-Encoding and If-None-Match"""
+    encoding, body = asset.negotiate(request.headers.get('accept-encoding'))
+    headers = dict(asset.headers(encoding))
+    content_type = headers.pop('Content-Type')
+    if asset.not_modified(request.headers.get('if-none-match'), encoding):
+        return Response(b'', status=304, headers=headers, content_type=content_type)
+    return Response(body, headers=headers, content_type=content_type)
+
+
+def redirect(location):
+    return Response(b'', status=302, headers={'Location': location}, content_type='text/html; charset=utf-8')
+
+
+async def run_ldap(func, *args):
+    """Run a blocking LDAP (or lock-taking) function on the bounded LDAP thread pool"""
+    # Carry the request's context (its trace) over to the worker thread
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(ldap_executor, context.run, func, *args)
+
+
+async def login(request):
+    """Web-based login page"""
+    if request.method == 'GET':
+        # Check if user is already logged in
+        session_token = request.cookies.get(COOKIE_NAME)
+        if session_token:
+            valid, payload = verify_session_token(session_token)
+            if valid:
+                # Already logged in, redirect to original URL or OpenGrok
+                return redirect(request.args.get('redirect', DEFAULT_REDIRECT))
+
+        # Show login form (pre-rendered)
+        return send_asset(request, LOGIN_PAGE)
+
+    # POST request - process login
+    form = await request.form()
+    username = form.get('username', '').strip()
+    password = form.get('password', '')
+
+    if not username or not password:
+        return render_login(error="사용자명과 비밀번호를 모두 입력해주세요.", username=username)
+
+    wait = check_login(username, request.headers.get('x-forwarded-for'), request.remote_addr)
+    if wait:
+        logger.warning(f"Login for {username} rejected, too many attempts")
+        return render_login(429, {'Retry-After': retry_after_header(wait)}, username=username,
+                            error="로그인 시도가 너무 많습니다. 잠시 후 다시 시도해주세요.")
+
+    # Authenticate against LDAP without blocking the event loop
+    success, result = await run_ldap(authenticate_ldap, username, password)
+
+    if success:
+        session_token = create_session_token(result)
+        redirect_url = request.args.get('redirect', DEFAULT_REDIRECT)
+        response = redirect(redirect_url)
+        response.set_cookie(COOKIE_NAME, session_token, max_age=SESSION_MAX_AGE,
+                            httponly=True, secure=True, samesite='Lax')
+        logger.info(f"Login successful for {username}, redirecting to {redirect_url}")
+        return response
+
+    if result == LDAP_UNAVAILABLE:
+        logger.warning(f"Login for {username} rejected, LDAP unavailable")
+        return render_login(503, {'Retry-After': retry_after()}, username=username,
+                            error="인증 서버에 일시적으로 연결할 수 없습니다. 잠시 후 다시 시도해주세요.")
+
+    logger.info(f"Login failed for {username}: {result}")
+    return render_login(error="로그인에 실패했습니다. 사용자명과 비밀번호를 확인해주세요.", username=username)
+
+
+async def login_asset(request):
+    """Fingerprinted login page stylesheet"""
+    asset = ASSETS.get(request.path)
+    if asset is None:
+        return jsonify({"error": "Not found"}, 404)
+    return send_asset(request, asset)
+
+
+async def logout(request):
+    """Logout: revoke the session server-side (copies of the token stop working too) and clear the cookie"""
+    session_token = request.cookies.get(COOKIE_NAME) or bearer_token(request.headers.get('authorization'))
+    if session_token:
+        # Takes the revocation store's cross-process lock and may sweep its tables
+        await run_ldap(revoke_session, session_token)
+    response = render_login(info="로그아웃되었습니다. 다시 로그인해주세요.")
+    response.set_cookie(COOKIE_NAME, '', max_age=0)
+    return response
+
+
+async def auth(request):
+    """
+    nginx auth_request endpoint - sessions are checked on the event loop; only a
+    Basic Auth upgrade (API clients) or a due renewal goes to the LDAP thread pool
+    """
+    authorization = request.headers.get('authorization')
+    session_token = request.cookies.get(COOKIE_NAME) or bearer_token(authorization)
+    issued = []
+
+    if session_token:
+        valid, result = check_session(session_token)
+    else:
+        valid, result = False, "Authentication required"
+
+    if not valid and BASIC_AUTH_UPGRADE and authorization and authorization.startswith('Basic '):
+        # Credential cache lookups hash the password, so they run off the event loop too
+        valid, result = await run_ldap(basic_session, authorization, request.headers.get('x-forwarded-for'),
+                                       request.remote_addr)
+        if valid:
+            result, session_token = result
+            issued = session_headers(session_token)
+        elif result == LDAP_UNAVAILABLE:
+            return jsonify({"error": "Authentication service unavailable"}, 503, {'Retry-After': retry_after()})
+        elif result == RATE_LIMITED:
+            return jsonify({"error": RATE_LIMITED}, 429, {'Retry-After': retry_after_header()})
+
+    if not valid:
+        logger.info(f"Invalid session: {result}")
+        return jsonify({"error": "Session invalid", "detail": result}, 401)
+
+    payload, headers, body, bare_headers = result
+    if not is_allowed(session_bits(payload), request.headers.get(ORIGINAL_URI_HEADER.lower())):
+        return jsonify({"error": "Access to this project is not allowed"}, 403)
+    if not issued and renewal_due(payload):
+        # Signing, and waiting on a renewal another thread is signing, block; keep them off the event loop
+        renewed = await run_ldap(renew_session, session_token, payload)
+        if renewed:
+            issued = session_headers(renewed)
+    return Response(body, headers={**headers, **dict(issued)})
+
+
+async def jwks(request):
+    """Public keys for verifying session cookies without calling this service"""
+    response = jsonify(session_keys.jwks())
+    response.headers.append((b'cache-control', b'public, max-age=300'))
+    return response
+
+
+async def validate(request):
+    """Alternative validation endpoint for direct credential checking"""
+    data = await request.get_json()
+
+    if not isinstance(data, dict) or 'username' not in data or 'password' not in data:
+        return jsonify({"error": "Username and password required"}, 400)
+
+    username = data['username']
+    wait = check_login(username, request.headers.get('x-forwarded-for'), request.remote_addr)
+    if wait:
+        return jsonify({"status": "rate_limited", "error": RATE_LIMITED}, 429, {'Retry-After': retry_after_header(wait)})
+    success, result = await run_ldap(authenticate_ldap, username, data['password'])
+
+    if success:
+        return jsonify({"status": "valid", "user": username, "result": result})
+    if result == LDAP_UNAVAILABLE:
+        return jsonify({"status": "unavailable", "error": result}, 503, {'Retry-After': retry_after()})
+    return jsonify({"status": "invalid", "error": result}, 401)
+
+
+async def validate_batch(request):
+    """Validate many credential pairs; one NDJSON line per pair streams back as its bind finishes"""
+    try:
+        credentials, timeout = parse_batch(await request.get_json())
+    except ValueError as e:
+        return jsonify({"error": str(e)}, 400)
+    # The batch spends one token of its client's IP bucket; every pair is checked against its user's
+    wait = check_login(None, request.headers.get('x-forwarded-for'), request.remote_addr)
+    if wait:
+        return jsonify({"error": RATE_LIMITED}, 429, {'Retry-After': retry_after_header(wait)})
+    return StreamingResponse(batch_lines(credentials, timeout), content_type=NDJSON)
+
+
+async def health(request):
+    """Health check endpoint - answered from the background LDAP prober, never binds itself"""
+    probe = ldap_prober.status()
+    if probe["status"] == "starting":
+        return jsonify({"status": "starting", "probe": probe, "circuit_breaker": ldap_breaker.stats()}, 503)
+    if probe["status"] != "healthy":
+        return jsonify({"status": "unhealthy", "error": probe["last_error"], "probe": probe,
+                        "circuit_breaker": ldap_breaker.stats()}, 500)
+    return jsonify({
+        "status": "healthy",
+        "ldap": "connected",
+        "probe": probe,
+        "session_timeout": f"{SESSION_TIMEOUT_HOURS} hours",
+        "session_cache": session_cache.stats(),
+        "credential_cache": credential_cache.stats(),
+        "rate_limit": rate_limit_stats(),
+        "revocation": revocations.stats(),
+        "signing_kid": session_keys.kid,
+        **ldap_stats()
+    })
+
+
+async def health_live(request):
+    """Liveness probe - the process is serving requests"""
+    return jsonify(liveness())
+
+
+async def health_ready(request):
+    """Readiness probe - LDAP answered a recent probe"""
+    ready, body = readiness()
+    return jsonify(body, 200 if ready else 503)
+
+
+async def metrics(request):
+    """Prometheus metrics, aggregated across gunicorn workers"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+
+async def index(request):
+    """Service info endpoint"""
+    return jsonify({
+        "service": "OpenGrok Enhanced LDAP Authentication Service (asyncio)",
+        "version": "2.0",
+        "endpoints": {
+            "/login": "Web login page",
+            "/logout": "Logout and clear session",
+            "/auth": "nginx auth_request endpoint",
+            "/validate": "direct credential validation",
+            "/validate/batch": "batch credential validation (NDJSON)",
+            "/health": "health check",
+            "/health/live": "liveness probe",
+            "/health/ready": "readiness probe",
+            "/.well-known/jwks.json": "session token verification keys",
+            "/metrics": "Prometheus metrics"
+        },
+        "ldap_server": LDAP_SERVER,
+        "user_base": LDAP_USER_BASE,
+        "session_timeout_hours": SESSION_TIMEOUT_HOURS,
+        "jwt_algorithm": JWT_ALGORITHM,
+        "ldap_threads": LDAP_EXECUTOR_SIZE
+    })
+
+
+ROUTES = {
+    '/login': (login, ('GET', 'POST')),
+    '/logout': (logout, ('GET', 'POST')),
+    '/auth': (auth, ('GET', 'POST')),
+    '/.well-known/jwks.json': (jwks, ('GET',)),
+    '/validate': (validate, ('POST',)),
+    '/validate/batch': (validate_batch, ('POST',)),
+    '/health': (health, ('GET',)),
+    '/health/live': (health_live, ('GET',)),
+    '/health/ready': (health_ready, ('GET',)),
+    '/metrics': (metrics, ('GET',)),
+    '/': (index, ('GET',))
+}
+
+
+async def application(scope, receive, send):
+    """ASGI entry point, before metrics and tracing instrumentation"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Probe from boot, so /health/ready turns ready without waiting for a first health request
+                ldap_prober.ensure_started()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                ldap_executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    route = ROUTES.get(scope['path'])
+    if route is None and scope['path'].startswith(ASSET_PREFIX):
+        route = (login_asset, ('GET',))
+    if route is None:
+        response = jsonify({"error": "Not Found"}, 404)
+    elif scope['method'] not in route[1] and not (scope['method'] == 'HEAD' and 'GET' in route[1]):
+        response = jsonify({"error": "Method Not Allowed"}, 405)
+    else:
+        request = Request(scope, receive)
+        try:
+            response = await route[0](request)
+        except Exception:
+            logger.exception(f"Unhandled error on {request.path}")
+            response = jsonify({"error": "Internal Server Error"}, 500)
+    await response.send(send)
+
+
+app = ASGIMetricsMiddleware(ASGITracingMiddleware(application))
+
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=8000)
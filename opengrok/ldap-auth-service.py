@@ -4,86 +4,28 @@ LDAP Authentication Service for OpenGrok
 Validates HTTP Basic Auth credentials against OpenLDAP server
 """
 
-from flask import Flask, request, jsonify
-import ldap
-import base64
+from flask import Flask, request, jsonify, Response
 import logging
-import os
+
+from auth_cache import CredentialCache
+from batch_validate import NDJSON, batch_lines, parse_batch
+from ldap_auth import (CREDENTIAL_CACHE_SIZE, CREDENTIAL_CACHE_TTL, LDAP_SERVER, LDAP_UNAVAILABLE, LDAP_USER_BASE,
+                       authenticate_ldap, json_default, ldap_breaker, ldap_prober, ldap_stats, liveness,
+                       parse_basic_auth, readiness, retry_after)
+from metrics import MetricsMiddleware, cache_observer, render_metrics
+from project_access import ORIGINAL_URI_HEADER, group_bitmap, is_allowed
+from rate_limit import RATE_LIMITED, check_login, rate_limit_stats, retry_after_header
+from tracing import TracingMiddleware
 
 app = Flask(__name__)
+# /validate returns LDAP attributes, whose values are bytes
+app.json.default = json_default
+app.wsgi_app = MetricsMiddleware(TracingMiddleware(app.wsgi_app))
 logging.basicConfig(level=logging.INFO)
 
-# LDAP Configuration
-LDAP_SERVER = os.getenv('LDAP_SERVER', 'ldap://openldap:389')
-LDAP_BASE_DN = os.getenv('LDAP_BASE_DN', 'dc=roboetech,dc=com')
-LDAP_USER_BASE = os.getenv('LDAP_USER_BASE', 'ou=users,dc=roboetech,dc=com')
-LDAP_GROUP_BASE = os.getenv('LDAP_GROUP_BASE', 'ou=groups,dc=roboetech,dc=com')
-LDAP_BIND_DN = os.getenv('LDAP_BIND_DN', 'cn=admin,dc=roboetech,dc=com')
-LDAP_BIND_PASSWORD = os.getenv('LDAP_BIND_PASSWORD', 'admin')
-
-def authenticate_ldap(username, password):
-    """Authenticate user against LDAP server"""
-    try:
-        # Connect to LDAP server
-        conn = ldap.initialize(LDAP_SERVER)
-        conn.protocol_version = ldap.VERSION3
-        conn.set_option(ldap.OPT_REFERRALS, 0)
-        
-        # Bind with admin credentials to search for user
-        conn.simple_bind_s(LDAP_BIND_DN, LDAP_BIND_PASSWORD)
-        
-        # Search for user
-        search_filter = f"(&(objectClass=person)(uid={username}))"
-        result = conn.search_s(LDAP_USER_BASE, ldap.SCOPE_SUBTREE, search_filter, ['cn', 'mail'])
-        
-        if not result:
-            app.logger.info(f"User {username} not found in LDAP")
-            return False, "User not found"
-            
-        user_dn = result[0][0]
-        user_attributes = result[0][1]
-        
-        app.logger.info(f"Found user: {user_dn}")
-        
-        # Try to bind as the user to verify password
-        try:
-            user_conn = ldap.initialize(LDAP_SERVER)
-            user_conn.protocol_version = ldap.VERSION3
-            user_conn.simple_bind_s(user_dn, password)
-            user_conn.unbind_s()
-            
-            app.logger.info(f"Authentication successful for {username}")
-            return True, {"username": username, "dn": user_dn, "attributes": user_attributes}
-            
-        except ldap.INVALID_CREDENTIALS:
-            app.logger.info(f"Invalid password for {username}")
-            return False, "Invalid credentials"
-            
-    except ldap.LDAPError as e:
-        app.logger.error(f"LDAP Error: {e}")
-        return False, f"LDAP Error: {e}"
-    except Exception as e:
-        app.logger.error(f"Authentication Error: {e}")
-        return False, f"Error: {e}"
-    finally:
-        try:
-            conn.unbind_s()
-        except:
-            pass
-
-def parse_basic_auth(auth_header):
-    """Parse HTTP Basic Auth header"""
-    if not auth_header or not auth_header.startswith('Basic '):
-        return None, None
-    
-    try:
-        encoded_credentials = auth_header[6:]  # Remove 'Basic '
-        decoded_credentials = base64.b64decode(encoded_credentials).decode('utf-8')
-        username, password = decoded_credentials.split(':', 1)
-        return username, password
-    except Exception as e:
-        app.logger.error(f"Error parsing auth header: {e}")
-        return None, None
+# Successful Basic Auth verifications are reused for a short time so one page load costs one LDAP round trip
+credential_cache = CredentialCache(ttl=CREDENTIAL_CACHE_TTL, maxsize=CREDENTIAL_CACHE_SIZE,
+                                   on_lookup=cache_observer('credential'))
 
 @app.route('/auth', methods=['GET', 'POST'])
 def auth():
@@ -105,10 +47,23 @@ def auth():
         app.logger.info("Invalid Authorization header format")
         return jsonify({"error": "Invalid authorization format"}), 401
     
-    # Authenticate against LDAP
-    success, result = authenticate_ldap(username, password)
+    # Authenticate against LDAP unless these credentials were verified moments ago
+    result = credential_cache.get(username, password)
+    success = result is not None
+    if not success:
+        wait = check_login(username, request.headers.get('X-Forwarded-For'), request.remote_addr)
+        if wait:
+            return jsonify({"error": RATE_LIMITED}), 429, {'Retry-After': retry_after_header(wait)}
+        success, result = authenticate_ldap(username, password)
+        if success:
+            credential_cache.set(username, password, result)
+        elif result != LDAP_UNAVAILABLE:
+            credential_cache.evict(username)
     
     if success:
+        if not is_allowed(group_bitmap(result.get('groups', ())), request.headers.get(ORIGINAL_URI_HEADER)):
+            app.logger.info(f"{username} is not allowed to read {request.headers.get(ORIGINAL_URI_HEADER)}")
+            return jsonify({"error": "Access to this project is not allowed"}), 403
         # Return 200 with user info in headers for nginx
         response = jsonify({"status": "authenticated", "user": username})
         response.headers['X-Auth-User'] = username
@@ -119,6 +74,9 @@ def auth():
             encoded_dn = urllib.parse.quote(result['dn'], safe='')
             response.headers['X-Auth-DN'] = encoded_dn
         return response, 200
+    elif result == LDAP_UNAVAILABLE:
+        # Fail fast instead of holding the request while the directory is down
+        return jsonify({"error": "Authentication service unavailable"}), 503, {'Retry-After': retry_after()}
     else:
         app.logger.info(f"Authentication failed for {username}: {result}")
         return jsonify({"error": "Authentication failed", "detail": result}), 401
@@ -136,24 +94,69 @@ def validate():
     username = data['username']
     password = data['password']
     
+    wait = check_login(username, request.headers.get('X-Forwarded-For'), request.remote_addr)
+    if wait:
+        return jsonify({"status": "rate_limited", "error": RATE_LIMITED}), 429, {'Retry-After': retry_after_header(wait)}
+    
     success, result = authenticate_ldap(username, password)
     
     if success:
         return jsonify({"status": "valid", "user": username, "result": result}), 200
+    elif result == LDAP_UNAVAILABLE:
+        return jsonify({"status": "unavailable", "error": result}), 503, {'Retry-After': retry_after()}
     else:
         return jsonify({"status": "invalid", "error": result}), 401
 
+@app.route('/validate/batch', methods=['POST'])
+def validate_batch():
+    """
+    Validate many credential pairs in one request; one NDJSON line per pair streams
+    back as its bind finishes, then a summary line
+    """
+    try:
+        credentials, timeout = parse_batch(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # The batch spends one token of its client's IP bucket; every pair is checked against its user's
+    wait = check_login(None, request.headers.get('X-Forwarded-For'), request.remote_addr)
+    if wait:
+        return jsonify({"error": RATE_LIMITED}), 429, {'Retry-After': retry_after_header(wait)}
+    return Response(batch_lines(credentials, timeout), mimetype=NDJSON)
+
 @app.route('/health', methods=['GET'])
 def health():
-    """Health check endpoint"""
-    try:
-        # Test LDAP connection
-        conn = ldap.initialize(LDAP_SERVER)
-        conn.simple_bind_s(LDAP_BIND_DN, LDAP_BIND_PASSWORD)
-        conn.unbind_s()
-        return jsonify({"status": "healthy", "ldap": "connected"}), 200
-    except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 500
+    """Health check endpoint - answered from the background LDAP prober, never binds itself"""
+    probe = ldap_prober.status()
+    if probe["status"] == "starting":
+        return jsonify({"status": "starting", "probe": probe, "circuit_breaker": ldap_breaker.stats()}), 503
+    if probe["status"] != "healthy":
+        return jsonify({"status": "unhealthy", "error": probe["last_error"], "probe": probe,
+                        "circuit_breaker": ldap_breaker.stats()}), 500
+    return jsonify({
+        "status": "healthy",
+        "ldap": "connected",
+        "probe": probe,
+        "credential_cache": credential_cache.stats(),
+        "rate_limit": rate_limit_stats(),
+        **ldap_stats()
+    }), 200
+
+@app.route('/health/live', methods=['GET'])
+def health_live():
+    """Liveness probe - the process is serving requests"""
+    return jsonify(liveness()), 200
+
+@app.route('/health/ready', methods=['GET'])
+def health_ready():
+    """Readiness probe - LDAP answered a recent probe"""
+    ready, body = readiness()
+    return jsonify(body), 200 if ready else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics, aggregated across gunicorn workers"""
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
 
 @app.route('/', methods=['GET'])
 def index():
@@ -164,11 +167,16 @@ def index():
         "endpoints": {
             "/auth": "nginx auth_request endpoint",
             "/validate": "direct credential validation",
-            "/health": "health check"
+            "/validate/batch": "batch credential validation (NDJSON)",
+            "/health": "health check",
+            "/health/live": "liveness probe",
+            "/health/ready": "readiness probe",
+            "/metrics": "Prometheus metrics"
         },
         "ldap_server": LDAP_SERVER,
         "user_base": LDAP_USER_BASE
     })
 
 if __name__ == '__main__':
+    ldap_prober.ensure_started()
     app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+LDAP credential verification shared by the OpenGrok LDAP authentication services
+(v1 Basic Auth, v2 web login and the asyncio edition)
+"""
+
+import base64
+import logging
+import math
+import os
+import re
+
+import ldap
+from ldap.filter import escape_filter_chars
+
+from auth_cache import LoginGuard, RefreshingCache
+from ldap_health import LDAPProber
+from ldap_pool import CircuitBreakerGroup, CircuitOpen, LDAPPoolGroup, PoolExhausted, ServerSelector
+from metrics import cache_observer, ldap_phase
+from project_access import ENABLED as PROJECT_ACCESS_ENABLED
+from tracing import span
+from user_directory import (GROUP_ATTRIBUTES, USER_ATTRIBUTES, GroupDirectory, MemoryIndex, SQLiteIndex,
+                            UserDirectory, paged_search)
+from warm_start import WarmStart
+
+logger = logging.getLogger(__name__)
+
+# LDAP Configuration - LDAP_SERVER may list several replicas separated by commas or spaces
+LDAP_SERVER = os.getenv('LDAP_SERVER', 'ldap://openldap:389')
+LDAP_SERVERS = [url for url in re.split(r'[,\s]+', LDAP_SERVER) if url]
+LDAP_BASE_DN = os.getenv('LDAP_BASE_DN', 'dc=roboetech,dc=com')
+LDAP_USER_BASE = os.getenv('LDAP_USER_BASE', 'ou=users,dc=roboetech,dc=com')
+LDAP_GROUP_BASE = os.getenv('LDAP_GROUP_BASE', 'ou=groups,dc=roboetech,dc=com')
+LDAP_BIND_DN = os.getenv('LDAP_BIND_DN', 'cn=admin,dc=roboetech,dc=com')
+LDAP_BIND_PASSWORD = os.getenv('LDAP_BIND_PASSWORD', 'admin')
+
+# Connection pools - admin connections stay bound for searches, user connections are re-bound per login
+LDAP_POOL_SIZE = int(os.getenv('LDAP_POOL_SIZE', '4'))
+LDAP_USER_POOL_SIZE = int(os.getenv('LDAP_USER_POOL_SIZE', '4'))
+LDAP_POOL_IDLE_TIMEOUT = int(os.getenv('LDAP_POOL_IDLE_TIMEOUT', '300'))
+
+# Timeouts (seconds) so a stalled directory fails requests instead of hanging workers
+LDAP_CONNECT_TIMEOUT = float(os.getenv('LDAP_CONNECT_TIMEOUT', '3'))
+LDAP_OPERATION_TIMEOUT = float(os.getenv('LDAP_OPERATION_TIMEOUT', '5'))
+LDAP_BIND_TIMEOUT = float(os.getenv('LDAP_BIND_TIMEOUT', '5'))
+
+# Circuit breaker per server - after this many consecutive failures of a server, skip it for
+# LDAP_BREAKER_RESET_TIMEOUT seconds; requests fail fast only while every server's breaker is open
+LDAP_BREAKER_THRESHOLD = int(os.getenv('LDAP_BREAKER_THRESHOLD', '5'))
+LDAP_BREAKER_RESET_TIMEOUT = float(os.getenv('LDAP_BREAKER_RESET_TIMEOUT', '30'))
+LDAP_BREAKER_HALF_OPEN_TRIALS = int(os.getenv('LDAP_BREAKER_HALF_OPEN_TRIALS', '1'))
+
+# A failed replica is skipped for LDAP_SERVER_BACKOFF seconds, doubling per consecutive failure
+LDAP_SERVER_BACKOFF = float(os.getenv('LDAP_SERVER_BACKOFF', '5'))
+LDAP_SERVER_MAX_BACKOFF = float(os.getenv('LDAP_SERVER_MAX_BACKOFF', '300'))
+
+ldap_servers = ServerSelector(LDAP_SERVERS, backoff=LDAP_SERVER_BACKOFF, max_backoff=LDAP_SERVER_MAX_BACKOFF)
+ldap_breaker = CircuitBreakerGroup(LDAP_SERVERS, failure_threshold=LDAP_BREAKER_THRESHOLD,
+                                   reset_timeout=LDAP_BREAKER_RESET_TIMEOUT,
+                                   half_open_trials=LDAP_BREAKER_HALF_OPEN_TRIALS)
+
+_pool_options = dict(idle_timeout=LDAP_POOL_IDLE_TIMEOUT, timer=ldap_phase,
+                     connect_timeout=LDAP_CONNECT_TIMEOUT, timeout=LDAP_OPERATION_TIMEOUT,
+                     bind_timeout=LDAP_BIND_TIMEOUT, breakers=ldap_breaker)
+# Pool sizes are per replica
+admin_pool = LDAPPoolGroup(LDAP_SERVERS, ldap_servers, bind_dn=LDAP_BIND_DN, bind_password=LDAP_BIND_PASSWORD,
+                           size=LDAP_POOL_SIZE, **_pool_options)
+user_pool = LDAPPoolGroup(LDAP_SERVERS, ldap_servers, size=LDAP_USER_POOL_SIZE, **_pool_options)
+
+# authenticate_ldap's failure result when the directory could not answer; services map it to 503
+LDAP_UNAVAILABLE = "LDAP unavailable"
+UNAVAILABLE_ERRORS = (CircuitOpen, PoolExhausted, ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.BUSY, ldap.UNAVAILABLE)
+
+# uid -> (DN, cn/mail attributes) cache; stale entries are served while refreshed in the background
+USER_CACHE_TTL = int(os.getenv('USER_CACHE_TTL', '3600'))
+USER_CACHE_STALE_TTL = int(os.getenv('USER_CACHE_STALE_TTL', '86400'))
+USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', '10000'))
+# A wrong password re-checks the cached DN in the background at most this often per user
+USER_CACHE_REVALIDATE_INTERVAL = int(os.getenv('USER_CACHE_REVALIDATE_INTERVAL', '60'))
+
+# (DN, uid) -> group cn, for logins while the group directory is not loaded (or disabled)
+GROUP_CACHE_TTL = int(os.getenv('GROUP_CACHE_TTL', '300'))
+GROUP_CACHE_STALE_TTL = int(os.getenv('GROUP_CACHE_STALE_TTL', '900'))
+
+# Recently active users are snapshotted to this file and loaded on startup (empty disables it)
+WARM_START_FILE = os.getenv('WARM_START_FILE', '')
+WARM_START_USERS = int(os.getenv('WARM_START_USERS', '5000'))
+WARM_START_MAX_AGE = int(os.getenv('WARM_START_MAX_AGE', '86400'))
+WARM_START_INTERVAL = int(os.getenv('WARM_START_INTERVAL', '300'))
+
+# Successful Basic Auth verifications are reused for a short time (v1 /auth and the v2 Basic upgrade)
+CREDENTIAL_CACHE_TTL = int(os.getenv('CREDENTIAL_CACHE_TTL', '60'))
+CREDENTIAL_CACHE_SIZE = int(os.getenv('CREDENTIAL_CACHE_SIZE', '1024'))
+
+# Failed logins are replayed for a few seconds and identical concurrent attempts share one LDAP call
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', '10'))
+NEGATIVE_CACHE_SIZE = int(os.getenv('NEGATIVE_CACHE_SIZE', '4096'))
+
+login_guard = LoginGuard(ttl=NEGATIVE_CACHE_TTL, maxsize=NEGATIVE_CACHE_SIZE,
+                         on_lookup=cache_observer('negative'))
+
+
+def lookup_user(username):
+    """Search LDAP for a user's DN and cn/mail attributes, or None if there is no such user"""
+    # Search for user on a pooled connection already bound with admin credentials
+    search_filter = f"(&(objectClass=person)(uid={escape_filter_chars(username)}))"
+
+    def search(conn):
+        with ldap_phase('search'):
+            return conn.search_s(LDAP_USER_BASE, ldap.SCOPE_SUBTREE, search_filter, ['cn', 'mail'])
+
+    result = admin_pool.run(search)
+    if not result:
+        return None
+    return result[0][0], result[0][1]
+
+
+user_cache = RefreshingCache(lookup_user, ttl=USER_CACHE_TTL, stale_ttl=USER_CACHE_STALE_TTL,
+                             maxsize=USER_CACHE_SIZE, on_lookup=cache_observer('user'))
+
+# Local replica of LDAP_USER_BASE so logins skip the admin search; a snapshot path shares it between workers
+USER_DIRECTORY_SYNC = os.getenv('USER_DIRECTORY_SYNC', 'true').lower() == 'true'
+USER_DIRECTORY_SNAPSHOT = os.getenv('USER_DIRECTORY_SNAPSHOT', '')
+USER_DIRECTORY_REFRESH_INTERVAL = int(os.getenv('USER_DIRECTORY_REFRESH_INTERVAL', '60'))
+USER_DIRECTORY_FULL_SYNC_INTERVAL = int(os.getenv('USER_DIRECTORY_FULL_SYNC_INTERVAL', '3600'))
+USER_DIRECTORY_PAGE_SIZE = int(os.getenv('USER_DIRECTORY_PAGE_SIZE', '500'))
+
+
+def search_users(filterstr):
+    """Paged search of LDAP_USER_BASE for the user directory sync"""
+    def search(conn):
+        with ldap_phase('sync'):
+            return paged_search(conn, LDAP_USER_BASE, filterstr, USER_ATTRIBUTES, USER_DIRECTORY_PAGE_SIZE)
+
+    return admin_pool.run(search)
+
+
+def search_groups(filterstr):
+    """Paged search of LDAP_GROUP_BASE for the group directory sync"""
+    def search(conn):
+        with ldap_phase('sync'):
+            return paged_search(conn, LDAP_GROUP_BASE, filterstr, GROUP_ATTRIBUTES, USER_DIRECTORY_PAGE_SIZE)
+
+    return admin_pool.run(search)
+
+
+user_directory = None
+if USER_DIRECTORY_SYNC:
+    user_directory = UserDirectory(
+        search_users, SQLiteIndex(USER_DIRECTORY_SNAPSHOT) if USER_DIRECTORY_SNAPSHOT else MemoryIndex(),
+        refresh_interval=USER_DIRECTORY_REFRESH_INTERVAL, full_sync_interval=USER_DIRECTORY_FULL_SYNC_INTERVAL,
+        on_lookup=cache_observer('directory'))
+
+# Group memberships are only needed when PROJECT_GROUPS restricts projects
+group_directory = None
+if USER_DIRECTORY_SYNC and PROJECT_ACCESS_ENABLED:
+    group_directory = GroupDirectory(search_groups, refresh_interval=USER_DIRECTORY_REFRESH_INTERVAL,
+                                     full_sync_interval=USER_DIRECTORY_FULL_SYNC_INTERVAL)
+
+
+def find_user(username):
+    """(DN, cn/mail attributes) from the local directory, else the user cache (admin search on a miss)"""
+    if user_directory is not None:
+        user = user_directory.lookup(username)
+        if user is not None:
+            return user
+    return user_cache.get(username)
+
+
+# OR-filter searches for batches are split into chunks of this many uids
+BATCH_SEARCH_CHUNK = int(os.getenv('BATCH_SEARCH_CHUNK', '50'))
+
+
+def prefetch_users(usernames):
+    """
+    Cache the DN of every user not already known locally, with one OR-filter search per
+    BATCH_SEARCH_CHUNK users instead of one search each. Returns the usernames that exist.
+    """
+    found = set()
+    missing = []
+    for username in usernames:
+        if ((user_directory is not None and user_directory.lookup(username) is not None)
+                or user_cache.peek(username) is not None):
+            found.add(username)
+        else:
+            missing.append(username)
+
+    for start in range(0, len(missing), BATCH_SEARCH_CHUNK):
+        requested = {username.lower(): username for username in missing[start:start + BATCH_SEARCH_CHUNK]}
+        uids = ''.join(f"(uid={escape_filter_chars(username)})" for username in requested.values())
+        search_filter = f"(&(objectClass=person)(|{uids}))"
+
+        def search(conn, search_filter=search_filter):
+            with ldap_phase('search'):
+                return conn.search_s(LDAP_USER_BASE, ldap.SCOPE_SUBTREE, search_filter, ['uid', 'cn', 'mail'])
+
+        for dn, attributes in admin_pool.run(search):
+            username = requested.get(attributes.get('uid', [b''])[0].decode('utf-8').lower()) if dn else None
+            if username is not None:
+                # Same shape lookup_user caches, so authenticate_ldap finds it
+                user_cache.put(username, (dn, {k: v for k, v in attributes.items() if k in ('cn', 'mail')}))
+                found.add(username)
+    return found
+
+
+def lookup_groups(user_dn, username):
+    """Search LDAP_GROUP_BASE for the cn of every group listing the user as a member"""
+    search_filter = (f"(|(member={escape_filter_chars(user_dn)})(uniqueMember={escape_filter_chars(user_dn)})"
+                     f"(memberUid={escape_filter_chars(username)}))")
+
+    def search(conn):
+        with ldap_phase('group_search'):
+            return conn.search_s(LDAP_GROUP_BASE, ldap.SCOPE_SUBTREE, search_filter, ['cn'])
+
+    return [attributes['cn'][0].decode('utf-8') for dn, attributes in admin_pool.run(search)
+            if dn and attributes.get('cn')]
+
+
+group_cache = RefreshingCache(lambda key: lookup_groups(*key), ttl=GROUP_CACHE_TTL,
+                              stale_ttl=GROUP_CACHE_STALE_TTL, maxsize=USER_CACHE_SIZE)
+
+
+def find_groups(user_dn, username):
+    """Group cn for a user from the local group directory, else the group cache (live search on a miss)"""
+    if group_directory is not None:
+        groups = group_directory.groups(user_dn, username)
+        if groups is not None:
+            return sorted(groups)
+    return sorted(group_cache.get((user_dn, username)))
+
+
+def cached_groups(user_dn, username):
+    """Like find_groups, but never waits on LDAP: None on a cache miss, which is then loaded in the background"""
+    if group_directory is not None:
+        groups = group_directory.groups(user_dn, username)
+        if groups is not None:
+            return sorted(groups)
+    groups = group_cache.get_nowait((user_dn, username))
+    return sorted(groups) if groups is not None else None
+
+
+warm_start = None
+if WARM_START_FILE:
+    warm_start = WarmStart(WARM_START_FILE, source=f"{LDAP_USER_BASE}\0{LDAP_GROUP_BASE}",
+                           max_users=WARM_START_USERS, max_age=WARM_START_MAX_AGE, interval=WARM_START_INTERVAL)
+
+
+def load_warm_start():
+    """
+    Seed the user and group caches from the warm-start snapshot, with the time each user was
+    last seen: entries past their ttl are served once and refreshed in the background
+    """
+    for username, (seen, dn, cn, mail, groups) in warm_start.load().items():
+        attributes = {name: [value.encode('utf-8')] for name, value in (('cn', cn), ('mail', mail)) if value}
+        user_cache.put(username, (dn, attributes), loaded_at=seen)
+        if groups is not None:
+            group_cache.put((dn, username), groups, loaded_at=seen)
+
+
+# Before gunicorn --preload forks, so every worker starts with the caches filled
+if warm_start is not None:
+    load_warm_start()
+
+
+def parse_basic_auth(auth_header):
+    """(username, password) from a Basic Authorization header, or (None, None)"""
+    if not auth_header or not auth_header.startswith('Basic '):
+        return None, None
+    try:
+        username, password = base64.b64decode(auth_header[6:]).decode('utf-8').split(':', 1)
+        return username, password
+    except Exception as e:
+        logger.error(f"Error parsing auth header: {e}")
+        return None, None
+
+
+def authenticate_ldap(username, password):
+    """Authenticate user against LDAP server, sharing concurrent and recently failed identical attempts"""
+    with span('authenticate'):
+        return login_guard.call(verify_ldap_credentials, username, password)
+
+
+def verify_ldap_credentials(username, password):
+    """Verify a username/password pair with a user bind against LDAP"""
+    try:
+        # Resolve the user's DN locally; only a user missing from both directory and cache costs an admin search
+        user = find_user(username)
+
+        if not user:
+            logger.info(f"User {username} not found in LDAP")
+            return False, "User not found"
+
+        user_dn, user_attributes = user
+
+        logger.info(f"Found user: {user_dn}")
+
+        # Try to bind as the user to verify password
+        try:
+            try:
+                user_pool.bind(user_dn, password)
+            except ldap.NO_SUCH_OBJECT:
+                # Cached DN no longer exists (user moved or renamed) - look it up again
+                user = user_cache.load(username)
+                if not user:
+                    logger.info(f"User {username} not found in LDAP")
+                    return False, "User not found"
+                user_dn, user_attributes = user
+                user_pool.bind(user_dn, password)
+
+            logger.info(f"Authentication successful for {username}")
+            user_info = {
+                "username": username,
+                "dn": user_dn,
+                "attributes": user_attributes,
+                "cn": user_attributes.get('cn', [b''])[0].decode('utf-8') if user_attributes.get('cn') else username
+            }
+            if PROJECT_ACCESS_ENABLED:
+                user_info["groups"] = find_groups(user_dn, username)
+            if warm_start is not None:
+                warm_start.record(username, user_dn, user_info["cn"] if user_attributes.get('cn') else '',
+                                  user_attributes['mail'][0].decode('utf-8') if user_attributes.get('mail') else '',
+                                  user_info.get("groups"))
+            return True, user_info
+
+        except ldap.INVALID_CREDENTIALS:
+            # Directories answer a bind to a vanished DN with INVALID_CREDENTIALS too, so re-check
+            # the cached DN - in the background and throttled, or password guessing costs a search each
+            user_cache.revalidate(username, USER_CACHE_REVALIDATE_INTERVAL)
+            logger.info(f"Invalid password for {username}")
+            return False, "Invalid credentials"
+
+    except UNAVAILABLE_ERRORS as e:
+        logger.error(f"LDAP unavailable: {e}")
+        return False, LDAP_UNAVAILABLE
+    except ldap.LDAPError as e:
+        logger.error(f"LDAP Error: {e}")
+        return False, f"LDAP Error: {e}"
+    except Exception as e:
+        logger.error(f"Authentication Error: {e}")
+        return False, f"Error: {e}"
+
+
+def retry_after():
+    """Retry-After value in seconds for 503 responses while LDAP is unavailable"""
+    return str(max(1, math.ceil(ldap_breaker.retry_after())))
+
+
+def json_default(value):
+    """JSON encoder fallback for LDAP attribute values, which are bytes"""
+    if isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def probe_ldap_server(server):
+    """Open a fresh connection to server and bind as the service account; raises on failure"""
+    conn = ldap.initialize(server)
+    conn.set_option(ldap.OPT_NETWORK_TIMEOUT, HEALTH_PROBE_TIMEOUT)
+    conn.set_option(ldap.OPT_TIMEOUT, HEALTH_PROBE_TIMEOUT)
+    try:
+        conn.simple_bind_s(LDAP_BIND_DN, LDAP_BIND_PASSWORD)
+    finally:
+        try:
+            conn.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+
+def check_ldap_connection():
+    """
+    Probe every replica, marking each up or down for the selector.
+    Succeeds if at least one replica answered; otherwise raises the last error.
+    """
+    error = None
+    answered = 0
+    for server in LDAP_SERVERS:
+        try:
+            probe_ldap_server(server)
+        except ldap.LDAPError as e:
+            ldap_servers.mark_down(server)
+            error = e
+        else:
+            ldap_servers.mark_up(server)
+            answered += 1
+    if not answered:
+        raise error
+
+
+# Health probing - /health answers from the prober's rolling status instead of binding per request
+HEALTH_PROBE_INTERVAL = int(os.getenv('HEALTH_PROBE_INTERVAL', '10'))
+HEALTH_PROBE_TIMEOUT = int(os.getenv('HEALTH_PROBE_TIMEOUT', '5'))
+
+ldap_prober = LDAPProber(check_ldap_connection, interval=HEALTH_PROBE_INTERVAL)
+
+
+def ldap_stats():
+    """Pool and cache counters for health output"""
+    return {
+        "pools": {"admin": admin_pool.stats(), "user": user_pool.stats()},
+        "circuit_breaker": ldap_breaker.stats(),
+        "servers": ldap_servers.stats(),
+        "user_cache": user_cache.stats(),
+        "user_directory": user_directory.stats() if user_directory is not None else None,
+        "group_directory": group_directory.stats() if group_directory is not None else None,
+        "group_cache": group_cache.stats(),
+        "warm_start": warm_start.stats() if warm_start is not None else None,
+        "login_guard": login_guard.stats()
+    }
+
+
+def liveness():
+    """Body for /health/live - the process is up; includes how fresh the LDAP status is"""
+    probe = ldap_prober.status()
+    return {
+        "status": "alive",
+        "prober_running": ldap_prober.is_running(),
+        "last_probe_age": probe["last_probe_age"]
+    }
+
+
+def readiness():
+    """(ready, body) for /health/ready - LDAP answered the last probe and it is recent"""
+    probe = ldap_prober.status()
+    ready = ldap_prober.is_ready(probe)
+    return ready, {
+        "status": "ready" if ready else "not ready",
+        "probe": probe,
+        "pools": {"admin": admin_pool.stats(), "user": user_pool.stats()},
+        "circuit_breaker": ldap_breaker.stats(),
+        "servers": ldap_servers.stats()
+    }
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Background LDAP health probing for the OpenGrok LDAP authentication services
+A daemon thread binds as the service account on a schedule and keeps a rolling window
+of results, so /health answers from memory instead of doing a live bind per request.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LDAPProber:
+    """
+    Runs probe() every interval seconds and keeps the last window results.
+    The services start the thread at worker boot; status() also starts it lazily, so
+    it runs in every process, including gunicorn workers forked from a --preload master.
+    """
+
+    def __init__(self, probe, interval=10, window=30):
+        self.probe = probe
+        self.interval = interval
+        self.stale_after = interval * 3
+        self._results = collections.deque(maxlen=window)  # (finished_at, ok, latency, error)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+    def ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ldap-prober', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.probe_once()
+            time.sleep(self.interval)
+
+    def probe_once(self):
+        start = time.monotonic()
+        try:
+            self.probe()
+            ok, error = True, None
+        except Exception as e:
+            ok, error = False, str(e)
+            logger.warning(f"LDAP health probe failed: {e}")
+        self._results.append((time.monotonic(), ok, time.monotonic() - start, error))
+
+    def status(self):
+        """Rolling probe status; never touches LDAP itself"""
+        self.ensure_started()
+        results = list(self._results)
+        if not results:
+            return {"status": "starting", "last_probe_age": None, "probes": 0}
+
+        finished_at, ok, latency, error = results[-1]
+        latencies = [r[2] for r in results if r[1]]
+        return {
+            "status": "healthy" if ok else "unhealthy",
+            "last_probe_age": round(time.monotonic() - finished_at, 3),
+            "last_latency_ms": round(latency * 1000, 2),
+            "avg_latency_ms": round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+            "max_latency_ms": round(max(latencies) * 1000, 2) if latencies else None,
+            "success_ratio": round(len(latencies) / len(results), 4),
+            "probes": len(results),
+            "last_error": error
+        }
+
+    def is_ready(self, status=None):
+        """Healthy and probed recently enough to trust"""
+        status = status or self.status()
+        return status["status"] == "healthy" and status["last_probe_age"] <= self.stale_after
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
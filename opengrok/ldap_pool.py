@@ -0,0 +1,498 @@
+#!/usr/bin/env python3
+"""
+LDAP connection pooling shared by the OpenGrok LDAP authentication services
+- Keeps connections open (and optionally bound as a service account) between requests
+- Checks idle connections for liveness before handing them out
+- Reconnects on SERVER_DOWN and reaps connections that sat idle too long
+- Bounds connect, operation and bind time, and stops calling a failing directory
+  through a circuit breaker
+- Spreads calls over several read replicas by measured latency and fails over
+  to another replica when one goes down
+"""
+
+import collections
+import contextlib
+import logging
+import random
+import threading
+import time
+
+import ldap
+
+logger = logging.getLogger(__name__)
+
+# Errors that are LDAP results rather than transport failures; the connection stays usable
+REUSABLE_ERRORS = (ldap.INVALID_CREDENTIALS, ldap.NO_SUCH_OBJECT)
+
+# Errors after which the same call is retried on another replica
+FAILOVER_ERRORS = (ldap.SERVER_DOWN, ldap.TIMEOUT, ldap.BUSY, ldap.UNAVAILABLE)
+
+
+class PoolExhausted(ldap.LDAPError):
+    """Raised when no pooled connection became free within the acquire timeout"""
+
+
+class CircuitOpen(ldap.LDAPError):
+    """Raised instead of contacting LDAP while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failed LDAP calls and rejects calls for
+    reset_timeout seconds. It then lets up to half_open_trials calls through: one success
+    closes it again, a failure re-opens it. State is per process.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_trials=1, name='LDAP'):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_trials = half_open_trials
+        self.state = self.CLOSED
+        self.failures = 0
+        self.times_opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._trials = 0
+        self._lock = threading.Lock()
+
+    def retry_after(self):
+        """Seconds until the breaker lets a trial call through (0 unless open)"""
+        if self.state != self.OPEN:
+            return 0
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Reserve a call, or raise CircuitOpen"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen({"desc": f"{self.name} circuit breaker open, retry in {self.retry_after():.0f}s"})
+                self.state = self.HALF_OPEN
+                self._trials = 0
+                logger.info(f"{self.name} circuit breaker half-open, sending trial requests")
+            if self.state == self.HALF_OPEN:
+                if self._trials >= self.half_open_trials:
+                    self.rejected += 1
+                    raise CircuitOpen({"desc": f"{self.name} circuit breaker half-open, trial request in progress"})
+                self._trials += 1
+
+    def success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info(f"{self.name} circuit breaker closed")
+            self.state = self.CLOSED
+            self.failures = 0
+            self._trials = 0
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and
+                                                self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self.times_opened += 1
+                logger.warning(f"{self.name} circuit breaker opened after {self.failures} consecutive failures")
+
+    def release(self):
+        """Give back a reserved call whose outcome says nothing about LDAP's health"""
+        with self._lock:
+            if self.state == self.HALF_OPEN and self._trials:
+                self._trials -= 1
+
+    def stats(self):
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1),
+            "times_opened": self.times_opened,
+            "rejected": self.rejected
+        }
+
+
+class CircuitBreakerGroup:
+    """
+    One CircuitBreaker per LDAP server, so a dead replica's breaker opens without
+    stopping calls to the others. Reported as a single breaker when there is one server.
+    """
+
+    def __init__(self, servers, **breaker_options):
+        self.breakers = {server: CircuitBreaker(name=f"LDAP {server}", **breaker_options) for server in servers}
+
+    def get(self, server):
+        return self.breakers[server]
+
+    def retry_after(self):
+        """Seconds until some server accepts a call again (0 unless every breaker is open)"""
+        return min(breaker.retry_after() for breaker in self.breakers.values())
+
+    def stats(self):
+        if len(self.breakers) == 1:
+            return next(iter(self.breakers.values())).stats()
+        return {server: breaker.stats() for server, breaker in self.breakers.items()}
+
+
+class LDAPConnectionPool:
+    """
+    Thread-safe pool of LDAP connections.
+    With bind_dn set every connection is bound as that account once, when it is opened;
+    without it connections are left anonymous and are meant to be re-bound per use (see bind()).
+    Connections are opened lazily, so creating a pool before gunicorn forks its workers is safe.
+    timer(phase) may return a context manager wrapped around each acquire, initialize,
+    admin_bind, user_bind and unbind call, for latency metrics and tracing.
+    connect_timeout, timeout and bind_timeout (seconds, None for no limit) bound the TCP
+    connect, every other operation and binds; a timed out connection is discarded.
+    With a breaker, transport failures and LDAP errors count against it and calls fail
+    with CircuitOpen while it is open.
+    """
+
+    def __init__(self, server, bind_dn=None, bind_password=None, size=4,
+                 idle_timeout=300, check_interval=30, acquire_timeout=10, timer=None,
+                 connect_timeout=None, timeout=None, bind_timeout=None, breaker=None):
+        self.server = server
+        self.bind_dn = bind_dn
+        self.bind_password = bind_password
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.acquire_timeout = acquire_timeout
+        self.timer = timer or (lambda phase: contextlib.nullcontext())
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.bind_timeout = bind_timeout
+        self.breaker = breaker
+        self.opened = 0
+        self.discarded = 0
+        self.reaped = 0
+        self._idle = collections.deque()  # (conn, last_used) pairs, most recently used on the right
+        self._total = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        """Open a new connection, binding as the service account if configured"""
+        with self.timer('initialize'):
+            conn = ldap.initialize(self.server)
+            conn.protocol_version = ldap.VERSION3
+            conn.set_option(ldap.OPT_REFERRALS, 0)
+            if self.connect_timeout is not None:
+                conn.set_option(ldap.OPT_NETWORK_TIMEOUT, self.connect_timeout)
+            if self.timeout is not None:
+                conn.set_option(ldap.OPT_TIMEOUT, self.timeout)
+                # python-ldap's *_s methods wait this long for each result
+                conn.timeout = self.timeout
+        if self.bind_dn:
+            try:
+                with self.timer('admin_bind'):
+                    self._simple_bind(conn, self.bind_dn, self.bind_password)
+            except BaseException:
+                self._close(conn)
+                raise
+        self.opened += 1
+        return conn
+
+    def _simple_bind(self, conn, dn, password):
+        """simple_bind_s limited to bind_timeout; raises ldap.TIMEOUT when it runs out"""
+        if self.bind_timeout is None:
+            conn.simple_bind_s(dn, password)
+            return
+        msgid = conn.simple_bind(dn, password)
+        conn.result(msgid, all=1, timeout=self.bind_timeout)
+
+    def _close(self, conn):
+        try:
+            with self.timer('unbind'):
+                conn.unbind_s()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_alive(conn):
+        try:
+            conn.whoami_s()
+            return True
+        except ldap.LDAPError:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._total -= 1
+            self._cond.notify()
+
+    def _reap_idle_locked(self, now):
+        """Pop connections idle longer than idle_timeout; caller holds the lock"""
+        stale = []
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            stale.append(self._idle.popleft()[0])
+            self._total -= 1
+        self.reaped += len(stale)
+        return stale
+
+    def acquire(self):
+        """Check a live connection out of the pool, opening one if there is room"""
+        deadline = time.monotonic() + self.acquire_timeout
+        with self._cond:
+            stale = self._reap_idle_locked(time.monotonic())
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._total < self.size:
+                    self._total += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolExhausted({"desc": f"No free LDAP connection to {self.server}"})
+                self._cond.wait(remaining)
+
+        for old in stale:
+            self._close(old)
+
+        if conn is not None:
+            if time.monotonic() - last_used < self.check_interval or self._is_alive(conn):
+                return conn
+            logger.info(f"Dropping dead pooled LDAP connection to {self.server}")
+            self._close(conn)
+            self.discarded += 1
+
+        # The slot is already reserved; give it back if the connect fails
+        try:
+            return self._connect()
+        except BaseException:
+            self._release_slot()
+            raise
+
+    def release(self, conn, discard=False):
+        """Return a connection to the pool, or close it if it is no longer usable"""
+        if discard:
+            self._close(conn)
+            self.discarded += 1
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def run(self, operation):
+        """
+        Call operation(conn) with a pooled connection and return its result.
+        On SERVER_DOWN the connection is dropped and the call is retried once on a fresh one.
+        """
+        for attempt in (1, 2):
+            if self.breaker is not None:
+                self.breaker.allow()
+            try:
+                with self.timer('acquire'):
+                    conn = self.acquire()
+            except BaseException as e:
+                self._record(e)
+                raise
+            try:
+                result = operation(conn)
+            except ldap.SERVER_DOWN as e:
+                self.release(conn, discard=True)
+                self._record(e)
+                if attempt == 2:
+                    raise
+                logger.info(f"LDAP server {self.server} went away, reconnecting")
+                continue
+            except REUSABLE_ERRORS:
+                self.release(conn)
+                self._record(None)
+                raise
+            except BaseException as e:
+                self.release(conn, discard=True)
+                self._record(e)
+                raise
+            self.release(conn)
+            self._record(None)
+            return result
+
+    def _record(self, error):
+        """Report one attempt's outcome to the circuit breaker"""
+        if self.breaker is None:
+            return
+        if error is None or isinstance(error, REUSABLE_ERRORS):
+            self.breaker.success()
+        elif isinstance(error, ldap.LDAPError) and not isinstance(error, PoolExhausted):
+            self.breaker.failure()
+        else:
+            self.breaker.release()
+
+    def bind(self, dn, password):
+        """Verify a password by re-binding a pooled connection as dn"""
+        # An empty password would be an unauthenticated bind, which always succeeds
+        if not password:
+            raise ldap.INVALID_CREDENTIALS({"desc": "Empty password"})
+
+        def user_bind(conn):
+            with self.timer('user_bind'):
+                self._simple_bind(conn, dn, password)
+
+        self.run(user_bind)
+
+    def close(self):
+        """Close every idle connection"""
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._total -= len(idle)
+            self._idle.clear()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """Return pool occupancy and lifetime counters for health output"""
+        with self._cond:
+            idle = len(self._idle)
+            total = self._total
+        return {
+            "size": self.size,
+            "open": total,
+            "idle": idle,
+            "in_use": total - idle,
+            "opened": self.opened,
+            "discarded": self.discarded,
+            "reaped": self.reaped
+        }
+
+
+class ServerSelector:
+    """
+    Tracks the health and latency of each LDAP replica and decides which to try first.
+    The first choice is the faster of two random healthy replicas (by moving average
+    latency), then the other healthy replicas fastest first, then replicas marked down
+    as a last resort. A failed replica is marked down for backoff seconds, doubling
+    with each consecutive failure up to max_backoff.
+    """
+
+    def __init__(self, servers, backoff=5, max_backoff=300, smoothing=0.2):
+        self.servers = list(servers)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.smoothing = smoothing
+        self._state = {server: {"latency": None, "down_until": 0.0, "failures": 0, "calls": 0, "errors": 0}
+                       for server in self.servers}
+        self._lock = threading.Lock()
+
+    def order(self):
+        """Replicas in the order a call should try them"""
+        if len(self.servers) == 1:
+            return self.servers
+        now = time.monotonic()
+        with self._lock:
+            up = [s for s in self.servers if self._state[s]["down_until"] <= now]
+            down = sorted((s for s in self.servers if s not in up), key=lambda s: self._state[s]["down_until"])
+            # Unmeasured replicas sort first so each one gets sampled
+            latency = {s: self._state[s]["latency"] or 0.0 for s in up}
+        up.sort(key=latency.get)
+        if len(up) > 1:
+            first = min(random.sample(up, 2), key=latency.get)
+            up.remove(first)
+            up.insert(0, first)
+        return up + down
+
+    def observe(self, server, seconds):
+        """Record a successful call and its latency; a down replica that answered is up again"""
+        with self._lock:
+            state = self._state[server]
+            state["calls"] += 1
+            previous = state["latency"]
+            state["latency"] = seconds if previous is None else previous + self.smoothing * (seconds - previous)
+            if state["failures"]:
+                logger.info(f"LDAP server {server} is back up")
+            state["failures"] = 0
+            state["down_until"] = 0.0
+
+    def mark_up(self, server):
+        """Clear a replica's down state without touching its latency (health probes)"""
+        with self._lock:
+            state = self._state[server]
+            if state["failures"]:
+                logger.info(f"LDAP server {server} is back up")
+            state["failures"] = 0
+            state["down_until"] = 0.0
+
+    def mark_down(self, server):
+        with self._lock:
+            state = self._state[server]
+            state["calls"] += 1
+            state["errors"] += 1
+            state["failures"] += 1
+            backoff = min(self.max_backoff, self.backoff * 2 ** (state["failures"] - 1))
+            state["down_until"] = time.monotonic() + backoff
+        logger.warning(f"LDAP server {server} marked down for {backoff:.0f}s")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                server: {
+                    "status": "down" if state["down_until"] > now else "up",
+                    "down_for": round(max(0.0, state["down_until"] - now), 1),
+                    "latency_ms": round(state["latency"] * 1000, 2) if state["latency"] is not None else None,
+                    "consecutive_failures": state["failures"],
+                    "calls": state["calls"],
+                    "errors": state["errors"]
+                }
+                for server, state in self._state.items()
+            }
+
+
+class LDAPPoolGroup:
+    """
+    One LDAPConnectionPool per replica behind the same run()/bind() interface.
+    Each call goes to the replica the selector picks; if that replica fails with one of
+    FAILOVER_ERRORS (or its pool is exhausted, or its breaker is open) the call moves on
+    to the next replica, so the caller only sees an error when every replica failed.
+    breakers, a CircuitBreakerGroup, gives each replica's pool that replica's breaker.
+    """
+
+    def __init__(self, servers, selector, breakers=None, **pool_options):
+        self.selector = selector
+        self.pools = {server: LDAPConnectionPool(server, breaker=breakers.get(server) if breakers else None,
+                                                 **pool_options)
+                      for server in servers}
+
+    def _call(self, func):
+        error = None
+        for server in self.selector.order():
+            start = time.monotonic()
+            try:
+                result = func(self.pools[server])
+            except REUSABLE_ERRORS:
+                # The replica answered; the credentials were wrong
+                self.selector.observe(server, time.monotonic() - start)
+                raise
+            except FAILOVER_ERRORS as e:
+                self.selector.mark_down(server)
+                logger.warning(f"LDAP call to {server} failed ({e}), trying the next replica")
+                error = e
+                continue
+            except (PoolExhausted, CircuitOpen) as e:
+                error = e
+                continue
+            self.selector.observe(server, time.monotonic() - start)
+            return result
+        raise error
+
+    def run(self, operation):
+        """Call operation(conn) on a pooled connection to the best available replica"""
+        return self._call(lambda pool: pool.run(operation))
+
+    def bind(self, dn, password):
+        """Verify a password by re-binding a pooled connection to the best available replica"""
+        return self._call(lambda pool: pool.bind(dn, password))
+
+    def close(self):
+        for pool in self.pools.values():
+            pool.close()
+
+    def stats(self):
+        """Pool stats of a single server, or per server when there are replicas"""
+        if len(self.pools) == 1:
+            return next(iter(self.pools.values())).stats()
+        return {server: pool.stats() for server, pool in self.pools.items()}
@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+"""
+Login page shared by the OpenGrok web login services (v2 and the asyncio edition)
+- Template compiled once at import; the plain form is pre-rendered
+- CSS served as a separate fingerprinted asset that browsers cache for a year
+- Pre-compressed gzip/brotli variants and ETags for conditional requests
+"""
+
+import gzip
+import hashlib
+
+from jinja2 import Environment
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+LOGIN_STYLESHEET = '''
+* {
+    margin: 0;
+    padding: 0;
+    box-sizing: border-box;
+}
+
+body {
+    font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    min-height: 100vh;
+    display: flex;
+    align-items: center;
+    justify-content: center;
+}
+
+.login-container {
+    background: white;
+    padding: 40px;
+    border-radius: 15px;
+    box-shadow: 0 15px 35px rgba(0, 0, 0, 0.1);
+    width: 400px;
+    max-width: 90%;
+}
+
+.logo {
+    text-align: center;
+    margin-bottom: 30px;
+}
+
+.logo h1 {
+    color: #333;
+    font-size: 28px;
+    margin-bottom: 10px;
+}
+
+.logo p {
+    color: #666;
+    font-size: 14px;
+}
+
+.form-group {
+    margin-bottom: 20px;
+}
+
+.form-group label {
+    display: block;
+    color: #333;
+    font-weight: 600;
+    margin-bottom: 8px;
+}
+
+.form-group input {
+    width: 100%;
+    padding: 12px 15px;
+    border: 2px solid #e1e8ed;
+    border-radius: 8px;
+    font-size: 16px;
+    transition: border-color 0.3s ease;
+}
+
+.form-group input:focus {
+    outline: none;
+    border-color: #667eea;
+    box-shadow: 0 0 0 3px rgba(102, 126, 234, 0.1);
+}
+
+.login-button {
+    width: 100%;
+    background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+    color: white;
+    border: none;
+    padding: 12px 20px;
+    border-radius: 8px;
+    font-size: 16px;
+    font-weight: 600;
+    cursor: pointer;
+    transition: transform 0.2s ease;
+}
+
+.login-button:hover {
+    transform: translateY(-2px);
+}
+
+.login-button:active {
+    transform: translateY(0);
+}
+
+.error-message {
+    background: #fee;
+    color: #c33;
+    padding: 10px;
+    border-radius: 5px;
+    margin-bottom: 20px;
+    border-left: 4px solid #c33;
+}
+
+.info-message {
+    background: #e8f4f8;
+    color: #0066cc;
+    padding: 15px;
+    border-radius: 5px;
+    margin-bottom: 20px;
+    border-left: 4px solid #0066cc;
+    font-size: 13px;
+    line-height: 1.5;
+}
+
+.info-message strong {
+    font-size: 14px;
+    display: block;
+    margin-bottom: 8px;
+}
+
+.info-message ul {
+    margin: 0;
+    padding-left: 18px;
+}
+
+.info-message li {
+    margin-bottom: 4px;
+}
+
+.footer {
+    text-align: center;
+    margin-top: 30px;
+    color: #888;
+    font-size: 12px;
+}
+'''
+
+# HTML Templates
+LOGIN_TEMPLATE = '''
+<!DOCTYPE html>
+<html lang="ko">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>OpenGrok 로그인 - Roboetech</title>
+    <link rel="stylesheet" href="__LOGIN_CSS_URL__">
+</head>
+<body>
+    <div class="login-container">
+        <div class="logo">
+            <h1>OpenGrok</h1>
+            <p>Roboetech Code Search Platform</p>
+        </div>
+        
+        <div class="info-message">
+            <strong>로그인 안내</strong>
+            <ul>
+                <li>사용자 ID: 본인의 이메일 ID</li>
+                <li>초기 비밀번호: (Gerrit 로그인 암호)</li>
+            </ul>
+        </div>
+        
+        {% if error %}
+        <div class="error-message">
+            {{ error }}
+        </div>
+        {% endif %}
+        
+        {% if info %}
+        <div class="info-message">
+            {{ info }}
+        </div>
+        {% endif %}
+        
+        <form method="POST" action="/login">
+            <div class="form-group">
+                <label for="username">사용자명</label>
+                <input type="text" id="username" name="username" required 
+                       placeholder="LDAP 사용자명을 입력하세요" value="{{ username or '' }}">
+            </div>
+            
+            <div class="form-group">
+                <label for="password">비밀번호</label>
+                <input type="password" id="password" name="password" required 
+                       placeholder="비밀번호를 입력하세요">
+            </div>
+            
+            <button type="submit" class="login-button">로그인</button>
+        </form>
+        
+        <div class="footer">
+            <p>세션은 2시간 후 자동으로 만료됩니다.</p>
+        </div>
+    </div>
+</body>
+</html>
+'''
+
+ASSET_PREFIX = '/login/assets/'
+
+
+class StaticAsset:
+    """An immutable response body with its ETag and pre-compressed variants"""
+
+    def __init__(self, body, content_type, cache_control):
+        body = body.encode('utf-8')
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {None: body, 'gzip': gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(body, quality=11)
+
+    def negotiate(self, accept_encoding):
+        """Pick the smallest variant the client accepts; returns (encoding, body)"""
+        accepted = set()
+        for token in (accept_encoding or '').split(','):
+            coding, _, params = token.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+                accepted.add(coding.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and (encoding in accepted or '*' in accepted):
+                return encoding, self.variants[encoding]
+        return None, self.variants[None]
+
+    def etag(self, encoding):
+        return f'"{self.digest}-{encoding}"' if encoding else f'"{self.digest}"'
+
+    def not_modified(self, if_none_match, encoding):
+        """True if the client's If-None-Match already names this variant"""
+        if not if_none_match:
+            return False
+        etag = self.etag(encoding)
+        return any(tag.strip() in ('*', etag, 'W/' + etag) for tag in if_none_match.split(','))
+
+    def headers(self, encoding):
+        headers = [
+            ('Content-Type', self.content_type),
+            ('Cache-Control', self.cache_control),
+            ('ETag', self.etag(encoding)),
+            ('Vary', 'Accept-Encoding')
+        ]
+        if encoding:
+            headers.append(('Content-Encoding', encoding))
+        return headers
+
+
+LOGIN_CSS = StaticAsset(LOGIN_STYLESHEET, 'text/css; charset=utf-8', 'public, max-age=31536000, immutable')
+LOGIN_CSS_URL = f"{ASSET_PREFIX}login.{LOGIN_CSS.digest}.css"
+
+# Compiled once; autoescaped like Flask's render_template_string
+login_template = Environment(autoescape=True).from_string(LOGIN_TEMPLATE.replace('__LOGIN_CSS_URL__', LOGIN_CSS_URL))
+
+# The plain form has no per-request content, so it is rendered and compressed once.
+# no-cache makes browsers revalidate, so an existing session still gets redirected.
+LOGIN_PAGE = StaticAsset(login_template.render(), 'text/html; charset=utf-8', 'no-cache')
+
+ASSETS = {LOGIN_CSS_URL: LOGIN_CSS}
+
+
+def render_login_page(**context):
+    """Render the login form with an error/info message or a prefilled username"""
+    return login_template.render(**context)
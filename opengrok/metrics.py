@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics for the OpenGrok LDAP authentication services
+- Request counters, latency histograms and in-flight gauges per endpoint
+- Per-phase LDAP timings (initialize, admin bind, search, user bind, unbind)
+- Cache lookup counters and JWT verification time
+
+With PROMETHEUS_MULTIPROC_DIR set every gunicorn worker writes its samples there and
+/metrics aggregates all of them; gunicorn.conf.py empties the directory on startup.
+"""
+
+import os
+import time
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+
+from tracing import add_span
+
+# Samples are written to per-process files here as soon as the metrics below are created
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+# Only these paths get their own label; anything else would let clients grow the series count
+TRACKED_ENDPOINTS = ('/auth', '/login', '/validate', '/validate/batch', '/health', '/health/live', '/health/ready')
+
+# /auth is answered from memory in well under a millisecond, LDAP binds take milliseconds to seconds
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter('opengrok_auth_requests_total', 'HTTP requests handled',
+                   ['endpoint', 'status'])
+REQUEST_SECONDS = Histogram('opengrok_auth_request_seconds', 'Time until the response was fully sent',
+                            ['endpoint'], buckets=LATENCY_BUCKETS)
+IN_FLIGHT = Gauge('opengrok_auth_requests_in_flight', 'Requests currently being handled',
+                  ['endpoint'], multiprocess_mode='livesum')
+LDAP_PHASE_SECONDS = Histogram('opengrok_auth_ldap_phase_seconds', 'Time spent in each LDAP operation',
+                               ['phase'], buckets=LATENCY_BUCKETS)
+LDAP_PHASE_ERRORS = Counter('opengrok_auth_ldap_phase_errors_total', 'LDAP operations that raised',
+                            ['phase'])
+CACHE_LOOKUPS = Counter('opengrok_auth_cache_lookups_total', 'Cache lookups by outcome',
+                        ['cache', 'result'])
+LOGIN_RATE_LIMITED = Counter('opengrok_auth_rate_limited_total', 'Login attempts rejected before LDAP',
+                             ['bucket'])
+JWT_VERIFY_SECONDS = Histogram('opengrok_auth_jwt_verify_seconds', 'Session token signature verification time',
+                               buckets=LATENCY_BUCKETS)
+
+
+def endpoint_label(path):
+    return path if path in TRACKED_ENDPOINTS else None
+
+
+class ldap_phase:
+    """
+    Context manager timing one LDAP operation: with ldap_phase('search'): ...
+    The time also becomes an ldap_<phase> span when the request is being traced.
+    """
+
+    __slots__ = ('phase', 'start')
+
+    def __init__(self, phase):
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        LDAP_PHASE_SECONDS.labels(self.phase).observe(duration)
+        add_span('ldap_' + self.phase, self.start, duration)
+        if exc_type is not None:
+            LDAP_PHASE_ERRORS.labels(self.phase).inc()
+        return False
+
+
+def cache_observer(name):
+    """Return an on_lookup(hit) callback counting lookups of the named cache"""
+    hit = CACHE_LOOKUPS.labels(name, 'hit')
+    miss = CACHE_LOOKUPS.labels(name, 'miss')
+
+    def on_lookup(found):
+        (hit if found else miss).inc()
+
+    return on_lookup
+
+
+def render_metrics():
+    """Return (body, content type) for /metrics, merged across workers in multiprocess mode"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+class MetricsMiddleware:
+    """
+    WSGI middleware recording request count, latency and in-flight gauges for tracked endpoints.
+    A request is recorded when the server closes its response, so streamed bodies
+    (/validate/batch) count until their last line has been sent.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        endpoint = endpoint_label(environ.get('PATH_INFO'))
+        if endpoint is None:
+            return self.app(environ, start_response)
+
+        status = ['500']
+
+        def recording_start_response(status_line, headers, exc_info=None):
+            status[0] = status_line.split(' ', 1)[0]
+            return start_response(status_line, headers, exc_info)
+
+        in_flight = IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        start = time.perf_counter()
+
+        def finish():
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, status[0]).inc()
+            in_flight.dec()
+
+        try:
+            body = self.app(environ, recording_start_response)
+        except BaseException:
+            finish()
+            raise
+        return ClosingBody(body, finish)
+
+
+class ClosingBody:
+    """WSGI response body that calls on_close once, after closing the wrapped body"""
+
+    def __init__(self, body, on_close):
+        self.body = body
+        self.on_close = on_close
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            close = getattr(self.body, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            on_close, self.on_close = self.on_close, None
+            if on_close is not None:
+                on_close()
+
+
+class ASGIMetricsMiddleware:
+    """ASGI counterpart of MetricsMiddleware"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        endpoint = endpoint_label(scope.get('path')) if scope['type'] == 'http' else None
+        if endpoint is None:
+            return await self.app(scope, receive, send)
+
+        status = ['500']
+
+        async def recording_send(message):
+            if message['type'] == 'http.response.start':
+                status[0] = str(message['status'])
+            await send(message)
+
+        in_flight = IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, recording_send)
+        finally:
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, status[0]).inc()
+            in_flight.dec()
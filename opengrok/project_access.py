@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Per-project authorization for nginx auth_request subrequests
+- PROJECT_GROUPS maps OpenGrok projects to the LDAP groups allowed to read them
+- Sessions carry the user's memberships as a bitmap over the groups named there
+- /auth checks every project X-Original-URI selects against that bitmap without any LDAP call:
+  path segments (/xref/<project>/..., /api/v1/projects/<project>), project= and projects=
+  parameters and the first segment of path-valued parameters (path=/<project>/...)
+- A search that names no project would cover all of them (or the OpenGrokProject cookie's
+  selection), so it is denied to users outside any restricted project
+- A subrequest without X-Original-URI is denied, since there is nothing to check
+
+Projects not listed in PROJECT_GROUPS are open to every authenticated user.
+"""
+
+import hashlib
+import logging
+import os
+import posixpath
+import re
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+# project=group,group;project=group - group names are LDAP group cn values
+PROJECT_GROUPS = os.getenv('PROJECT_GROUPS', '')
+# Path of X-Original-URI whose first group is the project; searches name projects in parameters
+PROJECT_URI_PATTERN = re.compile(os.getenv('PROJECT_URI_PATTERN',
+                                           r'/(?:xref|history|raw|download|diff|annotate|rss|api/v1/projects)'
+                                           r'/([^/?#]+)'))
+# Endpoints that search every project (or the cookie's selection) when the request names none
+PROJECT_SEARCH_PATTERN = re.compile(os.getenv('PROJECT_SEARCH_PATTERN',
+                                              r'/(?:search|s|json|api/v1/search|api/v1/suggest)$'))
+ORIGINAL_URI_HEADER = 'X-Original-URI'
+
+# Parameters naming projects (projects= may be comma-separated in the REST API), and parameters
+# holding a source path whose first segment is the project (REST API, diff revisions)
+PROJECT_PARAMETERS = ('project', 'projects')
+PATH_PARAMETERS = ('path', 'r1', 'r2', 'repository')
+
+
+def parse_project_groups(value):
+    """{project: [group cn, ...]} from 'project=group,group;project=group'"""
+    projects = {}
+    for item in value.split(';'):
+        project, _, groups = item.partition('=')
+        groups = [group.strip() for group in groups.split(',') if group.strip()]
+        if project.strip() and groups:
+            projects[project.strip()] = groups
+    return projects
+
+
+PROJECTS = parse_project_groups(PROJECT_GROUPS)
+# Bit i of a session's group bitmap is GROUPS[i]; group cn are matched case-insensitively
+GROUPS = sorted({group.lower() for groups in PROJECTS.values() for group in groups})
+GROUP_BITS = {group: 1 << i for i, group in enumerate(GROUPS)}
+# Stored with the bitmap so sessions issued under a different group table are not misread
+GROUP_VERSION = hashlib.sha256(','.join(GROUPS).encode('utf-8')).hexdigest()[:8]
+ENABLED = bool(PROJECTS)
+
+
+def group_bitmap(groups):
+    """Bitmap of the given group cn values, ignoring groups no project refers to"""
+    bits = 0
+    for group in groups:
+        bits |= GROUP_BITS.get(group.lower(), 0)
+    return bits
+
+
+# project -> bitmap of the groups allowed to read it
+PROJECT_MASKS = {project: group_bitmap(groups) for project, groups in PROJECTS.items()}
+
+
+def session_claims(groups):
+    """Claims to add to a session token for a user in these groups"""
+    if not ENABLED:
+        return {}
+    return {'grp': group_bitmap(groups), 'gv': GROUP_VERSION}
+
+
+def session_bits(payload):
+    """Group bitmap of a verified session, 0 if it was issued under another group table"""
+    if payload.get('gv') != GROUP_VERSION:
+        return 0
+    return payload.get('grp', 0)
+
+
+def normalize_path(path):
+    """URI path as the servlet container resolves it: decoded, without ;parameters, dot segments or //"""
+    path = re.sub(r';[^/]*', '', urllib.parse.unquote(path))
+    return posixpath.normpath('/' + path.lstrip('/')) if path else '/'
+
+
+def requested_projects(uri):
+    """(path, projects) for an OpenGrok URI: every project selected by its path or parameters"""
+    path, _, query = uri.partition('?')
+    path = normalize_path(path.partition('#')[0])
+    projects = PROJECT_URI_PATTERN.findall(path)
+    for name, value in urllib.parse.parse_qsl(query):
+        if name in PROJECT_PARAMETERS:
+            projects.extend(project.strip() for project in value.split(',') if project.strip())
+        elif name in PATH_PARAMETERS:
+            project = normalize_path(value).split('/')[1]
+            if project:
+                projects.append(project)
+    return path, projects
+
+
+def is_allowed(bits, uri):
+    """
+    True if a user with this group bitmap may read every restricted project in uri.
+    A search naming no project is allowed only to users who may read every restricted project.
+    Without X-Original-URI nothing can be checked, so the request is denied.
+    """
+    if not ENABLED:
+        return True
+    if not uri:
+        logger.warning(f"Access denied: no {ORIGINAL_URI_HEADER} header, is nginx setting it?")
+        return False
+    path, projects = requested_projects(uri)
+    for project in projects:
+        mask = PROJECT_MASKS.get(project)
+        if mask is not None and not mask & bits:
+            logger.info(f"Access to project {project} denied")
+            return False
+    if not projects and PROJECT_SEARCH_PATTERN.search(path):
+        if any(not mask & bits for mask in PROJECT_MASKS.values()):
+            logger.info(f"Search without a project denied on {path}")
+            return False
+    return True
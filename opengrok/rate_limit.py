@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+Login rate limiting shared by every pre-forked gunicorn worker
+Token buckets per username and per client IP live in one shared memory map, created
+before the workers fork (gunicorn --preload) or backed by RATE_LIMIT_FILE. A check is
+a hash, one or two slot reads and one write, with no lock: two workers updating the
+same bucket at the same instant may both spend one token, which errs towards allowing.
+Requests are checked only when they are about to cost an LDAP bind.
+"""
+
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+
+from metrics import LOGIN_RATE_LIMITED
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT = os.getenv('RATE_LIMIT', 'true').lower() == 'true'
+# Attempts per username: a burst, then a steady rate
+RATE_LIMIT_USER_BURST = int(os.getenv('RATE_LIMIT_USER_BURST', '10'))
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv('RATE_LIMIT_USER_PER_MINUTE', '10'))
+# Attempts per client IP - offices share one address behind NAT, so this is much larger
+RATE_LIMIT_IP_BURST = int(os.getenv('RATE_LIMIT_IP_BURST', '60'))
+RATE_LIMIT_IP_PER_MINUTE = float(os.getenv('RATE_LIMIT_IP_PER_MINUTE', '120'))
+# Buckets per table; a new key takes the staler of its two candidate slots
+RATE_LIMIT_SLOTS = int(os.getenv('RATE_LIMIT_SLOTS', '65536'))
+# Optional file (e.g. under /dev/shm) for sharing buckets when workers are not forked from one process
+RATE_LIMIT_FILE = os.getenv('RATE_LIMIT_FILE', '')
+# X-Forwarded-For entries added by our own proxies; the client is the one just left of them
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', '1'))
+
+RATE_LIMITED = "Too many attempts"
+
+# key fingerprint, tokens left, last update (epoch seconds)
+_SLOT = struct.Struct('<Qdd')
+# allowed, limited by user, limited by IP
+_COUNTERS = struct.Struct('<3Q')
+
+
+def _open_memory(size):
+    if not RATE_LIMIT_FILE:
+        # Anonymous maps are MAP_SHARED, so forked workers see each other's writes
+        return mmap.mmap(-1, size)
+    fd = os.open(RATE_LIMIT_FILE, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        if os.fstat(fd).st_size != size:
+            os.ftruncate(fd, size)
+        return mmap.mmap(fd, size)
+    finally:
+        os.close(fd)
+
+
+class SharedBuckets:
+    """Token buckets at a fixed offset of a shared memory map; each key has two candidate slots"""
+
+    def __init__(self, memory, offset, slots, burst, per_minute):
+        self.memory = memory
+        self.offset = offset
+        self.slots = slots
+        self.burst = float(burst)
+        self.rate = per_minute / 60.0
+
+    def take(self, key):
+        """Spend one token for key; return 0 if allowed, else seconds until a token is available"""
+        fingerprint = int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+        index = fingerprint % self.slots
+        position = self.offset + index * _SLOT.size
+        other = self.offset + (index ^ 1) * _SLOT.size
+        now = time.time()
+
+        found, tokens, updated = _SLOT.unpack_from(self.memory, position)
+        if found != fingerprint:
+            found, other_tokens, other_updated = _SLOT.unpack_from(self.memory, other)
+            if found == fingerprint:
+                position, tokens, updated = other, other_tokens, other_updated
+            else:
+                if other_updated < updated:
+                    position = other
+                tokens, updated = self.burst, now
+
+        tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+        if tokens < 1:
+            _SLOT.pack_into(self.memory, position, fingerprint, tokens, now)
+            return (1 - tokens) / self.rate if self.rate else float('inf')
+        _SLOT.pack_into(self.memory, position, fingerprint, tokens - 1, now)
+        return 0.0
+
+
+class RateLimiter:
+    """Per-username and per-IP token buckets in one shared memory map"""
+
+    def __init__(self, slots=RATE_LIMIT_SLOTS, user_burst=RATE_LIMIT_USER_BURST,
+                 user_per_minute=RATE_LIMIT_USER_PER_MINUTE, ip_burst=RATE_LIMIT_IP_BURST,
+                 ip_per_minute=RATE_LIMIT_IP_PER_MINUTE):
+        slots += slots % 2
+        table = slots * _SLOT.size
+        self.memory = _open_memory(_COUNTERS.size + 2 * table)
+        self.users = SharedBuckets(self.memory, _COUNTERS.size, slots, user_burst, user_per_minute)
+        self.ips = SharedBuckets(self.memory, _COUNTERS.size + table, slots, ip_burst, ip_per_minute)
+
+    def _count(self, field):
+        counters = list(_COUNTERS.unpack_from(self.memory, 0))
+        counters[field] += 1
+        _COUNTERS.pack_into(self.memory, 0, *counters)
+
+    def check(self, username=None, ip=None):
+        """0 if an LDAP attempt for username from ip may go ahead, else the Retry-After in seconds"""
+        if ip:
+            wait = self.ips.take(ip)
+            if wait:
+                self._count(2)
+                LOGIN_RATE_LIMITED.labels('ip').inc()
+                logger.debug(f"Rate limited client {ip}")
+                return wait
+        if username:
+            wait = self.users.take(username.lower())
+            if wait:
+                self._count(1)
+                LOGIN_RATE_LIMITED.labels('user').inc()
+                logger.debug(f"Rate limited user {username}")
+                return wait
+        self._count(0)
+        return 0.0
+
+    def stats(self):
+        allowed, limited_user, limited_ip = _COUNTERS.unpack_from(self.memory, 0)
+        return {
+            "enabled": True,
+            "user": {"burst": self.users.burst, "per_minute": self.users.rate * 60},
+            "ip": {"burst": self.ips.burst, "per_minute": self.ips.rate * 60},
+            "slots": self.users.slots,
+            "allowed": allowed,
+            "limited_user": limited_user,
+            "limited_ip": limited_ip
+        }
+
+
+def client_ip(forwarded_for, remote_addr):
+    """
+    Client address from X-Forwarded-For (skipping TRUSTED_PROXY_HOPS - 1 of our proxies).
+    Behind a proxy the peer is the proxy itself, so without the header there is no client
+    address and '' is returned (no IP bucket); with TRUSTED_PROXY_HOPS=0 the peer is the client.
+    """
+    if not TRUSTED_PROXY_HOPS:
+        return remote_addr or ''
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()] if forwarded_for else []
+    if len(hops) >= TRUSTED_PROXY_HOPS:
+        return hops[-TRUSTED_PROXY_HOPS]
+    _warn_missing_client(remote_addr)
+    return ''
+
+
+_last_missing_client_warning = 0.0
+
+
+def _warn_missing_client(remote_addr):
+    # Every request of a misconfigured location lands here; one line a minute is enough
+    global _last_missing_client_warning
+    now = time.time()
+    if now - _last_missing_client_warning >= 60:
+        _last_missing_client_warning = now
+        logger.warning(f"No client address in X-Forwarded-For (from {remote_addr}, TRUSTED_PROXY_HOPS="
+                       f"{TRUSTED_PROXY_HOPS}); skipping the per-IP rate limit. Is nginx setting the header?")
+
+
+def retry_after_header(wait=None):
+    """Retry-After value for a rejected attempt; without a wait, the time for a user bucket to refill one token"""
+    if wait is None:
+        wait = 60 / RATE_LIMIT_USER_PER_MINUTE if RATE_LIMIT_USER_PER_MINUTE else 60
+    return str(max(1, math.ceil(wait)))
+
+
+login_limiter = RateLimiter() if RATE_LIMIT else None
+
+
+def check_login(username, forwarded_for=None, remote_addr=None):
+    """0 if this login attempt may reach LDAP, else seconds to wait"""
+    if login_limiter is None:
+        return 0.0
+    return login_limiter.check(username, client_ip(forwarded_for, remote_addr))
+
+
+def rate_limit_stats():
+    return login_limiter.stats() if login_limiter else {"enabled": False}
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Session cookies for the OpenGrok web login services (v2 and the asyncio edition)
+- Session token creation and verification
+- Verified-session cache for nginx auth_request subrequests
+- Sliding renewal with a per-user jittered lifetime and an absolute maximum age
+- Compact claims: sub/iat/exp and a per-login sid, plus the DN, auth_time and group bitmap only when they add information
+- Server-side revocation (/logout, users removed from LDAP) shared by all workers
+"""
+
+import json
+import logging
+import os
+import secrets
+import time
+import urllib.parse
+
+import jwt
+
+from auth_cache import SingleFlight, TTLCache, token_digest
+from ldap_auth import LDAP_USER_BASE, cached_groups, user_directory
+from metrics import JWT_VERIFY_SECONDS, cache_observer
+from project_access import ENABLED as PROJECT_ACCESS_ENABLED, session_claims
+from session_keys import SessionKeys
+from session_revocation import RevocationFull, RevocationStore
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Session configuration - 2 hours
+SESSION_TIMEOUT_HOURS = 2
+JWT_SECRET = os.getenv('JWT_SECRET', secrets.token_urlsafe(32))
+COOKIE_NAME = 'opengrok_session'
+SESSION_HEADER = 'X-Auth-Session'
+
+# Sliding renewal - /auth reissues a session past this fraction of its lifetime (0 disables),
+# but never beyond SESSION_MAX_AGE_HOURS after the original login
+SESSION_RENEW_AFTER = float(os.getenv('SESSION_RENEW_AFTER', '0.5'))
+SESSION_MAX_AGE_HOURS = float(os.getenv('SESSION_MAX_AGE_HOURS', '12'))
+# Lifetime is spread by up to +/- this fraction per user, so people who log in together don't expire together
+SESSION_EXPIRY_JITTER = float(os.getenv('SESSION_EXPIRY_JITTER', '0.1'))
+SESSION_MAX_AGE = int(SESSION_MAX_AGE_HOURS * 3600)
+
+# Token signing - HS256 with JWT_SECRET, or ES256/EdDSA with keys published at /.well-known/jwks.json
+JWT_ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
+JWT_PRIVATE_KEY_FILE = os.getenv('JWT_PRIVATE_KEY_FILE')
+JWT_PREVIOUS_PUBLIC_KEYS = [path for path in os.getenv('JWT_PREVIOUS_PUBLIC_KEYS', '').split(',') if path]
+# Key ring file or directory shared by all workers/replicas; overrides the settings above
+JWT_KEYRING = os.getenv('JWT_KEYRING')
+JWT_KEYRING_RELOAD_INTERVAL = int(os.getenv('JWT_KEYRING_RELOAD_INTERVAL', '30'))
+# Keep accepting kid-less HS256 tokens (signed with JWT_SECRET) after switching to ES256/EdDSA or a
+# key ring; off unless set, since anyone with the secret could forge them. Always on in plain HS256 mode.
+JWT_ACCEPT_LEGACY_HS256 = os.getenv('JWT_ACCEPT_LEGACY_HS256', '').lower()
+
+session_keys = SessionKeys(JWT_SECRET, algorithm=JWT_ALGORITHM, private_key_file=JWT_PRIVATE_KEY_FILE,
+                           public_key_files=JWT_PREVIOUS_PUBLIC_KEYS, keyring_path=JWT_KEYRING,
+                           reload_interval=JWT_KEYRING_RELOAD_INTERVAL,
+                           accept_legacy_hs256=JWT_ACCEPT_LEGACY_HS256 == 'true' if JWT_ACCEPT_LEGACY_HS256 else None)
+
+# Verified-session cache for /auth subrequests (entries expire at the token's exp)
+SESSION_CACHE_SIZE = int(os.getenv('SESSION_CACHE_SIZE', '4096'))
+session_cache = TTLCache(maxsize=SESSION_CACHE_SIZE, on_lookup=cache_observer('session'))
+
+# Prebuilt X-Auth-* headers and JSON body per (username, DN), shared by every session of that user
+identity_cache = TTLCache(maxsize=SESSION_CACHE_SIZE)
+
+# Renewed token per session (token digest), kept until the old token expires
+renewal_cache = TTLCache(maxsize=SESSION_CACHE_SIZE)
+_renewals = SingleFlight()
+
+# Revoked sessions and users, checked on every verification; any change clears each worker's session_cache
+revocations = RevocationStore(SESSION_MAX_AGE)
+
+
+def session_lifetime(username):
+    """Session lifetime in seconds, offset per user by up to SESSION_EXPIRY_JITTER"""
+    spread = int.from_bytes(token_digest(username)[:4], 'big') / 0xffffffff * 2 - 1
+    return int(SESSION_TIMEOUT_HOURS * 3600 * (1 + SESSION_EXPIRY_JITTER * spread))
+
+
+def default_dn(username):
+    return f"uid={username},{LDAP_USER_BASE}"
+
+
+def compact_claims(username, dn, issued, expires, auth_time, extra=None, sid=None):
+    """
+    Token claims: sub (username), iat and exp always; d (DN) only if it is not the
+    default uid DN, auth_time only if it differs from iat; sid identifies the login
+    """
+    claims = {'sub': username, 'iat': issued, 'exp': expires}
+    if sid:
+        claims['sid'] = sid
+    if dn != default_dn(username):
+        claims['d'] = dn
+    if auth_time != issued:
+        claims['auth_time'] = auth_time
+    if extra:
+        claims.update(extra)
+    return claims
+
+
+def expand_claims(payload):
+    """Fill in username and dn for a compact token; tokens issued before the compact format carry them already"""
+    if 'username' not in payload:
+        payload['username'] = payload['sub']
+        payload['dn'] = payload.pop('d', None) or default_dn(payload['sub'])
+    return payload
+
+
+def new_session_id():
+    """Random id for one login, kept by its renewals, so /logout revokes that login and no other"""
+    return secrets.token_urlsafe(6)
+
+
+def create_session_token(user_info):
+    """Create JWT token for session"""
+    now = int(time.time())
+    username = user_info['username']
+    expires = now + min(session_lifetime(username), SESSION_MAX_AGE)
+    # Group memberships as a bitmap, for per-project checks in /auth
+    extra = session_claims(user_info['groups']) if 'groups' in user_info else None
+    with span('jwt_sign'):
+        return session_keys.sign(compact_claims(username, user_info['dn'], now, expires, now, extra,
+                                                new_session_id()))
+
+
+def verify_session_token(token):
+    """Verify JWT token and return user info"""
+    try:
+        with span('jwt_verify'), JWT_VERIFY_SECONDS.time():
+            payload = expand_claims(session_keys.decode(token))
+        if revocations.is_revoked(payload['username'], payload.get('auth_time', payload['iat']),
+                                  payload.get('sid', '')):
+            return False, "Session revoked"
+        return True, payload
+    except jwt.ExpiredSignatureError:
+        return False, "Session expired"
+    except jwt.InvalidTokenError:
+        return False, "Invalid session"
+
+
+def check_session(token):
+    """
+    Verify a session cookie for nginx auth_request.
+    Returns (True, (payload, headers, body, bare_headers)) or (False, reason).
+    headers carries the X-Auth-* values for the JSON body; bare_headers is the full
+    WSGI header list for an empty-bodied 200. Repeat calls with the same cookie are
+    served from cache until the token expires or any session is revoked.
+    """
+    if revocations.changed():
+        session_cache.clear()
+    cache_key = token_digest(token)
+    cached = session_cache.get(cache_key)
+    if cached is not None:
+        return True, cached
+
+    sequence = revocations.sequence()
+    valid, result = verify_session_token(token)
+    if not valid:
+        return False, result
+
+    cached = (result,) + identity_headers(result['username'], result['dn'])
+    # A revocation made while verifying may already have cleared the cache; don't refill it with this session
+    if revocations.sequence() == sequence:
+        session_cache.set(cache_key, cached, expires_at=result['exp'])
+
+    logger.info(f"Authentication successful for {result['username']} via session")
+    return True, cached
+
+
+def identity_headers(username, dn):
+    """(headers, body, bare_headers) answering /auth for this user; built once per user, not per session"""
+    key = (username, dn)
+    identity = identity_cache.get(key)
+    if identity is None:
+        headers = {
+            'X-Auth-User': username,
+            'X-Auth-Status': 'OK',
+            # URL encode the DN to handle Korean characters safely
+            'X-Auth-DN': urllib.parse.quote(dn, safe='')
+        }
+        body = json.dumps({"status": "authenticated", "user": username})
+        bare_headers = list(headers.items()) + [('Content-Type', 'text/plain'), ('Content-Length', '0')]
+        identity = (headers, body, bare_headers)
+        identity_cache.set(key, identity)
+    return identity
+
+
+def renewal_due(payload):
+    """True once a verified session is past SESSION_RENEW_AFTER of its lifetime"""
+    if not SESSION_RENEW_AFTER:
+        return False
+    issued, expires = payload['iat'], payload['exp']
+    return time.time() >= issued + (expires - issued) * SESSION_RENEW_AFTER
+
+
+def renew_session(token, payload):
+    """
+    Reissued token for a verified session past SESSION_RENEW_AFTER of its lifetime, or None.
+    A session is signed again at most once per worker; concurrent subrequests share that
+    signature and later ones reuse it until the client switches to the new token.
+    """
+    if not renewal_due(payload):
+        return None
+    key = token_digest(token)
+    renewed = renewal_cache.get(key)
+    if renewed is None:
+        renewed = _renewals.do(key, _reissue, key, payload)
+    return renewed or None
+
+
+def _reissue(key, payload):
+    renewed = renewal_cache.get(key)
+    if renewed is not None:
+        return renewed
+    now = int(time.time())
+    auth_time = payload.get('auth_time', payload['iat'])
+    expires = min(now + session_lifetime(payload['username']), auth_time + SESSION_MAX_AGE)
+    if expires <= payload['exp']:
+        # Already at the maximum session age; remember that there is nothing to renew
+        renewed = ''
+    else:
+        extra = None
+        if PROJECT_ACCESS_ENABLED:
+            # Current memberships and PROJECT_GROUPS, not the old token's, so losing a group takes
+            # effect within one token lifetime. Only the group directory or cache is consulted; on a
+            # miss the groups load in the background and a later /auth renews (the old token stays valid)
+            groups = cached_groups(payload['dn'], payload['username'])
+            if groups is None:
+                logger.info(f"Not renewing session for {payload['username']} yet: groups not cached")
+                return None
+            extra = session_claims(groups)
+        with span('jwt_sign'):
+            renewed = session_keys.sign(compact_claims(payload['username'], payload['dn'], now, expires,
+                                                       auth_time, extra, payload.get('sid')))
+        logger.info(f"Renewed session for {payload['username']}")
+    renewal_cache.set(key, renewed, expires_at=payload['exp'])
+    return renewed
+
+
+def revoke_session(token):
+    """Revoke the login session a token belongs to, including tokens renewed from it; False if it is not valid"""
+    valid, payload = verify_session_token(token)
+    if not valid:
+        return False
+    try:
+        revocations.revoke_session(payload['username'], payload.get('auth_time', payload['iat']),
+                                   payload.get('sid', ''))
+    except RevocationFull as e:
+        # The cookie is still cleared; copies of the token stay valid until they expire
+        logger.error(str(e))
+        return False
+    logger.info(f"Revoked session of {payload['username']}")
+    return True
+
+
+def revoke_removed_users(usernames):
+    """End every session of users that have disappeared from LDAP"""
+    for username in usernames:
+        try:
+            revocations.revoke_user(username)
+        except RevocationFull as e:
+            logger.error(str(e))
+    logger.info(f"Revoked sessions of {len(usernames)} users removed from LDAP")
+
+
+if user_directory is not None:
+    user_directory.on_removed = revoke_removed_users
+
+
+def session_headers(token):
+    """Response headers handing a new session token to the client (browser cookie and API header)"""
+    cookie = f"{COOKIE_NAME}={token}; Max-Age={SESSION_MAX_AGE}; Path=/; HttpOnly; Secure; SameSite=Lax"
+    return [('Set-Cookie', cookie), (SESSION_HEADER, token)]
+
+
+def session_cookie(cookie_header):
+    """Pull the session cookie out of a raw Cookie header without parsing the rest"""
+    for pair in cookie_header.split(';'):
+        name, _, value = pair.strip().partition('=')
+        if name == COOKIE_NAME:
+            return value.strip('"')
+    return None
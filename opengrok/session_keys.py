@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+Session token signing keys for the OpenGrok LDAP authentication service
+- HS256 with a shared secret (default)
+- ES256 / EdDSA with a private key, publishing the public keys as a JWKS document
+  so nginx (njs), the Jenkins dashboard or a sidecar can verify cookies locally
+- Key ring loaded from a file or directory, shared by every worker and replica that
+  mounts it, with several active keys selected by kid and rotation without a restart
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+
+logger = logging.getLogger(__name__)
+
+ASYMMETRIC_ALGORITHMS = ('ES256', 'EdDSA')
+# Distinct token headers remembered by SessionKeys.decode (one per key, plus the pre-kid format)
+MAX_HEADER_KIDS = 64
+# A token signed with a kid not in the ring re-reads the ring at most this often (seconds)
+UNKNOWN_KID_RELOAD_INTERVAL = 1
+
+# Members of each key type that make up its RFC 7638 thumbprint
+THUMBPRINT_MEMBERS = {
+    'EC': ('crv', 'kty', 'x', 'y'),
+    'OKP': ('crv', 'kty', 'x')
+}
+
+
+def _load_private_key(path):
+    with open(path, 'rb') as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+def _load_public_key(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    # Accept either a public key or a retired private key file
+    if b'PRIVATE KEY' in data:
+        return serialization.load_pem_private_key(data, password=None).public_key()
+    return serialization.load_pem_public_key(data)
+
+
+def _key_algorithm(key):
+    """Map a cryptography key object to the JWT algorithm that uses it"""
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)) and key.curve.name == 'secp256r1':
+        return 'ES256'
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return 'EdDSA'
+    raise ValueError(f"Unsupported key type {type(key).__name__}")
+
+
+def public_jwk(algorithm, public_key, kid=None):
+    """Return the JWK dict for a public key; kid defaults to its RFC 7638 thumbprint"""
+    jwk = jwt.algorithms.get_default_algorithms()[algorithm].to_jwk(public_key, as_dict=True)
+    if kid is None:
+        members = {name: jwk[name] for name in THUMBPRINT_MEMBERS[jwk['kty']]}
+        canonical = json.dumps(members, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        kid = base64.urlsafe_b64encode(hashlib.sha256(canonical).digest()).rstrip(b'=').decode('ascii')
+    jwk.update(kid=kid, alg=algorithm, use='sig')
+    return jwk
+
+
+class KeySet:
+    """Immutable snapshot of the signing key and every key accepted for verification"""
+
+    def __init__(self):
+        self.signing = None  # (kid, algorithm, private key or secret)
+        self.verify = {}  # kid -> (algorithm, public key or secret)
+        self.jwks = {"keys": []}
+
+    def add(self, kid, algorithm, verify_key, signing_key=None):
+        self.verify[kid] = (algorithm, verify_key)
+        if algorithm != 'HS256':
+            self.jwks["keys"].append(public_jwk(algorithm, verify_key, kid))
+        if signing_key is not None:
+            self.signing = (kid, algorithm, signing_key)
+        return kid
+
+
+def load_key_ring(path):
+    """
+    Build a KeySet from a key file or a directory of key files.
+    Each file is one key and its name without extension is the kid:
+    PEM private keys (P-256 or Ed25519) can sign, PEM public keys only verify,
+    anything else is an HS256 secret. The most recently modified signing-capable
+    file signs new tokens; the rest stay valid for verification.
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if not name.startswith('.')]
+        files = [f for f in files if os.path.isfile(f)]
+    else:
+        files = [path]
+
+    keys = KeySet()
+    newest = None
+    for file in sorted(files, key=os.path.getmtime):
+        kid = os.path.splitext(os.path.basename(file))[0]
+        with open(file, 'rb') as f:
+            data = f.read()
+        if b'PRIVATE KEY' in data:
+            private_key = serialization.load_pem_private_key(data, password=None)
+            newest = (kid, _key_algorithm(private_key), private_key.public_key(), private_key)
+            keys.add(*newest)
+        elif b'PUBLIC KEY' in data:
+            public_key = serialization.load_pem_public_key(data)
+            keys.add(kid, _key_algorithm(public_key), public_key)
+        else:
+            secret = data.strip()
+            newest = (kid, 'HS256', secret, secret)
+            keys.add(*newest)
+    if newest is None:
+        raise ValueError(f"No signing key found in {path}")
+    # Ordered by mtime, so the last signing-capable key wins
+    keys.signing = (newest[0], newest[1], newest[3])
+    return keys
+
+
+class UTF8JSONEncoder(json.JSONEncoder):
+    """Raw UTF-8 instead of \\uXXXX escapes: a Korean DN costs 3 bytes per character, not 6"""
+
+    def __init__(self, **kwargs):
+        kwargs['ensure_ascii'] = False
+        super().__init__(**kwargs)
+
+
+class SessionKeys:
+    """
+    Signs session tokens with the current key and verifies them by their kid header.
+    Tokens without a kid are HS256 tokens signed with the shared secret. Outside plain HS256
+    mode they are only accepted with accept_legacy_hs256, to keep sessions issued before the
+    switch to asymmetric keys or a key ring: anyone holding the secret could forge them.
+    With keyring_path set the ring is re-read when its files change, checked at most
+    every reload_interval seconds, and straight away for a token with an unknown kid
+    (another worker or replica may already sign with a key added since the last check).
+    """
+
+    def __init__(self, secret, algorithm='HS256', private_key_file=None, public_key_files=(),
+                 keyring_path=None, reload_interval=30, accept_legacy_hs256=None):
+        self.secret = secret
+        if accept_legacy_hs256 is None:
+            accept_legacy_hs256 = algorithm == 'HS256' and not keyring_path
+        self.accept_legacy_hs256 = accept_legacy_hs256
+        self.keyring_path = keyring_path
+        self.reload_interval = reload_interval
+        self._fingerprint = None
+        self._next_check = 0
+        self._next_unknown_kid_check = 0
+        self._reload_lock = threading.Lock()
+        # kid by encoded JWT header: every token signed with one key has the same header segment
+        self._header_kids = {}
+
+        if keyring_path:
+            self._fingerprint = self._ring_fingerprint()
+            self._keys = load_key_ring(keyring_path)
+            self._next_check = time.monotonic() + reload_interval
+            return
+
+        keys = KeySet()
+        if algorithm == 'HS256':
+            keys.signing = (None, 'HS256', secret)
+        elif algorithm not in ASYMMETRIC_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT algorithm: {algorithm}")
+        elif not private_key_file:
+            raise ValueError(f"JWT_PRIVATE_KEY_FILE is required for {algorithm}")
+        else:
+            private_key = _load_private_key(private_key_file)
+            kid = keys.add(public_jwk(algorithm, private_key.public_key())['kid'], algorithm,
+                           private_key.public_key(), private_key)
+            # Previous public keys stay published and accepted until their sessions have expired
+            for path in public_key_files:
+                public_key = _load_public_key(path)
+                keys.add(public_jwk(algorithm, public_key)['kid'], algorithm, public_key)
+            keys.signing = (kid, algorithm, private_key)
+        self._keys = keys
+
+    def _ring_fingerprint(self):
+        path = self.keyring_path
+        names = sorted(os.listdir(path)) if os.path.isdir(path) else ['']
+        stats = []
+        for name in names:
+            st = os.stat(os.path.join(path, name))
+            stats.append((name, st.st_mtime_ns, st.st_size))
+        return tuple(stats)
+
+    def _reload(self):
+        """Re-read the key ring if its files changed (caller holds _reload_lock)"""
+        try:
+            self._next_check = time.monotonic() + self.reload_interval
+            fingerprint = self._ring_fingerprint()
+            if fingerprint != self._fingerprint:
+                self._keys = load_key_ring(self.keyring_path)
+                self._fingerprint = fingerprint
+                logger.info(f"Reloaded session key ring, signing with kid {self._keys.signing[0]}")
+        except (OSError, ValueError) as e:
+            # Keep the keys we have rather than locking everyone out
+            logger.error(f"Failed to reload session key ring {self.keyring_path}: {e}")
+
+    def _current(self):
+        """Return the active KeySet, re-reading the key ring if its files changed"""
+        if self.keyring_path and time.monotonic() >= self._next_check and self._reload_lock.acquire(False):
+            try:
+                self._reload()
+            finally:
+                self._reload_lock.release()
+        return self._keys
+
+    def _reload_for_unknown_kid(self):
+        """Re-read the key ring now, at most every UNKNOWN_KID_RELOAD_INTERVAL; False if it was not re-read"""
+        if not self.keyring_path or time.monotonic() < self._next_unknown_kid_check:
+            return False
+        with self._reload_lock:
+            if time.monotonic() < self._next_unknown_kid_check:
+                return False
+            self._next_unknown_kid_check = time.monotonic() + UNKNOWN_KID_RELOAD_INTERVAL
+            self._reload()
+        return True
+
+    @property
+    def kid(self):
+        return self._current().signing[0]
+
+    def sign(self, payload):
+        """Encode payload as a JWT signed with the current key"""
+        kid, algorithm, key = self._current().signing
+        # "typ": "JWT" tells nothing the cookie name doesn't; leaving it out saves 16 bytes per request
+        headers = {'typ': None, 'kid': kid} if kid else {'typ': None}
+        return jwt.encode(payload, key, algorithm=algorithm, headers=headers, json_encoder=UTF8JSONEncoder)
+
+    def decode(self, token):
+        """Verify token and return its payload; raises jwt.InvalidTokenError subclasses"""
+        header = token.partition('.')[0]
+        kid = self._header_kids.get(header, '')
+        if kid == '':
+            kid = jwt.get_unverified_header(token).get('kid')
+        if kid is None:
+            if not self.accept_legacy_hs256:
+                raise jwt.InvalidTokenError("Token has no key id")
+            payload = jwt.decode(token, self.secret, algorithms=['HS256'])
+        else:
+            key = self._current().verify.get(kid)
+            if key is None and self._reload_for_unknown_kid():
+                key = self._keys.verify.get(kid)
+            if key is None:
+                raise jwt.InvalidTokenError(f"Unknown key id {kid}")
+            algorithm, verify_key = key
+            payload = jwt.decode(token, verify_key, algorithms=[algorithm])
+        # Only headers of verified tokens are remembered, so the map stays as small as the key ring
+        if len(self._header_kids) < MAX_HEADER_KIDS:
+            self._header_kids[header] = kid
+        return payload
+
+    def jwks(self):
+        """Return the JWKS document listing every public key accepted for verification"""
+        return self._current().jwks
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+"""
+Server-side revocation of session tokens, shared by every worker
+- Per-user "sessions valid after" times: tokens whose auth_time is not later are rejected
+  (users removed from LDAP, or revoked by an operator)
+- Per-session denylist for /logout, keyed by (user, auth_time, sid) so tokens renewed from the
+  same login are covered too, but not other logins in the same second; a Bloom filter in front of it answers "not revoked" for
+  almost every token without probing the exact table
+Everything lives in one shared memory map: anonymous and inherited through gunicorn
+--preload, or REVOCATION_FILE so revocations survive restarts and can be made from the
+command line. Readers take no lock; writers bump a sequence number before and after each
+change and readers retry if it moved. Entries expire with the last token they cover.
+
+Usage: REVOCATION_FILE=... python session_revocation.py revoke-user <username> [...]
+"""
+
+import argparse
+import fcntl
+import hashlib
+import logging
+import mmap
+import multiprocessing
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Entries per table (users and sessions); about 0.7MB of shared memory at the default
+REVOCATION_SLOTS = int(os.getenv('REVOCATION_SLOTS', '16384'))
+# Optional file (e.g. on a volume) holding the tables, so revocations survive restarts
+REVOCATION_FILE = os.getenv('REVOCATION_FILE', '')
+# Expired entries are dropped and the Bloom filter rebuilt at most this often, by a writer
+REVOCATION_SWEEP_INTERVAL = int(os.getenv('REVOCATION_SWEEP_INTERVAL', '3600'))
+
+# Slots probed per key; a session that finds no room revokes all of its user's sessions instead
+MAX_PROBE = 32
+# A full table is swept at most this often (seconds); revocations in between fail fast instead of re-sweeping
+FULL_SWEEP_BACKOFF = 60
+# About 0.2% false positives with every slot of both tables in use
+BLOOM_BITS_PER_SLOT = 32
+BLOOM_HASHES = 4
+READ_RETRIES = 8
+
+# sequence (odd while a write is in progress), last sweep, sessions revoked, users revoked
+_HEADER = struct.Struct('<Qqqq')
+_SEQUENCE = struct.Struct('<Q')
+# user fingerprint, sessions valid after, expires
+_USER = struct.Struct('<Qqq')
+# session fingerprint, expires
+_SESSION = struct.Struct('<Qq')
+
+
+def fingerprint(text):
+    """Non-zero 64-bit key for a table slot (zero marks an empty slot)"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little') | 1
+
+
+class RevocationFull(Exception):
+    """No free slot for a revocation, even after dropping expired entries"""
+
+
+def user_key(username):
+    return fingerprint(f"u\0{username}")
+
+
+def session_key(username, auth_time, sid=''):
+    # Tokens issued before sessions carried a sid are keyed as they always were
+    if not sid:
+        return fingerprint(f"s\0{username}\0{auth_time}")
+    return fingerprint(f"s\0{username}\0{auth_time}\0{sid}")
+
+
+class RevocationStore:
+    """Per-user valid-after table and per-session denylist in one shared memory map"""
+
+    def __init__(self, max_age, slots=REVOCATION_SLOTS, path=REVOCATION_FILE,
+                 sweep_interval=REVOCATION_SWEEP_INTERVAL):
+        self.max_age = max_age
+        self.slots = slots
+        self.sweep_interval = sweep_interval
+        self.bloom_bits = slots * BLOOM_BITS_PER_SLOT
+        self._users = _HEADER.size
+        self._sessions = self._users + slots * _USER.size
+        self._bloom = self._sessions + slots * _SESSION.size
+        size = self._bloom + self.bloom_bits // 8
+
+        self.path = path or None
+        self._fd = None
+        self._fd_pid = None
+        if self.path:
+            # Threads of one process; other processes are kept out by flock
+            self._lock = threading.Lock()
+            os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+            with self._locked():
+                if os.fstat(self._fd).st_size != size:
+                    # New file, or one laid out for another REVOCATION_SLOTS; start empty
+                    os.ftruncate(self._fd, 0)
+                    os.ftruncate(self._fd, size)
+                self.memory = mmap.mmap(self._fd, size)
+                self._repair()
+        else:
+            # Anonymous maps are MAP_SHARED, and the semaphore survives fork, so workers share both
+            self._lock = multiprocessing.Lock()
+            self.memory = mmap.mmap(-1, size)
+        self._seen = self.sequence()
+
+    def _process_fd(self):
+        # A flock is shared by every process holding the inherited descriptor, so each process opens its own
+        if self._fd_pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR)
+            self._fd_pid = os.getpid()
+        return self._fd
+
+    @contextmanager
+    def _locked(self):
+        with self._lock:
+            if self.path is None:
+                yield
+                return
+            fd = self._process_fd()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _repair(self):
+        # A writer killed mid-change leaves the sequence odd; the lock holder may even it out
+        sequence = self.sequence()
+        if sequence & 1:
+            _SEQUENCE.pack_into(self.memory, 0, sequence + 1)
+
+    @contextmanager
+    def _writing(self):
+        with self._locked():
+            self._repair()
+            sequence = self.sequence()
+            _SEQUENCE.pack_into(self.memory, 0, sequence + 1)
+            try:
+                yield
+            finally:
+                _SEQUENCE.pack_into(self.memory, 0, sequence + 2)
+
+    def sequence(self):
+        return _SEQUENCE.unpack_from(self.memory, 0)[0]
+
+    def changed(self):
+        """True once in this process after each revocation made anywhere"""
+        sequence = self.sequence()
+        if sequence == self._seen:
+            return False
+        self._seen = sequence
+        return True
+
+    def _read(self, func, *args):
+        for _ in range(READ_RETRIES):
+            before = self.sequence()
+            if not before & 1:
+                result = func(*args)
+                if self.sequence() == before:
+                    return result
+        # Writer still busy or died mid-change; read under its lock
+        with self._locked():
+            self._repair()
+            return func(*args)
+
+    def _bloom_positions(self, key):
+        first, second = key & 0xffffffff, (key >> 32) | 1
+        return [(first + i * second) % self.bloom_bits for i in range(BLOOM_HASHES)]
+
+    def _in_bloom(self, key):
+        memory, offset, bits = self.memory, self._bloom, self.bloom_bits
+        first, second = key & 0xffffffff, (key >> 32) | 1
+        # Same positions as _bloom_positions; a key that was never added usually fails on the first bit
+        for i in range(BLOOM_HASHES):
+            bit = (first + i * second) % bits
+            if not memory[offset + (bit >> 3)] & (1 << (bit & 7)):
+                return False
+        return True
+
+    def _add_to_bloom(self, key, memory=None):
+        memory = self.memory if memory is None else memory
+        for bit in self._bloom_positions(key):
+            position = self._bloom + (bit >> 3)
+            memory[position] |= 1 << (bit & 7)
+
+    def _find(self, offset, layout, key, memory=None):
+        """(position, entry) for key, or (position of a free or expired slot, None); position is None if no room"""
+        memory = self.memory if memory is None else memory
+        now = time.time()
+        start = key % self.slots
+        free = None
+        for probe in range(MAX_PROBE):
+            position = offset + ((start + probe) % self.slots) * layout.size
+            entry = layout.unpack_from(memory, position)
+            if entry[0] == key:
+                return position, entry
+            if free is None and (entry[0] == 0 or entry[-1] <= now):
+                free = position
+            if entry[0] == 0:
+                break
+        return free, None
+
+    def _check(self, user, session, auth_time):
+        now = time.time()
+        if self._in_bloom(user):
+            _, entry = self._find(self._users, _USER, user)
+            if entry is not None and entry[2] > now and auth_time <= entry[1]:
+                return True
+        if self._in_bloom(session):
+            _, entry = self._find(self._sessions, _SESSION, session)
+            if entry is not None and entry[1] > now:
+                return True
+        return False
+
+    def is_revoked(self, username, auth_time, sid=''):
+        """True if the session of username that logged in at auth_time (login id sid) has been revoked"""
+        return self._read(self._check, user_key(username), session_key(username, auth_time, sid), auth_time)
+
+    def revoke_session(self, username, auth_time, sid=''):
+        """
+        Revoke one login session (every token renewed from it) until it could no longer be valid.
+        Without room in the session denylist every session of the user is revoked instead.
+        """
+        key = session_key(username, auth_time, sid)
+        expires = auth_time + self.max_age
+        with self._writing():
+            self._sweep_if_due()
+            position, entry = self._find(self._sessions, _SESSION, key)
+            if position is None and self._sweep_when_full():
+                position, entry = self._find(self._sessions, _SESSION, key)
+            if position is not None:
+                _SESSION.pack_into(self.memory, position, key, max(expires, entry[1] if entry else 0))
+                self._add_to_bloom(key)
+                self._count(2)
+                return
+        logger.warning(f"Session denylist full; revoking every session of {username}")
+        self.revoke_user(username, auth_time)
+
+    def revoke_user(self, username, valid_after=None):
+        """
+        Revoke every session of username that logged in at or before valid_after (default: now).
+        Raises RevocationFull if the user table has no room for username.
+        """
+        key = user_key(username)
+        valid_after = int(time.time()) if valid_after is None else valid_after
+        with self._writing():
+            self._sweep_if_due()
+            position, entry = self._find(self._users, _USER, key)
+            if position is None and self._sweep_when_full():
+                position, entry = self._find(self._users, _USER, key)
+            if position is None:
+                raise RevocationFull(f"Revocation table full; could not revoke sessions of {username} "
+                                     f"(raise REVOCATION_SLOTS)")
+            if entry is not None and entry[2] > time.time():
+                valid_after = max(valid_after, entry[1])
+            _USER.pack_into(self.memory, position, key, valid_after, valid_after + self.max_age)
+            self._add_to_bloom(key)
+            self._count(3)
+
+    def _count(self, field):
+        header = list(_HEADER.unpack_from(self.memory, 0))
+        header[field] += 1
+        _HEADER.pack_into(self.memory, 0, *header)
+
+    def _sweep_if_due(self):
+        last_sweep = _HEADER.unpack_from(self.memory, 0)[1]
+        if last_sweep and time.time() - last_sweep >= self.sweep_interval:
+            self._sweep()
+        elif not last_sweep:
+            # Fresh tables; nothing to sweep yet
+            self._set_last_sweep(int(time.time()))
+
+    def _sweep_when_full(self):
+        """Sweep for a revocation that found no room, unless a sweep ran less than FULL_SWEEP_BACKOFF ago"""
+        last_sweep = _HEADER.unpack_from(self.memory, 0)[1]
+        if time.time() - last_sweep < FULL_SWEEP_BACKOFF:
+            return False
+        return self._sweep()
+
+    def _sweep(self):
+        """
+        Drop expired entries and rebuild the Bloom filter from the live ones (under the write lock).
+        The tables are rebuilt in a scratch buffer and copied in only if every live entry fits,
+        so a failed rebuild leaves them as they were. Returns whether the tables were rebuilt.
+        """
+        now = time.time()
+        self._set_last_sweep(int(now))
+        scratch = bytearray(len(self.memory))
+        for offset, layout in ((self._users, _USER), (self._sessions, _SESSION)):
+            for i in range(self.slots):
+                entry = layout.unpack_from(self.memory, offset + i * layout.size)
+                if not entry[0] or entry[-1] <= now:
+                    continue
+                position, _ = self._find(offset, layout, entry[0], scratch)
+                if position is None:
+                    # Reinserted in another order, a cluster can outgrow MAX_PROBE; keep the old tables
+                    logger.error("Revocation table too full to rebuild; keeping expired entries")
+                    return False
+                layout.pack_into(scratch, position, *entry)
+                self._add_to_bloom(entry[0], scratch)
+        self.memory[self._users:] = scratch[self._users:]
+        return True
+
+    def _set_last_sweep(self, when):
+        header = list(_HEADER.unpack_from(self.memory, 0))
+        header[1] = when
+        _HEADER.pack_into(self.memory, 0, *header)
+
+    def stats(self):
+        _, last_sweep, sessions, users = _HEADER.unpack_from(self.memory, 0)
+        return {
+            "slots": self.slots,
+            "file": self.path,
+            "sessions_revoked": sessions,
+            "users_revoked": users,
+            "last_sweep": last_sweep or None
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Revoke OpenGrok sessions in the shared REVOCATION_FILE")
+    parser.add_argument('command', choices=['revoke-user'])
+    parser.add_argument('usernames', nargs='+')
+    args = parser.parse_args()
+    if not REVOCATION_FILE:
+        parser.error("REVOCATION_FILE must point at the file the service uses")
+    # Same as session_auth.SESSION_MAX_AGE, without importing the LDAP settings
+    max_age = int(float(os.getenv('SESSION_MAX_AGE_HOURS', '12')) * 3600)
+    store = RevocationStore(max_age)
+    for username in args.usernames:
+        try:
+            store.revoke_user(username)
+        except RevocationFull as e:
+            parser.exit(1, f"{e}\n")
+        print(f"Revoked sessions of {username}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Shared fixtures: one in-process fake LDAP server (bench/fake_ldap_server.py) for the whole
+run. The service modules read their configuration from the environment at import time,
+so it is set here, before any test module imports them.
+"""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'bench'))
+
+from fake_ldap_server import FakeLDAPServer, USER_PASSWORD  # noqa: E402,F401
+
+# user0001, user0005, ... are in team1 and user0002, user0006, ... in team2; only team1 may read
+# the "secret" project, team1 and team2 the "shared" project
+ldap_server = FakeLDAPServer(users=200, groups=4).start()
+
+os.environ.update({
+    'LDAP_SERVER': ldap_server.url,
+    'USER_DIRECTORY_SYNC': 'false',
+    'PROJECT_GROUPS': 'secret=team1;shared=team1,team2',
+    'RATE_LIMIT': 'false',
+    'JWT_SECRET': 'test-secret',
+    'HEALTH_PROBE_INTERVAL': '1',
+    'LDAP_BREAKER_THRESHOLD': '1000',
+})
+os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_service(filename):
+    """Import a service module by file name (they are not valid module names)"""
+    name = filename.replace('-', '_').removesuffix('.py')
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(SERVICE_DIR, filename))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+@pytest.fixture(scope='session')
+def ldap_directory():
+    return ldap_server
+
+
+@pytest.fixture
+def password():
+    return USER_PASSWORD
@@ -0,0 +1,92 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from conftest import load_service
+from ldap_auth import group_cache
+from session_auth import compact_claims, session_claims, session_keys
+
+PUBLIC_URI = '/source/xref/public/a.c'
+
+
+@pytest.fixture(scope='module')
+def service():
+    return load_service('ldap-auth-service-async.py')
+
+
+def call(app, path, headers=()):
+    """(status, headers) of one ASGI GET request"""
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'', 'client': ('127.0.0.1', 1),
+             'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    start = messages[0]
+    return start['status'], {name.decode('latin-1'): value.decode('latin-1') for name, value in start['headers']}
+
+
+def aged_cookie(username, age):
+    issued = int(time.time()) - age
+    token = session_keys.sign(compact_claims(username, f"uid={username},ou=users,dc=roboetech,dc=com",
+                                             issued, issued + 7200, issued, session_claims(['team1'])))
+    return f"opengrok_session={token}"
+
+
+def test_auth_status_codes(service):
+    assert call(service.app, '/auth', [('X-Original-URI', PUBLIC_URI)])[0] == 401
+    cookie = aged_cookie('user0037', 10)
+    status, headers = call(service.app, '/auth', [('Cookie', cookie), ('X-Original-URI', PUBLIC_URI)])
+    assert status == 200
+    assert headers['x-auth-user'] == 'user0037'
+    assert 'x-auth-session' not in headers
+    assert call(service.app, '/auth', [('Cookie', cookie), ('X-Original-URI', '/source/xref/secret/')])[0] == 200
+    assert call(service.app, '/auth', [('Cookie', cookie)])[0] == 403
+
+
+def test_renewal_runs_off_the_event_loop(service, monkeypatch):
+    threads = []
+    renew_session = service.renew_session
+
+    def recording_renew(token, payload):
+        threads.append(threading.current_thread().name)
+        return renew_session(token, payload)
+
+    monkeypatch.setattr(service, 'renew_session', recording_renew)
+    group_cache.put(('uid=user0041,ou=users,dc=roboetech,dc=com', 'user0041'), ['team1'])
+    status, headers = call(service.app, '/auth', [('Cookie', aged_cookie('user0041', 5000)),
+                                                  ('X-Original-URI', PUBLIC_URI)])
+    assert status == 200
+    assert headers['x-auth-session']
+    assert len(threads) == 1 and threads[0].startswith('ldap')
+
+
+def test_lifespan_starts_prober(service, monkeypatch):
+    from concurrent.futures import ThreadPoolExecutor
+    from ldap_health import LDAPProber
+
+    probed = threading.Event()
+    prober = LDAPProber(probed.set, interval=60)
+    monkeypatch.setattr(service, 'ldap_prober', prober)
+    # Shutdown stops the executor; keep the module's own for the other tests
+    monkeypatch.setattr(service, 'ldap_executor', ThreadPoolExecutor(max_workers=1))
+    messages = iter([{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}])
+    sent = []
+
+    async def receive():
+        return next(messages)
+
+    async def send(message):
+        sent.append(message['type'])
+
+    asyncio.run(service.app({'type': 'lifespan'}, receive, send))
+    assert sent == ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+    assert prober.is_running()
+    assert probed.wait(2)
@@ -0,0 +1,185 @@
+import threading
+import time
+
+from auth_cache import CredentialCache, LoginGuard, RefreshingCache, SingleFlight, TTLCache
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_ttl_cache_expiry():
+    cache = TTLCache(maxsize=10, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2, expires_at=time.time() - 1)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('b', 'default') == 'default'
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    cache = TTLCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('a') == 1
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+
+
+def test_ttl_cache_on_lookup():
+    lookups = []
+    cache = TTLCache(on_lookup=lookups.append)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('b')
+    assert lookups == [True, False]
+
+
+def test_refreshing_cache_loads_once():
+    calls = []
+    cache = RefreshingCache(lambda key: calls.append(key) or key.upper(), ttl=60, stale_ttl=60)
+    assert cache.get('a') == 'A'
+    assert cache.get('a') == 'A'
+    assert calls == ['a']
+
+
+def test_refreshing_cache_does_not_cache_none():
+    calls = []
+    cache = RefreshingCache(lambda key: calls.append(key), ttl=60, stale_ttl=60)
+    assert cache.get('a') is None
+    assert cache.get('a') is None
+    assert calls == ['a', 'a']
+
+
+def test_refreshing_cache_serves_stale_and_refreshes():
+    loaded = threading.Event()
+    release = threading.Event()
+
+    def loader(key):
+        release.wait(2)
+        loaded.set()
+        return 'new'
+
+    cache = RefreshingCache(loader, ttl=60, stale_ttl=60)
+    cache.put('a', 'old', loaded_at=time.time() - 90)
+    # Stale but within stale_ttl: served at once, reloaded in the background once
+    assert cache.get('a') == 'old'
+    assert cache.get('a') == 'old'
+    release.set()
+    wait_for(lambda: cache.refreshes == 1)
+    assert cache.get('a') == 'new'
+    assert cache.stale_hits == 2
+
+
+def test_refreshing_cache_drops_entries_past_stale_ttl():
+    cache = RefreshingCache(lambda key: 'new', ttl=60, stale_ttl=60)
+    cache.put('a', 'old', loaded_at=time.time() - 150)
+    assert cache.peek('a') is None
+    assert cache.get('a') == 'new'
+
+
+def test_get_nowait_loads_in_background():
+    release = threading.Event()
+    cache = RefreshingCache(lambda key: release.wait(2) and key.upper(), ttl=60, stale_ttl=60)
+    assert cache.get_nowait('a') is None
+    assert cache.get_nowait('a') is None
+    release.set()
+    wait_for(lambda: cache.peek('a') is not None)
+    assert cache.get_nowait('a') == 'A'
+    assert cache.refreshes == 1
+
+
+def test_refresh_failure_keeps_stale_value():
+    def loader(key):
+        raise RuntimeError("directory down")
+
+    cache = RefreshingCache(loader, ttl=60, stale_ttl=60)
+    cache.put('a', 'old', loaded_at=time.time() - 90)
+    assert cache.get('a') == 'old'
+    wait_for(lambda: not cache._refreshing)
+    assert cache.get('a') == 'old'
+
+
+def test_revalidate_is_throttled_by_entry_age():
+    loads = []
+    cache = RefreshingCache(lambda key: loads.append(key) or 'new', ttl=60, stale_ttl=60)
+    cache.put('a', 'old', loaded_at=time.time() - 5)
+    # Loaded 5s ago: not old enough to re-check, and the entry stays
+    assert not cache.revalidate('a', 10)
+    assert cache.peek('a') == 'old' and loads == []
+    assert cache.revalidate('a', 1)
+    wait_for(lambda: cache.peek('a') == 'new')
+    # Just reloaded, so the next failure doesn't reload again
+    assert not cache.revalidate('a', 1)
+    assert loads == ['a']
+
+
+def test_single_flight_shares_one_call():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        started.set()
+        release.wait(2)
+        return value * 2
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('k', work, 21)))
+    leader.start()
+    started.wait(2)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', work, 21))) for _ in range(4)]
+    for thread in followers:
+        thread.start()
+    wait_for(lambda: flight.shared == 4)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(2)
+    assert calls == [21]
+    assert results == [42] * 5
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("boom")
+
+    for _ in range(2):
+        try:
+            flight.do('k', fail)
+        except ValueError as e:
+            assert str(e) == "boom"
+        else:
+            raise AssertionError("expected ValueError")
+
+
+def test_credential_cache():
+    cache = CredentialCache(ttl=60, iterations=1)
+    cache.set('alice', 'secret', {'dn': 'uid=alice'})
+    assert cache.get('alice', 'secret') == {'dn': 'uid=alice'}
+    assert cache.get('alice', 'wrong') is None
+    cache.evict('alice')
+    assert cache.get('alice', 'secret') is None
+
+
+def test_login_guard_replays_failures():
+    calls = []
+
+    def authenticate(username, password):
+        calls.append(username)
+        return (True, {}) if password == 'right' else (False, "Invalid credentials")
+
+    guard = LoginGuard(ttl=60)
+    assert guard.call(authenticate, 'alice', 'wrong') == (False, "Invalid credentials")
+    assert guard.call(authenticate, 'alice', 'wrong') == (False, "Invalid credentials")
+    assert guard.call(authenticate, 'alice', 'right') == (True, {})
+    assert calls == ['alice', 'alice']
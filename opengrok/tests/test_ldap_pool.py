@@ -0,0 +1,198 @@
+import socket
+import threading
+
+import ldap
+import pytest
+
+import ldap_pool
+from conftest import USER_PASSWORD
+from ldap_pool import (CircuitBreaker, CircuitBreakerGroup, CircuitOpen, LDAPConnectionPool, LDAPPoolGroup,
+                       PoolExhausted, ServerSelector)
+
+USER_DN = 'uid=user0001,ou=users,dc=roboetech,dc=com'
+
+
+def user_bind(conn):
+    return conn.simple_bind_s(USER_DN, USER_PASSWORD)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ldap_pool.time, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture(scope='module')
+def dead_server():
+    """URL of a port nothing listens on"""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return f"ldap://127.0.0.1:{port}"
+
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.allow()
+        breaker.failure()
+    breaker.allow()
+    breaker.success()
+    for _ in range(3):
+        breaker.allow()
+        breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    assert breaker.retry_after() == 30
+    clock[0] += 10
+    assert breaker.retry_after() == 20
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_breaker_half_open_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, half_open_trials=1)
+    breaker.allow()
+    breaker.failure()
+    clock[0] += 30
+    breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.allow()
+    # A trial whose outcome says nothing about LDAP frees its place
+    breaker.release()
+    breaker.allow()
+    breaker.success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.allow()
+
+
+def test_breaker_reopens_on_failed_trial(clock):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    breaker.allow()
+    breaker.failure()
+    clock[0] += 30
+    breaker.allow()
+    breaker.failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.retry_after() == 30
+    assert breaker.times_opened == 2
+
+
+def test_breaker_group(clock):
+    group = CircuitBreakerGroup(['ldap://a', 'ldap://b'], failure_threshold=1, reset_timeout=30)
+    group.get('ldap://a').failure()
+    assert group.retry_after() == 0
+    group.get('ldap://b').failure()
+    clock[0] += 5
+    assert group.retry_after() == 25
+    assert set(group.stats()) == {'ldap://a', 'ldap://b'}
+    assert CircuitBreakerGroup(['ldap://a']).stats()['state'] == 'closed'
+
+
+def test_pool_reuses_connections(ldap_directory):
+    pool = LDAPConnectionPool(ldap_directory.url, size=2)
+    for _ in range(5):
+        pool.bind(USER_DN, USER_PASSWORD)
+    assert pool.opened == 1
+    assert pool.stats()['idle'] == 1
+    with pytest.raises(ldap.INVALID_CREDENTIALS):
+        pool.bind(USER_DN, 'wrong')
+    with pytest.raises(ldap.INVALID_CREDENTIALS):
+        pool.bind(USER_DN, '')
+    # Wrong passwords leave the connection usable
+    assert pool.opened == 1 and pool.discarded == 0
+
+
+def test_server_down_is_retried_once_on_a_fresh_connection(ldap_directory):
+    breaker = CircuitBreaker(failure_threshold=5)
+    pool = LDAPConnectionPool(ldap_directory.url, size=2, breaker=breaker)
+    calls = []
+
+    def flaky(conn):
+        calls.append(conn)
+        if len(calls) == 1:
+            raise ldap.SERVER_DOWN({"desc": "Can't contact LDAP server"})
+        return user_bind(conn)
+
+    pool.run(flaky)
+    assert len(calls) == 2 and calls[0] is not calls[1]
+    assert pool.discarded == 1
+    assert breaker.failures == 0
+
+    def down(conn):
+        raise ldap.SERVER_DOWN({"desc": "Can't contact LDAP server"})
+
+    with pytest.raises(ldap.SERVER_DOWN):
+        pool.run(down)
+    assert pool.discarded == 3
+    assert breaker.failures == 2
+    assert pool.stats()['open'] == 0
+
+
+def test_pool_exhaustion(ldap_directory):
+    breaker = CircuitBreaker(failure_threshold=1)
+    pool = LDAPConnectionPool(ldap_directory.url, size=1, acquire_timeout=0.1, breaker=breaker)
+    conn = pool.acquire()
+    with pytest.raises(PoolExhausted):
+        pool.run(user_bind)
+    # A busy pool says nothing about the server
+    assert breaker.state == CircuitBreaker.CLOSED
+    released = threading.Timer(0.05, pool.release, args=(conn,))
+    released.start()
+    pool.acquire_timeout = 2
+    pool.run(user_bind)
+    released.join()
+
+
+def test_breaker_stops_calls_to_dead_server(dead_server):
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    pool = LDAPConnectionPool(dead_server, connect_timeout=1, breaker=breaker)
+    # The call and its reconnect attempt are two failures
+    with pytest.raises(ldap.SERVER_DOWN):
+        pool.bind(USER_DN, USER_PASSWORD)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpen):
+        pool.bind(USER_DN, USER_PASSWORD)
+
+
+def test_failover_to_live_replica(ldap_directory, dead_server):
+    servers = [dead_server, ldap_directory.url]
+    selector = ServerSelector(servers, backoff=60)
+    group = LDAPPoolGroup(servers, selector, connect_timeout=1)
+    for _ in range(10):
+        group.bind(USER_DN, USER_PASSWORD)
+    assert selector.stats()[dead_server]['status'] == 'down'
+    assert selector.order() == [ldap_directory.url, dead_server]
+    with pytest.raises(ldap.INVALID_CREDENTIALS):
+        group.bind(USER_DN, 'wrong')
+
+
+def test_open_breaker_fails_over(ldap_directory, dead_server):
+    servers = [dead_server, ldap_directory.url]
+    selector = ServerSelector(servers, backoff=0)
+    breakers = CircuitBreakerGroup(servers, failure_threshold=2, reset_timeout=60)
+    group = LDAPPoolGroup(servers, selector, breakers=breakers, connect_timeout=1)
+    with pytest.raises(ldap.SERVER_DOWN):
+        group.pools[dead_server].bind(USER_DN, USER_PASSWORD)
+    assert breakers.get(dead_server).state == CircuitBreaker.OPEN
+    # The dead replica's open breaker must not fail calls the live one can answer
+    for _ in range(10):
+        selector.mark_up(dead_server)
+        group.bind(USER_DN, USER_PASSWORD)
+    assert breakers.get(ldap_directory.url).state == CircuitBreaker.CLOSED
+    assert breakers.get(dead_server).rejected > 0
+    assert breakers.retry_after() == 0
+
+
+def test_every_replica_down(dead_server):
+    servers = [dead_server, dead_server.replace('127.0.0.1', 'localhost')]
+    breakers = CircuitBreakerGroup(servers, failure_threshold=2, reset_timeout=60)
+    group = LDAPPoolGroup(servers, ServerSelector(servers), breakers=breakers, connect_timeout=1)
+    with pytest.raises(ldap.SERVER_DOWN):
+        group.bind(USER_DN, USER_PASSWORD)
+    with pytest.raises(CircuitOpen):
+        group.bind(USER_DN, USER_PASSWORD)
+    assert breakers.retry_after() > 0
@@ -0,0 +1,61 @@
+from prometheus_client import REGISTRY
+
+from auth_cache import RefreshingCache
+from metrics import ClosingBody, MetricsMiddleware, cache_observer
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def streaming_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'application/x-ndjson')])
+    yield b'{"line": 1}\n'
+    yield b'{"line": 2}\n'
+
+
+def test_request_recorded_when_body_is_closed():
+    app = MetricsMiddleware(streaming_app)
+    requests = sample('opengrok_auth_requests_total', endpoint='/validate/batch', status='200')
+    in_flight = sample('opengrok_auth_requests_in_flight', endpoint='/validate/batch')
+
+    body = app({'PATH_INFO': '/validate/batch'}, lambda status, headers, exc_info=None: None)
+    assert next(iter(body)) == b'{"line": 1}\n'
+    # Still streaming: in flight, not yet counted
+    assert sample('opengrok_auth_requests_in_flight', endpoint='/validate/batch') == in_flight + 1
+    assert sample('opengrok_auth_requests_total', endpoint='/validate/batch', status='200') == requests
+    body.close()
+    body.close()
+    assert sample('opengrok_auth_requests_in_flight', endpoint='/validate/batch') == in_flight
+    assert sample('opengrok_auth_requests_total', endpoint='/validate/batch', status='200') == requests + 1
+
+
+def test_failed_request_recorded_at_once():
+    def failing_app(environ, start_response):
+        raise RuntimeError("boom")
+
+    app = MetricsMiddleware(failing_app)
+    requests = sample('opengrok_auth_requests_total', endpoint='/validate', status='500')
+    try:
+        app({'PATH_INFO': '/validate'}, None)
+    except RuntimeError:
+        pass
+    assert sample('opengrok_auth_requests_total', endpoint='/validate', status='500') == requests + 1
+    assert sample('opengrok_auth_requests_in_flight', endpoint='/validate') == 0
+
+
+def test_untracked_paths_pass_through():
+    body = MetricsMiddleware(streaming_app)({'PATH_INFO': '/metrics'}, lambda *args: None)
+    assert not isinstance(body, ClosingBody)
+
+
+def test_peek_is_not_a_lookup():
+    cache = RefreshingCache(lambda key: key.upper(), on_lookup=cache_observer('test'))
+    cache.get('a')
+    hits = sample('opengrok_auth_cache_lookups_total', cache='test', result='hit')
+    misses = sample('opengrok_auth_cache_lookups_total', cache='test', result='miss')
+    assert cache.peek('a') == 'A'
+    assert cache.peek('b') is None
+    assert sample('opengrok_auth_cache_lookups_total', cache='test', result='hit') == hits
+    assert sample('opengrok_auth_cache_lookups_total', cache='test', result='miss') == misses
+    assert cache.stats()['hits'] == 0 and cache.stats()['misses'] == 1
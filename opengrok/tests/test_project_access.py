@@ -0,0 +1,58 @@
+from project_access import GROUP_VERSION, group_bitmap, is_allowed, requested_projects, session_bits
+
+TEAM1 = group_bitmap(['team1'])
+TEAM2 = group_bitmap(['TEAM2'])
+
+
+def test_requested_projects_from_path():
+    assert requested_projects('/source/xref/secret/src/main.c') == ('/source/xref/secret/src/main.c', ['secret'])
+    assert requested_projects('/source/api/v1/projects/secret/files')[1] == ['secret']
+    assert requested_projects('/source/')[1] == []
+
+
+def test_requested_projects_normalizes_path():
+    assert requested_projects('/source/xref/public/../secret/a.c')[1] == ['secret']
+    assert requested_projects('/source/xref/%73ecret/a.c')[1] == ['secret']
+    assert requested_projects('/source/xref;jsessionid=1/secret/a.c')[1] == ['secret']
+    assert requested_projects('/source//xref//secret/a.c')[1] == ['secret']
+
+
+def test_requested_projects_from_parameters():
+    assert requested_projects('/source/search?full=x&project=public&project=secret')[1] == ['public', 'secret']
+    assert requested_projects('/source/api/v1/search?full=x&projects=public,secret')[1] == ['public', 'secret']
+    assert requested_projects('/source/api/v1/file/content?path=/secret/a.c')[1] == ['secret']
+    assert requested_projects('/source/diff/public/a.c?r1=/secret/a.c@1&r2=/public/a.c@2')[1] == [
+        'public', 'secret', 'public']
+
+
+def test_is_allowed_by_group():
+    uri = '/source/xref/secret/a.c'
+    assert is_allowed(TEAM1, uri)
+    assert not is_allowed(TEAM2, uri)
+    assert not is_allowed(0, uri)
+    assert is_allowed(TEAM2, '/source/xref/shared/a.c')
+    assert is_allowed(0, '/source/xref/public/a.c')
+
+
+def test_every_selected_project_is_checked():
+    assert not is_allowed(TEAM2, '/source/search?full=x&project=shared&project=secret')
+    assert not is_allowed(TEAM2, '/source/api/v1/file/content?path=/public/../secret/a.c')
+    assert not is_allowed(TEAM2, '/source/diff/public/a.c?r1=/secret/a.c@1&r2=/public/a.c@2')
+
+
+def test_search_without_project():
+    assert is_allowed(TEAM1, '/source/search?full=x')
+    assert not is_allowed(TEAM2, '/source/search?full=x')
+    assert not is_allowed(TEAM2, '/source/api/v1/search?full=x')
+    assert is_allowed(TEAM2, '/source/search?full=x&project=shared')
+
+
+def test_missing_uri_is_denied():
+    assert not is_allowed(TEAM1 | TEAM2, None)
+    assert not is_allowed(TEAM1 | TEAM2, '')
+
+
+def test_session_bits_ignores_other_group_tables():
+    assert session_bits({'grp': TEAM1, 'gv': GROUP_VERSION}) == TEAM1
+    assert session_bits({'grp': TEAM1, 'gv': 'other'}) == 0
+    assert session_bits({}) == 0
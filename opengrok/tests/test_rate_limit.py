@@ -0,0 +1,87 @@
+import pytest
+
+import rate_limit
+from rate_limit import RateLimiter, client_ip, retry_after_header
+
+
+@pytest.fixture
+def limiter():
+    return RateLimiter(slots=64, user_burst=2, user_per_minute=60, ip_burst=3, ip_per_minute=60)
+
+
+def test_user_bucket(limiter):
+    assert limiter.check('alice') == 0
+    assert limiter.check('Alice') == 0
+    wait = limiter.check('ALICE')
+    assert 0 < wait <= 1
+    assert limiter.check('bob') == 0
+    assert limiter.stats()['limited_user'] == 1
+
+
+def test_ip_bucket(limiter):
+    for n in range(3):
+        assert limiter.check(f"user{n}", '10.0.0.1') == 0
+    assert limiter.check('user9', '10.0.0.1') > 0
+    assert limiter.check('user9', '10.0.0.2') == 0
+    assert limiter.stats()['limited_ip'] == 1
+
+
+def test_bucket_refills(limiter, monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: now)
+    limiter.check('alice')
+    limiter.check('alice')
+    assert limiter.check('alice') > 0
+    now += 1.5
+    assert limiter.check('alice') == 0
+    assert limiter.check('alice') > 0
+
+
+def test_limited_attempts_do_not_go_negative(limiter, monkeypatch):
+    now = 1_000_000.0
+    monkeypatch.setattr(rate_limit.time, 'time', lambda: now)
+    for _ in range(50):
+        limiter.check('alice')
+    now += 1
+    assert limiter.check('alice') == 0
+
+
+def test_buckets_survive_slot_collisions():
+    limiter = RateLimiter(slots=2, user_burst=1, user_per_minute=1, ip_burst=1, ip_per_minute=1)
+    assert limiter.check('alice') == 0
+    assert limiter.check('bob') == 0
+    assert limiter.check('alice') > 0
+    assert limiter.check('bob') > 0
+
+
+def test_client_ip(monkeypatch):
+    assert client_ip('203.0.113.7', '172.18.0.5') == '203.0.113.7'
+    assert client_ip('198.51.100.1, 203.0.113.7', '172.18.0.5') == '203.0.113.7'
+    monkeypatch.setattr(rate_limit, 'TRUSTED_PROXY_HOPS', 2)
+    assert client_ip('198.51.100.1, 203.0.113.7', '172.18.0.5') == '198.51.100.1'
+
+
+def test_no_client_ip_without_forwarded_for(monkeypatch, caplog):
+    # The peer is nginx; bucketing on it would make every user share one IP bucket
+    monkeypatch.setattr(rate_limit, '_last_missing_client_warning', 0.0)
+    assert client_ip(None, '172.18.0.5') == ''
+    assert client_ip('', '172.18.0.5') == ''
+    assert [record.levelname for record in caplog.records] == ['WARNING']
+    monkeypatch.setattr(rate_limit, 'TRUSTED_PROXY_HOPS', 2)
+    assert client_ip('203.0.113.7', '172.18.0.5') == ''
+
+
+def test_direct_exposure_uses_peer(monkeypatch):
+    monkeypatch.setattr(rate_limit, 'TRUSTED_PROXY_HOPS', 0)
+    assert client_ip('198.51.100.1', '203.0.113.7') == '203.0.113.7'
+
+
+def test_missing_client_skips_ip_bucket(limiter):
+    for n in range(10):
+        assert limiter.check(f"user{n}", client_ip(None, '172.18.0.5')) == 0
+    assert limiter.stats()['limited_ip'] == 0
+
+
+def test_retry_after_header():
+    assert retry_after_header(0.2) == '1'
+    assert retry_after_header(12.1) == '13'
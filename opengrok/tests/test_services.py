@@ -0,0 +1,121 @@
+import base64
+import importlib.util
+import os
+
+import pytest
+
+import ldap_auth
+from conftest import SERVICE_DIR, load_service
+
+SECRET_URI = '/source/xref/secret/a.c'
+PUBLIC_URI = '/source/xref/public/a.c'
+
+
+def basic(username, password):
+    return 'Basic ' + base64.b64encode(f"{username}:{password}".encode('utf-8')).decode('ascii')
+
+
+@pytest.fixture(scope='module')
+def v1():
+    return load_service('ldap-auth-service.py').app.test_client(use_cookies=False)
+
+
+@pytest.fixture(scope='module')
+def v2():
+    return load_service('ldap-auth-service-v2.py').app.test_client(use_cookies=False)
+
+
+def auth(client, uri=PUBLIC_URI, **headers):
+    """/auth as nginx sends it: X-Original-URI set, plus the given headers"""
+    if uri is not None:
+        headers['X-Original-URI'] = uri
+    return client.get('/auth', headers=headers)
+
+
+def login(client, username, password):
+    response = client.post('/login', data={'username': username, 'password': password})
+    assert response.status_code == 302
+    cookie = response.headers['Set-Cookie']
+    return cookie.split(';')[0]
+
+
+def test_v1_auth(v1, password):
+    assert auth(v1).status_code == 401
+    assert auth(v1, Authorization='Basic !!!').status_code == 401
+    assert auth(v1, Authorization=basic('user0001', 'wrong')).status_code == 401
+    assert auth(v1, Authorization=basic('nobody', password)).status_code == 401
+    response = auth(v1, Authorization=basic('user0001', password))
+    assert response.status_code == 200
+    assert response.headers['X-Auth-User'] == 'user0001'
+    assert response.headers['X-Auth-DN'] == 'uid%3Duser0001%2Cou%3Dusers%2Cdc%3Droboetech%2Cdc%3Dcom'
+
+
+def test_wrong_password_keeps_cached_dn(v1, password):
+    assert ldap_auth.authenticate_ldap('user0031', password)[0]
+    entry = ldap_auth.user_cache.peek('user0031')
+    refreshes = ldap_auth.user_cache.refreshes
+    for attempt in range(5):
+        assert auth(v1, Authorization=basic('user0031', f'wrong{attempt}')).status_code == 401
+    # The DN was loaded moments ago, so failed binds neither drop it nor search again
+    assert ldap_auth.user_cache.peek('user0031') == entry
+    assert ldap_auth.user_cache.refreshes == refreshes
+
+
+def test_v1_project_access(v1, password):
+    assert auth(v1, uri=SECRET_URI, Authorization=basic('user0005', password)).status_code == 200
+    assert auth(v1, uri=SECRET_URI, Authorization=basic('user0006', password)).status_code == 403
+
+
+def test_missing_original_uri_is_denied(v1, v2, password):
+    assert auth(v1, uri=None, Authorization=basic('user0005', password)).status_code == 403
+    assert auth(v1, uri='', Authorization=basic('user0005', password)).status_code == 403
+    cookie = login(v2, 'user0005', password)
+    assert auth(v2, uri=None, Cookie=cookie).status_code == 403
+
+
+def test_v2_auth_requires_session(v2):
+    assert auth(v2).status_code == 401
+    assert auth(v2, Cookie='opengrok_session=garbage').status_code == 401
+
+
+def test_v2_login_and_auth(v2, password):
+    cookie = login(v2, 'user0009', password)
+    response = auth(v2, Cookie=cookie)
+    assert response.status_code == 200
+    assert response.headers['X-Auth-User'] == 'user0009'
+    assert auth(v2, Cookie=cookie, uri=SECRET_URI).status_code == 200
+
+
+def test_v2_failed_login(v2):
+    response = v2.post('/login', data={'username': 'user0009', 'password': 'wrong'})
+    assert response.status_code == 200
+    assert 'Set-Cookie' not in response.headers
+
+
+def test_v2_project_access(v2, password):
+    cookie = login(v2, 'user0010', password)
+    assert auth(v2, Cookie=cookie, uri=SECRET_URI).status_code == 403
+    assert auth(v2, Cookie=cookie, uri='/source/xref/shared/').status_code == 200
+
+
+def test_v2_logout_revokes_session(v2, password):
+    cookie = login(v2, 'user0013', password)
+    assert auth(v2, Cookie=cookie).status_code == 200
+    assert v2.get('/logout', headers={'Cookie': cookie}).status_code == 200
+    assert auth(v2, Cookie=cookie).status_code == 401
+
+
+def test_v2_basic_upgrade(v2, password):
+    response = auth(v2, Authorization=basic('user0014', password))
+    assert response.status_code == 200
+    token = response.headers['X-Auth-Session']
+    assert auth(v2, Authorization=f"Bearer {token}").status_code == 200
+    assert auth(v2, Authorization=basic('user0014', 'wrong')).status_code == 401
+
+
+def test_gunicorn_worker_boot_starts_prober(v1):
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', os.path.join(SERVICE_DIR, 'gunicorn.conf.py'))
+    config = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(config)
+    config.post_worker_init(None)
+    assert ldap_auth.ldap_prober.is_running()
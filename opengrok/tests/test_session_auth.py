@@ -0,0 +1,177 @@
+import threading
+import time
+
+import pytest
+
+import session_auth
+from ldap_auth import group_cache
+from project_access import group_bitmap, session_bits
+from session_auth import (SESSION_MAX_AGE, check_session, compact_claims, create_session_token, renew_session,
+                          revoke_session, session_keys, verify_session_token)
+
+
+def user_info(username, groups=('team1',)):
+    return {'username': username, 'dn': f"uid={username},ou=users,dc=roboetech,dc=com", 'groups': list(groups)}
+
+
+def dn(username):
+    return f"uid={username},ou=users,dc=roboetech,dc=com"
+
+
+def cache_groups(username, groups=('team1',)):
+    group_cache.put((dn(username), username), list(groups))
+
+
+def wait_for(condition, timeout=2):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def aged_token(username, age, lifetime=7200, auth_time=None, groups=('team1',), sid=None):
+    """A session token issued age seconds ago"""
+    issued = int(time.time()) - age
+    auth_time = issued if auth_time is None else auth_time
+    extra = session_auth.session_claims(list(groups))
+    return session_keys.sign(compact_claims(username, f"uid={username},ou=users,dc=roboetech,dc=com",
+                                            issued, issued + lifetime, auth_time, extra, sid))
+
+
+def test_issue_and_verify():
+    token = create_session_token(user_info('user0001'))
+    valid, payload = verify_session_token(token)
+    assert valid
+    assert payload['username'] == 'user0001'
+    assert payload['dn'] == 'uid=user0001,ou=users,dc=roboetech,dc=com'
+    assert session_bits(payload) == group_bitmap(['team1'])
+    assert 'd' not in payload and 'auth_time' not in payload
+
+
+def test_non_default_dn_is_kept():
+    info = dict(user_info('user0001'), dn='uid=user0001,ou=people,dc=roboetech,dc=com')
+    valid, payload = verify_session_token(create_session_token(info))
+    assert payload['dn'] == 'uid=user0001,ou=people,dc=roboetech,dc=com'
+
+
+def test_tampered_and_expired_tokens():
+    token = create_session_token(user_info('user0001'))
+    assert verify_session_token(token[:-2] + ('AA' if token[-2:] != 'AA' else 'BB')) == (False, "Invalid session")
+    assert verify_session_token(aged_token('user0001', 7300)) == (False, "Session expired")
+
+
+def test_check_session_is_cached():
+    token = create_session_token(user_info('user0009'))
+    valid, (payload, headers, body, bare_headers) = check_session(token)
+    assert valid
+    assert headers['X-Auth-User'] == 'user0009'
+    assert ('Content-Length', '0') in bare_headers
+    hits = session_auth.session_cache.hits
+    assert check_session(token)[0]
+    assert session_auth.session_cache.hits == hits + 1
+
+
+def test_no_renewal_before_renew_point():
+    token = create_session_token(user_info('user0029'))
+    assert renew_session(token, verify_session_token(token)[1]) is None
+
+
+def test_renewal_keeps_auth_time():
+    cache_groups('user0001')
+    auth_time = int(time.time()) - 5000
+    token = aged_token('user0001', 5000, auth_time=auth_time, sid='login1')
+    payload = verify_session_token(token)[1]
+    renewed = renew_session(token, payload)
+    assert renewed
+    # Signed once; concurrent and later subrequests with the old token get the same renewal
+    assert renew_session(token, payload) == renewed
+    valid, renewed_payload = verify_session_token(renewed)
+    assert valid
+    assert renewed_payload['exp'] > payload['exp']
+    assert renewed_payload['auth_time'] == auth_time
+    assert renewed_payload.get('sid') == payload.get('sid')
+
+
+def test_renewal_stops_at_max_age():
+    auth_time = int(time.time()) - SESSION_MAX_AGE + 60
+    token = aged_token('user0001', 5000, auth_time=auth_time, lifetime=5060)
+    assert renew_session(token, verify_session_token(token)[1]) is None
+
+
+def test_renewal_recomputes_groups():
+    # user0002 is in team2 only; a token still claiming team1 loses it on renewal
+    token = aged_token('user0002', 5000, groups=('team1',))
+    payload = verify_session_token(token)[1]
+    # Groups not cached yet: no renewal this time, they are loaded in the background
+    assert renew_session(token, payload) is None
+    wait_for(lambda: group_cache.peek((dn('user0002'), 'user0002')) is not None)
+    renewed = renew_session(token, payload)
+    assert session_bits(verify_session_token(renewed)[1]) == group_bitmap(['team2'])
+
+
+def test_renewal_never_waits_on_ldap(monkeypatch):
+    release = threading.Event()
+    loads = []
+
+    def slow_loader(key):
+        loads.append(key)
+        release.wait(5)
+        return ['team1']
+
+    monkeypatch.setattr(group_cache, 'loader', slow_loader)
+    token = aged_token('user0033', 5000)
+    payload = verify_session_token(token)[1]
+    started = time.monotonic()
+    assert renew_session(token, payload) is None
+    assert renew_session(token, payload) is None
+    assert time.monotonic() - started < 1
+    release.set()
+    wait_for(lambda: group_cache.peek((dn('user0033'), 'user0033')) is not None)
+    assert renew_session(token, payload)
+    assert len(loads) == 1
+
+
+def test_revoke_session():
+    token = create_session_token(user_info('user0017'))
+    other = create_session_token(user_info('user0021'))
+    assert check_session(token)[0]
+    assert revoke_session(token)
+    assert check_session(token) == (False, "Session revoked")
+    assert check_session(other)[0]
+
+
+def test_logout_leaves_other_logins_in_the_same_second():
+    first = create_session_token(user_info('user0045'))
+    second = create_session_token(user_info('user0045'))
+    assert verify_session_token(first)[1]['iat'] == verify_session_token(second)[1]['iat']
+    assert revoke_session(first)
+    assert verify_session_token(first) == (False, "Session revoked")
+    assert verify_session_token(second)[0]
+
+
+def test_revoke_token_without_sid():
+    token = aged_token('user0049', 10)
+    assert 'sid' not in verify_session_token(token)[1]
+    assert revoke_session(token)
+    assert verify_session_token(token) == (False, "Session revoked")
+
+
+def test_revoke_covers_renewed_tokens():
+    cache_groups('user0025')
+    token = aged_token('user0025', 5000, sid='login1')
+    renewed = renew_session(token, verify_session_token(token)[1])
+    assert revoke_session(token)
+    assert verify_session_token(renewed) == (False, "Session revoked")
+
+
+def test_revoke_invalid_token():
+    assert not revoke_session('not-a-token')
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('opengrok_session=abc', 'abc'),
+    ('theme=dark; opengrok_session="abc"; lang=ko', 'abc'),
+    ('theme=dark', None),
+])
+def test_session_cookie(header, expected):
+    assert session_auth.session_cookie(header) == expected
@@ -0,0 +1,164 @@
+import base64
+import json
+import os
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+import session_keys
+from session_keys import SessionKeys
+
+SECRET = 'shared-secret'
+CLAIMS = {'sub': 'alice', 'exp': 4102444800}
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(json.dumps(data).encode('utf-8')).rstrip(b'=').decode('ascii')
+
+
+def forged(header, claims=CLAIMS, signature='c2ln'):
+    return f"{b64(header)}.{b64(claims)}.{signature}"
+
+
+def write_private_key(path, mtime=None):
+    key = ec.generate_private_key(ec.SECP256R1())
+    with open(path, 'wb') as f:
+        f.write(key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                  serialization.NoEncryption()))
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+    return key
+
+
+def write_secret(path, secret, mtime):
+    with open(path, 'w') as f:
+        f.write(secret)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def es256(tmp_path):
+    path = str(tmp_path / 'signing.pem')
+    write_private_key(path)
+    return SessionKeys(SECRET, algorithm='ES256', private_key_file=path)
+
+
+@pytest.fixture
+def ring(tmp_path):
+    path = tmp_path / 'ring'
+    path.mkdir()
+    write_secret(str(path / 'k1'), 'first-secret', time.time() - 100)
+    return path
+
+
+def test_hs256_round_trip():
+    keys = SessionKeys(SECRET)
+    assert keys.decode(keys.sign(CLAIMS)) == CLAIMS
+    assert 'kid' not in jwt.get_unverified_header(keys.sign(CLAIMS))
+
+
+def test_es256_round_trip_and_jwks(es256):
+    token = es256.sign(CLAIMS)
+    assert jwt.get_unverified_header(token)['kid'] == es256.kid
+    assert es256.decode(token) == CLAIMS
+    [jwk] = es256.jwks()['keys']
+    assert jwk['kid'] == es256.kid and jwk['alg'] == 'ES256' and 'd' not in jwk
+
+
+def test_kid_less_token_rejected_outside_hs256_mode(es256, ring):
+    legacy = jwt.encode(CLAIMS, SECRET, algorithm='HS256')
+    with pytest.raises(jwt.InvalidTokenError, match="no key id"):
+        es256.decode(legacy)
+    with pytest.raises(jwt.InvalidTokenError, match="no key id"):
+        SessionKeys(SECRET, keyring_path=str(ring)).decode(legacy)
+
+
+def test_kid_less_token_accepted_in_legacy_mode(tmp_path):
+    path = str(tmp_path / 'signing.pem')
+    write_private_key(path)
+    keys = SessionKeys(SECRET, algorithm='ES256', private_key_file=path, accept_legacy_hs256=True)
+    assert keys.decode(jwt.encode(CLAIMS, SECRET, algorithm='HS256')) == CLAIMS
+    with pytest.raises(jwt.InvalidSignatureError):
+        keys.decode(jwt.encode(CLAIMS, 'other-secret', algorithm='HS256'))
+
+
+@pytest.mark.parametrize('header', [{'alg': 'none'}, {'alg': 'none', 'typ': 'JWT'}])
+def test_alg_none_rejected(header, es256):
+    with pytest.raises(jwt.InvalidTokenError):
+        SessionKeys(SECRET).decode(forged(header, signature=''))
+    with pytest.raises(jwt.InvalidTokenError):
+        es256.decode(forged(dict(header, kid=es256.kid), signature=''))
+
+
+def test_algorithm_must_match_key(es256):
+    # HS256 token claiming the ES256 key's kid: verified only with ES256, so rejected
+    token = jwt.encode(CLAIMS, SECRET, algorithm='HS256', headers={'kid': es256.kid})
+    with pytest.raises(jwt.InvalidTokenError):
+        es256.decode(token)
+
+
+@pytest.mark.parametrize('kid', [['k1'], 7, {'kid': 'k1'}, True])
+def test_non_string_kid_rejected(kid, ring):
+    keys = SessionKeys(SECRET, keyring_path=str(ring))
+    with pytest.raises(jwt.InvalidTokenError):
+        keys.decode(forged({'alg': 'HS256', 'kid': kid}))
+
+
+def test_unknown_kid_rejected(ring):
+    keys = SessionKeys(SECRET, keyring_path=str(ring))
+    token = jwt.encode(CLAIMS, 'first-secret', algorithm='HS256', headers={'kid': 'k9'})
+    with pytest.raises(jwt.InvalidTokenError, match="Unknown key id"):
+        keys.decode(token)
+
+
+def test_unknown_kid_reload_is_throttled(ring, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_keys.time, 'monotonic', lambda: now[0])
+    keys = SessionKeys(SECRET, keyring_path=str(ring), reload_interval=3600)
+    reads = []
+    fingerprint = keys._ring_fingerprint
+    monkeypatch.setattr(keys, '_ring_fingerprint', lambda: reads.append(1) or fingerprint())
+    token = forged({'alg': 'HS256', 'kid': 'attacker'})
+    for _ in range(50):
+        with pytest.raises(jwt.InvalidTokenError):
+            keys.decode(token)
+    assert len(reads) == 1
+    now[0] += session_keys.UNKNOWN_KID_RELOAD_INTERVAL
+    with pytest.raises(jwt.InvalidTokenError):
+        keys.decode(token)
+    assert len(reads) == 2
+
+
+def test_key_rotation(ring):
+    worker = SessionKeys(SECRET, keyring_path=str(ring), reload_interval=0)
+    other_worker = SessionKeys(SECRET, keyring_path=str(ring), reload_interval=3600)
+    old_token = worker.sign(CLAIMS)
+    assert worker.kid == 'k1'
+
+    # A new, newer key signs from now on; the old key still verifies
+    write_private_key(str(ring / 'k2.pem'), mtime=time.time())
+    new_token = worker.sign(CLAIMS)
+    assert worker.kid == 'k2'
+    assert jwt.get_unverified_header(new_token)['kid'] == 'k2'
+    assert worker.decode(old_token) == CLAIMS
+    assert [jwk['kid'] for jwk in worker.jwks()['keys']] == ['k2']
+    # Another worker that has not reached its reload interval picks up the new kid on first sight
+    assert other_worker.decode(new_token) == CLAIMS
+
+    # Retiring the old key ends its sessions
+    os.remove(ring / 'k1')
+    with pytest.raises(jwt.InvalidTokenError, match="Unknown key id"):
+        worker.decode(old_token)
+    assert worker.decode(new_token) == CLAIMS
+
+
+def test_broken_ring_keeps_current_keys(ring):
+    keys = SessionKeys(SECRET, keyring_path=str(ring), reload_interval=0)
+    token = keys.sign(CLAIMS)
+    os.remove(ring / 'k1')
+    (ring / 'k2.pem').write_text("-----BEGIN PUBLIC KEY-----\nnot a key\n-----END PUBLIC KEY-----\n")
+    assert keys.decode(token) == CLAIMS
+    assert keys.kid == 'k1'
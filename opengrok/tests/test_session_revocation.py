@@ -0,0 +1,194 @@
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import session_revocation
+from session_revocation import FULL_SWEEP_BACKOFF, RevocationFull, RevocationStore, session_key
+
+MAX_AGE = 3600
+fork = multiprocessing.get_context('fork')
+
+
+@pytest.fixture
+def store():
+    return RevocationStore(MAX_AGE, slots=1024, path='')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controllable time.time for the revocation module"""
+    now = [time.time()]
+    monkeypatch.setattr(session_revocation.time, 'time', lambda: now[0])
+    return now
+
+
+def test_revoke_session(store):
+    now = int(time.time())
+    assert not store.is_revoked('alice', now, 'a1')
+    store.revoke_session('alice', now, 'a1')
+    assert store.is_revoked('alice', now, 'a1')
+    # Another login of the same user in the same second has its own sid
+    assert not store.is_revoked('alice', now, 'a2')
+    assert not store.is_revoked('bob', now, 'a1')
+    assert store.stats()['sessions_revoked'] == 1
+
+
+def test_tokens_without_sid(store):
+    now = int(time.time())
+    store.revoke_session('alice', now)
+    assert store.is_revoked('alice', now)
+    assert not store.is_revoked('alice', now, 'a1')
+    assert session_key('alice', now) == session_key('alice', now, '')
+
+
+def test_revoke_user(store):
+    now = int(time.time())
+    store.revoke_user('alice', now)
+    assert store.is_revoked('alice', now - 100, 'a1')
+    assert store.is_revoked('alice', now, 'a2')
+    assert not store.is_revoked('alice', now + 1, 'a3')
+    # A later revocation moves the cut-off forward, never back
+    store.revoke_user('alice', now - 500)
+    assert store.is_revoked('alice', now, 'a2')
+
+
+def test_changed_and_sequence(store):
+    assert not store.changed()
+    sequence = store.sequence()
+    store.revoke_session('alice', int(time.time()), 'a1')
+    assert store.sequence() == sequence + 2
+    assert store.changed()
+    assert not store.changed()
+
+
+def test_entries_expire(store, clock):
+    now = int(clock[0])
+    store.revoke_session('alice', now, 'a1')
+    store.revoke_user('bob', now)
+    clock[0] += MAX_AGE + 1
+    assert not store.is_revoked('alice', now, 'a1')
+    assert not store.is_revoked('bob', now, 'b1')
+
+
+def test_sweep_drops_expired_entries(clock):
+    store = RevocationStore(MAX_AGE, slots=64, path='', sweep_interval=600)
+    now = int(clock[0])
+    for n in range(20):
+        store.revoke_session(f"user{n}", now, 's')
+    first_sweep = store.stats()['last_sweep']
+    clock[0] += MAX_AGE + 600
+    store.revoke_session('late', int(clock[0]), 's')
+    assert store.stats()['last_sweep'] > first_sweep
+    assert store.is_revoked('late', int(clock[0]), 's')
+    # Rebuilt from live entries only: expired keys are gone from the table and the Bloom filter
+    assert not any(store._in_bloom(session_key(f"user{n}", now, 's')) for n in range(20))
+    assert store._find(store._sessions, session_revocation._SESSION, session_key('user0', now, 's'))[1] is None
+
+
+def test_full_user_table_raises(clock):
+    store = RevocationStore(MAX_AGE, slots=8, path='')
+    now = int(clock[0])
+    for n in range(8):
+        store.revoke_user(f"user{n}", now)
+    with pytest.raises(RevocationFull):
+        store.revoke_user('one-too-many', now)
+    # Past the backoff a full table is swept again, but live entries still leave no room
+    clock[0] += FULL_SWEEP_BACKOFF + 1
+    with pytest.raises(RevocationFull):
+        store.revoke_user('one-too-many', now)
+    assert all(store.is_revoked(f"user{n}", now, 's') for n in range(8))
+
+
+def test_full_session_table_revokes_user(clock):
+    store = RevocationStore(MAX_AGE, slots=8, path='')
+    now = int(clock[0])
+    for n in range(8):
+        store.revoke_session('alice', now - n, f"s{n}")
+    store.revoke_session('bob', now, 'b1')
+    assert store.stats()['users_revoked'] == 1
+    assert store.is_revoked('bob', now - 10, 'b0')
+    assert not store.is_revoked('bob', now + 1, 'b2')
+
+
+def test_concurrent_readers_and_writers(store):
+    now = int(time.time())
+    revoked = []
+    errors = []
+    done = threading.Event()
+
+    def writer(prefix):
+        for n in range(150):
+            store.revoke_session(f"{prefix}{n}", now, 's')
+            revoked.append(f"{prefix}{n}")
+
+    def reader():
+        n = 0
+        while not done.is_set():
+            if revoked and not store.is_revoked(revoked[n % len(revoked)], now, 's'):
+                errors.append(revoked[n % len(revoked)])
+            if store.is_revoked(f"never{n}", now, 's'):
+                errors.append(f"never{n}")
+            n += 1
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    writers = [threading.Thread(target=writer, args=(prefix,)) for prefix in 'abcd']
+    for thread in readers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    done.set()
+    for thread in readers:
+        thread.join()
+    assert errors == []
+    assert store.stats()['sessions_revoked'] == 600
+    assert all(store.is_revoked(username, now, 's') for username in revoked)
+
+
+def _revoke_many(store, prefix, now, count):
+    for n in range(count):
+        store.revoke_session(f"{prefix}{n}", now, 's')
+
+
+def test_forked_workers_share_anonymous_store(store):
+    # Like gunicorn --preload: the store is created before the workers fork
+    now = int(time.time())
+    workers = [fork.Process(target=_revoke_many, args=(store, prefix, now, 100)) for prefix in 'ab']
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(10)
+        assert worker.exitcode == 0
+    assert store.changed()
+    assert all(store.is_revoked(f"{prefix}{n}", now, 's') for prefix in 'ab' for n in range(100))
+    assert store.stats()['sessions_revoked'] == 200
+
+
+def _open_and_revoke(path, prefix, now, count):
+    _revoke_many(RevocationStore(MAX_AGE, slots=1024, path=path), prefix, now, count)
+
+
+def test_file_backed_store_across_processes(tmp_path):
+    path = str(tmp_path / 'revocations')
+    store = RevocationStore(MAX_AGE, slots=1024, path=path)
+    now = int(time.time())
+    # Separate processes opening the file themselves, writing at the same time
+    writers = [fork.Process(target=_open_and_revoke, args=(path, prefix, now, 100)) for prefix in 'abc']
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join(10)
+        assert writer.exitcode == 0
+    assert all(store.is_revoked(f"{prefix}{n}", now, 's') for prefix in 'abc' for n in range(100))
+    assert store.stats()['sessions_revoked'] == 300
+    # And a restart reads them back
+    reopened = RevocationStore(MAX_AGE, slots=1024, path=path)
+    assert reopened.is_revoked('a0', now, 's')
+
+
+def test_file_layout_change_starts_empty(tmp_path):
+    path = str(tmp_path / 'revocations')
+    now = int(time.time())
+    RevocationStore(MAX_AGE, slots=1024, path=path).revoke_session('alice', now, 's')
+    assert not RevocationStore(MAX_AGE, slots=2048, path=path).is_revoked('alice', now, 's')
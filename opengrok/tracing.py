@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Per-request tracing for the OpenGrok LDAP authentication services
+- Spans around each LDAP step and session token signing/verification
+- Server-Timing response header on request (X-Debug-Timing) or always
+- Structured, sampled log line with the span breakdown for slow requests
+
+A trace only exists while the middleware has one active for the current request;
+otherwise span() costs a context variable lookup and nothing is recorded.
+"""
+
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# off: never send Server-Timing, header: only when the request carries X-Debug-Timing, always: every response
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'off').lower()
+TRACE_HEADER = 'X-Debug-Timing'
+# Requests slower than this are logged with their spans, a sample of them if the rate is below 1.
+# Off (0) by default: when set, every request carries a trace and records its spans.
+SLOW_REQUEST_THRESHOLD_MS = float(os.getenv('SLOW_REQUEST_THRESHOLD_MS', '0'))
+SLOW_REQUEST_SAMPLE_RATE = float(os.getenv('SLOW_REQUEST_SAMPLE_RATE', '1.0'))
+
+_WSGI_TRACE_HEADER = 'HTTP_' + TRACE_HEADER.upper().replace('-', '_')
+_ASGI_TRACE_HEADER = TRACE_HEADER.lower().encode('latin-1')
+
+_current = contextvars.ContextVar('opengrok_trace', default=None)
+
+
+class Trace:
+    """Spans recorded for one request, as (name, offset from request start, duration) in seconds"""
+
+    __slots__ = ('start', 'spans')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.spans = []
+
+    def add(self, name, start, duration):
+        self.spans.append((name, start - self.start, duration))
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def server_timing(self):
+        """Server-Timing header value, spans in start order followed by the total so far"""
+        parts = [f"{name};dur={duration * 1000:.2f}" for name, _, duration in sorted(self.spans, key=lambda s: s[1])]
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ', '.join(parts)
+
+    def breakdown(self):
+        return [{"name": name, "start_ms": round(offset * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+                for name, offset, duration in sorted(self.spans, key=lambda s: s[1])]
+
+
+def current_trace():
+    return _current.get()
+
+
+def add_span(name, start, duration):
+    """Record an already measured span on the current request, if it is being traced"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, start, duration)
+
+
+class span:
+    """Context manager recording a named span on the current request: with span('jwt_verify'): ..."""
+
+    __slots__ = ('name', 'trace', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is not None:
+            self.trace.add(self.name, self.start, time.perf_counter() - self.start)
+        return False
+
+
+def _begin(header_present):
+    """Return (trace or None, emit Server-Timing) for a new request"""
+    emit = SERVER_TIMING == 'always' or (SERVER_TIMING == 'header' and header_present)
+    if not emit and not SLOW_REQUEST_THRESHOLD_MS:
+        return None, False
+    return Trace(), emit
+
+
+def _finish(trace, method, path, status):
+    elapsed_ms = trace.elapsed() * 1000
+    if not SLOW_REQUEST_THRESHOLD_MS or elapsed_ms < SLOW_REQUEST_THRESHOLD_MS:
+        return
+    if SLOW_REQUEST_SAMPLE_RATE < 1 and random.random() >= SLOW_REQUEST_SAMPLE_RATE:
+        return
+    logger.warning("slow_request " + json.dumps({
+        "method": method,
+        "path": path,
+        "status": status,
+        "duration_ms": round(elapsed_ms, 2),
+        "spans": trace.breakdown()
+    }))
+
+
+class TracingMiddleware:
+    """WSGI middleware that opens a trace per request and emits Server-Timing / slow-request logs"""
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        trace, emit = _begin(_WSGI_TRACE_HEADER in environ)
+        if trace is None:
+            return self.app(environ, start_response)
+
+        status = [500]
+
+        def traced_start_response(status_line, headers, exc_info=None):
+            status[0] = int(status_line.split(' ', 1)[0])
+            if emit:
+                headers = list(headers) + [('Server-Timing', trace.server_timing())]
+            return start_response(status_line, headers, exc_info)
+
+        token = _current.set(trace)
+        try:
+            return self.app(environ, traced_start_response)
+        finally:
+            _current.reset(token)
+            _finish(trace, environ.get('REQUEST_METHOD'), environ.get('PATH_INFO'), status[0])
+
+
+class ASGITracingMiddleware:
+    """ASGI counterpart of TracingMiddleware"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        trace, emit = _begin(any(name == _ASGI_TRACE_HEADER for name, _ in scope['headers']))
+        if trace is None:
+            return await self.app(scope, receive, send)
+
+        status = [500]
+
+        async def traced_send(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+                if emit:
+                    message = dict(message, headers=list(message.get('headers', [])) + [
+                        (b'server-timing', trace.server_timing().encode('latin-1'))])
+            await send(message)
+
+        token = _current.set(trace)
+        try:
+            await self.app(scope, receive, traced_send)
+        finally:
+            _current.reset(token)
+            _finish(trace, scope['method'], scope['path'], status[0])
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+Local replica of the LDAP user directory for the OpenGrok LDAP authentication services
+- Paged bulk load of LDAP_USER_BASE, then incremental refreshes by modifyTimestamp
+- Compact uid/mail -> (uid, DN, cn, mail) index, in memory or in a SQLite snapshot
+  that every gunicorn worker reads and only one of them (holding a file lock) writes
+- Group memberships from LDAP_GROUP_BASE as a reverse member -> groups map
+- Periodic full reloads pick up deleted entries, which modifyTimestamp cannot show
+"""
+
+import fcntl
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import ldap
+from ldap.controls import SimplePagedResultsControl
+
+logger = logging.getLogger(__name__)
+
+USER_ATTRIBUTES = ['uid', 'cn', 'mail', 'modifyTimestamp']
+GROUP_ATTRIBUTES = ['cn', 'member', 'uniqueMember', 'memberUid', 'modifyTimestamp']
+GROUP_FILTER = '(|(objectClass=groupOfNames)(objectClass=groupOfUniqueNames)(objectClass=posixGroup))'
+
+
+def _first(attributes, name):
+    """First value of an attribute as str, matching the name case-insensitively"""
+    for key, values in attributes.items():
+        if key.lower() == name and values:
+            return values[0].decode('utf-8')
+    return ''
+
+
+def paged_search(conn, base, filterstr, attributes, page_size):
+    """Run a subtree search with the simple paged results control and return every entry"""
+    control = SimplePagedResultsControl(True, size=page_size, cookie='')
+    entries = []
+    while True:
+        msgid = conn.search_ext(base, ldap.SCOPE_SUBTREE, filterstr, attributes, serverctrls=[control])
+        _, data, _, response_controls = conn.result3(msgid, all=1, timeout=conn.timeout)
+        entries.extend(entry for entry in data if entry[0])  # skip referrals
+        cookies = [c.cookie for c in response_controls or ()
+                   if c.controlType == SimplePagedResultsControl.controlType]
+        if not cookies or not cookies[0]:
+            return entries
+        control.cookie = cookies[0]
+
+
+def to_entry(dn, attributes):
+    """Compact (uid, dn, cn, mail) tuple from an LDAP search result"""
+    uid = _first(attributes, 'uid')
+    return uid, dn, _first(attributes, 'cn') or uid, _first(attributes, 'mail')
+
+
+def to_group(dn, attributes):
+    """(cn, dn, member keys) for a group; members are lower-cased DNs, or uid:<uid> for memberUid"""
+    members = set()
+    for key, values in attributes.items():
+        key = key.lower()
+        if key in ('member', 'uniquemember'):
+            members.update(value.decode('utf-8').lower() for value in values)
+        elif key == 'memberuid':
+            members.update('uid:' + value.decode('utf-8') for value in values)
+    return _first(attributes, 'cn'), dn, frozenset(members)
+
+
+class MemoryIndex:
+    """Per-process index; a full load builds new dicts and swaps them in"""
+
+    mode = 'memory'
+    entry = staticmethod(to_entry)
+
+    def __init__(self):
+        self._by_uid = {}
+        self._by_mail = {}
+        self.high_water = ''
+        self.synced_at = None
+
+    def replace(self, entries, high_water):
+        by_uid = {entry[0]: entry for entry in entries}
+        self._by_mail = {entry[3].lower(): entry[0] for entry in by_uid.values() if entry[3]}
+        self._by_uid = by_uid
+        self.high_water = high_water
+        self.synced_at = time.time()
+
+    def update(self, entries, high_water):
+        for entry in entries:
+            self._by_uid[entry[0]] = entry
+            if entry[3]:
+                self._by_mail[entry[3].lower()] = entry[0]
+        self.high_water = max(self.high_water, high_water)
+        self.synced_at = time.time()
+
+    def get(self, uid):
+        return self._by_uid.get(uid)
+
+    def get_by_mail(self, mail):
+        uid = self._by_mail.get(mail.lower())
+        return self._by_uid.get(uid) if uid else None
+
+    def uids(self):
+        return set(self._by_uid)
+
+    def state(self):
+        return self.high_water, self.synced_at
+
+    def __len__(self):
+        return len(self._by_uid)
+
+
+class SQLiteIndex:
+    """
+    Index stored in a SQLite file (WAL mode) so every worker on the host shares one copy.
+    Connections are opened per thread and re-opened after a fork.
+    """
+
+    mode = 'sqlite'
+    entry = staticmethod(to_entry)
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS users (uid TEXT PRIMARY KEY, dn TEXT, cn TEXT, mail TEXT, mail_key TEXT);
+            CREATE INDEX IF NOT EXISTS users_mail ON users (mail_key);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        """)
+
+    def _conn(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            local.pid = os.getpid()
+        return local.conn
+
+    def _write(self, entries, high_water, replace):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if replace:
+                conn.execute('DELETE FROM users')
+            conn.executemany('INSERT OR REPLACE INTO users VALUES (?, ?, ?, ?, ?)',
+                             [entry + (entry[3].lower(),) for entry in entries])
+            if not replace:
+                row = conn.execute("SELECT value FROM meta WHERE key = 'high_water'").fetchone()
+                high_water = max(row[0] if row else '', high_water)
+            conn.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)',
+                             [('high_water', high_water), ('synced_at', repr(time.time()))])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    def replace(self, entries, high_water):
+        self._write(entries, high_water, replace=True)
+
+    def update(self, entries, high_water):
+        self._write(entries, high_water, replace=False)
+
+    def get(self, uid):
+        return self._conn().execute('SELECT uid, dn, cn, mail FROM users WHERE uid = ?', (uid,)).fetchone()
+
+    def get_by_mail(self, mail):
+        return self._conn().execute('SELECT uid, dn, cn, mail FROM users WHERE mail_key = ?',
+                                    (mail.lower(),)).fetchone()
+
+    def uids(self):
+        return {row[0] for row in self._conn().execute('SELECT uid FROM users')}
+
+    def state(self):
+        meta = dict(self._conn().execute('SELECT key, value FROM meta').fetchall())
+        synced_at = meta.get('synced_at')
+        return meta.get('high_water', ''), float(synced_at) if synced_at else None
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+
+class GroupIndex:
+    """Per-process group index: group cn -> member keys, and the reverse member key -> group cns"""
+
+    mode = 'memory'
+    entry = staticmethod(to_group)
+
+    def __init__(self):
+        self._members = {}
+        self._by_member = {}
+        self.high_water = ''
+        self.synced_at = None
+
+    def replace(self, entries, high_water):
+        members = {cn: keys for cn, _, keys in entries}
+        by_member = {}
+        for cn, keys in members.items():
+            for key in keys:
+                by_member.setdefault(key, set()).add(cn)
+        self._by_member = {key: frozenset(groups) for key, groups in by_member.items()}
+        self._members = members
+        self.high_water = high_water
+        self.synced_at = time.time()
+
+    def update(self, entries, high_water):
+        by_member = dict(self._by_member)
+        for cn, _, keys in entries:
+            old = self._members.get(cn, frozenset())
+            for key in old - keys:
+                by_member[key] = by_member[key] - {cn}
+            for key in keys - old:
+                by_member[key] = by_member.get(key, frozenset()) | {cn}
+            self._members[cn] = keys
+        self._by_member = by_member
+        self.high_water = max(self.high_water, high_water)
+        self.synced_at = time.time()
+
+    def groups(self, dn, uid):
+        return self._by_member.get(dn.lower(), frozenset()) | self._by_member.get('uid:' + uid, frozenset())
+
+    def state(self):
+        return self.high_water, self.synced_at
+
+    def __len__(self):
+        return len(self._members)
+
+
+class UserDirectory:
+    """
+    Keeps an index of the users under base in sync with LDAP from a background thread.
+    search(filterstr) must return (dn, attributes) pairs for the whole subtree; the
+    index turns each into its compact entry.
+    With a SQLite index only the process holding <path>.lock syncs; the others read.
+    Lookups return None until the first full load has finished, so callers fall back
+    to searching LDAP themselves.
+    """
+
+    kind = 'users'
+
+    def __init__(self, search, index, object_filter='(objectClass=person)',
+                 refresh_interval=60, full_sync_interval=3600, on_lookup=None, on_removed=None):
+        self.search = search
+        self.index = index
+        self.object_filter = object_filter
+        self.refresh_interval = refresh_interval
+        self.full_sync_interval = full_sync_interval
+        self.on_lookup = on_lookup
+        # Called with the uids a full load no longer finds (users only)
+        self.on_removed = on_removed
+        self.full_syncs = 0
+        self.refreshes = 0
+        self.errors = 0
+        self.last_error = None
+        self._last_full_sync = None
+        self._lock_file = None
+        self._pid = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._lock_file = None
+            self._thread = threading.Thread(target=self._run, name=f"{self.kind}-directory", daemon=True)
+            self._thread.start()
+
+    def is_leader(self):
+        """True if this process is the one that writes the index"""
+        if not isinstance(self.index, SQLiteIndex):
+            return True
+        if self._lock_file is None:
+            lock_file = open(self.index.path + '.lock', 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self._lock_file = lock_file
+            logger.info(f"Process {os.getpid()} is syncing the {self.kind} directory to {self.index.path}")
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self.is_leader():
+                    self.sync()
+            except Exception as e:
+                self.errors += 1
+                self.last_error = str(e)
+                logger.warning(f"Local {self.kind} directory sync failed: {e}")
+            time.sleep(self.refresh_interval)
+
+    def sync(self):
+        """Full load when due (or never done), otherwise fetch entries modified since the last sync"""
+        high_water, synced_at = self.index.state()
+        full_due = self._last_full_sync is None or time.monotonic() - self._last_full_sync >= self.full_sync_interval
+        if synced_at is None or not high_water or full_due:
+            self.full_sync()
+        else:
+            self.refresh(high_water)
+
+    def _fetch(self, filterstr):
+        results = self.search(filterstr)
+        entries = [self.index.entry(dn, attributes) for dn, attributes in results]
+        entries = [entry for entry in entries if entry[0]]
+        high_water = max((_first(attributes, 'modifytimestamp') for _, attributes in results), default='')
+        return entries, high_water
+
+    def full_sync(self):
+        start = time.monotonic()
+        entries, high_water = self._fetch(self.object_filter)
+        previous = self.index.uids() if self.on_removed is not None else set()
+        self.index.replace(entries, high_water)
+        self._last_full_sync = time.monotonic()
+        self.full_syncs += 1
+        logger.info(f"Loaded {len(entries)} {self.kind} into the local directory in {time.monotonic() - start:.2f}s")
+        removed = previous - {entry[0] for entry in entries}
+        if len(removed) > len(previous) // 2:
+            # More likely a wrong base or filter than a mass departure
+            logger.warning(f"{len(removed)} of {len(previous)} {self.kind} vanished from LDAP; "
+                           f"not treating them as removed")
+        elif removed:
+            self.on_removed(removed)
+
+    def refresh(self, high_water):
+        # >= so entries changed within the same second as the last sync are not missed
+        filterstr = f"(&{self.object_filter}(modifyTimestamp>={high_water}))"
+        entries, new_high_water = self._fetch(filterstr)
+        self.index.update(entries, new_high_water or high_water)
+        self.refreshes += 1
+        if entries:
+            logger.info(f"Refreshed {len(entries)} changed {self.kind} in the local directory")
+
+    def _ready(self):
+        self.ensure_started()
+        return self.index.state()[1] is not None
+
+    def _lookup(self, entry):
+        if self.on_lookup is not None:
+            self.on_lookup(entry is not None)
+        if entry is None:
+            return None
+        uid, dn, cn, mail = entry
+        # Same shape as an LDAP search result, so callers need not care where it came from
+        attributes = {'cn': [cn.encode('utf-8')]}
+        if mail:
+            attributes['mail'] = [mail.encode('utf-8')]
+        return dn, attributes
+
+    def lookup(self, uid):
+        """(dn, attributes) for uid, or None if unknown or the directory is not loaded yet"""
+        if not self._ready():
+            return None
+        return self._lookup(self.index.get(uid))
+
+    def lookup_mail(self, mail):
+        """(dn, attributes) for the user with this mail address, or None"""
+        if not self._ready():
+            return None
+        return self._lookup(self.index.get_by_mail(mail))
+
+    def stats(self):
+        high_water, synced_at = self.index.state()
+        return {
+            "mode": self.index.mode,
+            "users": len(self.index),
+            "ready": synced_at is not None,
+            "last_sync_age": round(time.time() - synced_at, 1) if synced_at else None,
+            "high_water": high_water or None,
+            "syncing_process": self._lock_file is not None or not isinstance(self.index, SQLiteIndex),
+            "full_syncs": self.full_syncs,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "last_error": self.last_error
+        }
+
+
+class GroupDirectory(UserDirectory):
+    """UserDirectory over a GroupIndex, answering which groups list a user as a member"""
+
+    kind = 'groups'
+
+    def __init__(self, search, index=None, object_filter=GROUP_FILTER, **options):
+        super().__init__(search, index or GroupIndex(), object_filter=object_filter, **options)
+
+    def groups(self, dn, uid):
+        """cn of every group listing dn or uid, or None if the directory is not loaded yet"""
+        if not self._ready():
+            return None
+        return self.index.groups(dn, uid)
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Warm-start snapshot for the OpenGrok LDAP authentication services
+Recently active users (uid, DN, cn, mail and group cn, never passwords or tokens) are
+written to a compact binary file every few minutes and when a worker exits. A new
+process loads it before serving, so the first logins after a restart or redeploy find
+their DN and groups locally instead of all searching LDAP while the directory replica
+is still loading. Loaded entries keep the time they were last seen: anything older than
+the caches' ttl is served once and refreshed in the background.
+
+File layout (little-endian):
+  header   magic "OGWS", version, created (f64), source hash (8 bytes), group count, record count
+  groups   group cn table, each a u16 length and UTF-8 bytes
+  records  seen (f64), uid, dn, cn, mail (u16 length + UTF-8 each),
+           group count (u16, 0xffff if unknown) and that many u16 indexes into the group table
+"""
+
+import atexit
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'OGWS'
+VERSION = 1
+_HEADER = struct.Struct('<4sBd8sII')
+_SEEN = struct.Struct('<d')
+_LENGTH = struct.Struct('<H')
+NO_GROUPS = 0xffff
+
+
+def _pack_text(text):
+    data = text.encode('utf-8')[:0xfffe]
+    return _LENGTH.pack(len(data)) + data
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.offset = 0
+
+    def unpack(self, layout):
+        values = layout.unpack_from(self.data, self.offset)
+        self.offset += layout.size
+        return values
+
+    def text(self):
+        length, = self.unpack(_LENGTH)
+        data = self.data[self.offset:self.offset + length]
+        if len(data) != length:
+            raise ValueError("Truncated snapshot")
+        self.offset += length
+        return data.decode('utf-8')
+
+
+def encode_snapshot(records, source, created=None):
+    """Binary snapshot of records {uid: (seen, dn, cn, mail, groups or None)}"""
+    groups = sorted({group for *_, member_of in records.values() if member_of for group in member_of})
+    index = {group: i for i, group in enumerate(groups)}
+    parts = [_HEADER.pack(MAGIC, VERSION, created or time.time(), source, len(groups), len(records))]
+    parts.extend(_pack_text(group) for group in groups)
+    for uid, (seen, dn, cn, mail, member_of) in records.items():
+        parts.append(_SEEN.pack(seen))
+        parts.extend(_pack_text(value or '') for value in (uid, dn, cn, mail))
+        if member_of is None:
+            parts.append(_LENGTH.pack(NO_GROUPS))
+        else:
+            parts.append(struct.pack(f'<H{len(member_of)}H', len(member_of), *(index[group] for group in member_of)))
+    return b''.join(parts)
+
+
+def decode_snapshot(data):
+    """(created, source, records) from encode_snapshot output; raises ValueError if it is not one"""
+    try:
+        reader = _Reader(data)
+        magic, version, created, source, group_count, record_count = reader.unpack(_HEADER)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a warm-start snapshot")
+        groups = [reader.text() for _ in range(group_count)]
+        records = {}
+        for _ in range(record_count):
+            seen, = reader.unpack(_SEEN)
+            uid, dn, cn, mail = (reader.text() for _ in range(4))
+            count, = reader.unpack(_LENGTH)
+            member_of = None
+            if count != NO_GROUPS:
+                member_of = [groups[i] for i in reader.unpack(struct.Struct(f'<{count}H'))]
+            records[uid] = (seen, dn, cn, mail, member_of)
+        return created, source, records
+    except (struct.error, IndexError, UnicodeDecodeError) as e:
+        raise ValueError(f"Corrupt snapshot: {e}")
+
+
+class WarmStart:
+    """
+    Tracks recently active users in this process and merges them into a snapshot file
+    shared by every worker (the file is locked and replaced atomically)
+    """
+
+    def __init__(self, path, source, max_users=5000, max_age=86400, interval=300):
+        self.path = path
+        # Snapshots written for another directory are ignored
+        self.source = hashlib.sha256(source.encode('utf-8')).digest()[:8]
+        self.max_users = max_users
+        self.max_age = max_age
+        self.interval = interval
+        self.loaded = 0
+        self.saved = 0
+        self.last_save = None
+        self.last_error = None
+        # uid -> record, least recently active first
+        self._active = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._pid = None
+        self._start_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def record(self, uid, dn, cn, mail, groups=None):
+        """Remember a user that just authenticated (groups None when memberships are not looked up)"""
+        record = (time.time(), dn, cn, mail, sorted(groups) if groups is not None else None)
+        with self._lock:
+            self._active.pop(uid, None)
+            self._active[uid] = record
+            if len(self._active) > self.max_users:
+                self._active.popitem(last=False)
+            self._dirty = True
+        self.ensure_started()
+
+    def _read(self):
+        with open(self.path, 'rb') as f:
+            created, source, records = decode_snapshot(f.read())
+        if source != self.source:
+            raise ValueError("Snapshot was written for another directory")
+        age = time.time() - created
+        if age > self.max_age:
+            raise ValueError(f"Snapshot is {age:.0f}s old")
+        cutoff = time.time() - self.max_age
+        return {uid: record for uid, record in records.items() if record[0] >= cutoff}
+
+    def load(self):
+        """Records {uid: (seen, dn, cn, mail, groups)} from the snapshot, or {} if it is missing, stale or corrupt"""
+        start = time.monotonic()
+        try:
+            records = self._read()
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.last_error = str(e)
+            logger.warning(f"Ignoring warm-start snapshot {self.path}: {e}")
+            return {}
+        self.loaded = len(records)
+        logger.info(f"Loaded {len(records)} users from warm-start snapshot in {(time.monotonic() - start) * 1000:.1f}ms")
+        return records
+
+    def save(self):
+        """Merge this process's active users into the snapshot file"""
+        if not self._dirty:
+            return
+        with self._write_lock:
+            with self._lock:
+                self._dirty = False
+                active = dict(self._active)
+            try:
+                with open(f"{self.path}.lock", 'w') as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                    try:
+                        records = self._read()
+                    except (OSError, ValueError):
+                        records = {}
+                    for uid, record in active.items():
+                        if uid not in records or records[uid][0] <= record[0]:
+                            records[uid] = record
+                    newest = sorted(records.items(), key=lambda item: item[1][0], reverse=True)[:self.max_users]
+                    data = encode_snapshot(dict(newest), self.source)
+                    temporary = f"{self.path}.{os.getpid()}.tmp"
+                    with open(temporary, 'wb') as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(temporary, self.path)
+                self.saved += 1
+                self.last_save = time.time()
+                self.last_error = None
+                logger.debug(f"Wrote {len(newest)} users ({len(data)} bytes) to {self.path}")
+            except OSError as e:
+                self._dirty = True
+                self.last_error = str(e)
+                logger.warning(f"Failed to write warm-start snapshot {self.path}: {e}")
+
+    def ensure_started(self):
+        """Start this process's periodic writer (and exit hook) once"""
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, name='warm-start', daemon=True).start()
+            atexit.register(self.save)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.save()
+
+    def stats(self):
+        return {
+            "file": self.path,
+            "loaded": self.loaded,
+            "active": len(self._active),
+            "saved": self.saved,
+            "last_save": self.last_save,
+            "last_error": self.last_error
+        }